@@ -0,0 +1,105 @@
+"""
+Provider payload decoding: json.loads + dict picking vs. typed projections.
+
+    python -m benchmarks.bench_decode [repeat]
+"""
+import json
+import sys
+import timeit
+
+import httpx
+
+from utils.schemas import DeezerTrackList, SpotifyTopTracks, decode
+
+
+def _deezer_top_payload(n=100):
+    # roughly the shape of /artist/{id}/top, including the fields we ignore
+    return {
+        "data": [
+            {
+                "id": 3135556 + i, "readable": True, "title": f"Track {i}", "title_short": f"Track {i}",
+                "title_version": "", "link": f"https://www.deezer.com/track/{i}", "duration": 200 + i,
+                "rank": 900000 - i, "explicit_lyrics": False, "explicit_content_lyrics": 0,
+                "explicit_content_cover": 0, "preview": f"https://cdns-preview-d.dzcdn.net/stream/{i}.mp3",
+                "contributors": [{"id": 27, "name": "Artist", "link": "https://www.deezer.com/artist/27",
+                                  "picture": "p", "picture_small": "ps", "picture_medium": "pm",
+                                  "picture_big": "pb", "picture_xl": "px", "role": "Main"}],
+                "md5_image": "2e018122cb56986277102d2041a592c8",
+                "artist": {"id": 27, "name": "Artist", "tracklist": "https://api.deezer.com/artist/27/top?limit=50",
+                           "type": "artist"},
+                "album": {"id": 302127, "title": "Album", "cover": "c", "cover_small": "cs",
+                          "cover_medium": "cm", "cover_big": "cb", "cover_xl": "cx",
+                          "md5_image": "2e018122cb56986277102d2041a592c8",
+                          "tracklist": "https://api.deezer.com/album/302127/tracks", "type": "album"},
+                "type": "track",
+            }
+            for i in range(n)
+        ]
+    }
+
+
+def _spotify_top_payload(n=10):
+    artist = {"external_urls": {"spotify": "https://open.spotify.com/artist/x"}, "href": "h", "id": "x",
+              "name": "Artist", "type": "artist", "uri": "spotify:artist:x"}
+    album = {"album_type": "album", "artists": [artist] * 3, "available_markets": ["US", "NL", "DE"] * 60,
+             "external_urls": {"spotify": "a"}, "href": "h", "id": "alb",
+             "images": [{"height": s, "url": f"https://i.scdn.co/image/{s}", "width": s} for s in (640, 300, 64)],
+             "name": "Album", "release_date": "2020-01-01", "release_date_precision": "day",
+             "total_tracks": 12, "type": "album", "uri": "spotify:album:alb"}
+    return {
+        "tracks": [
+            {"album": album, "artists": [artist] * 2, "available_markets": ["US", "NL"] * 90,
+             "disc_number": 1, "duration_ms": 200000, "explicit": False, "external_ids": {"isrc": "X"},
+             "external_urls": {"spotify": f"https://open.spotify.com/track/{i}"}, "href": "h", "id": str(i),
+             "is_local": False, "name": f"Track {i}", "popularity": 70, "preview_url": None,
+             "track_number": i, "type": "track", "uri": f"spotify:track:{i}"}
+            for i in range(n)
+        ]
+    }
+
+
+def _response(payload):
+    return httpx.Response(200, content=json.dumps(payload).encode(),
+                          request=httpx.Request("GET", "https://bench.invalid/"))
+
+
+def _old_deezer(r):
+    return [(t["title"], t["artist"]["name"], t["duration"], t["album"]["cover_big"], t.get("preview"), t["link"])
+            for t in r.json().get("data", [])[:20]]
+
+
+def _new_deezer(r):
+    return [(t.title, t.artist.name, t.duration, t.album.cover_big, t.preview, t.link)
+            for t in decode(r, DeezerTrackList).data[:20]]
+
+
+def _old_spotify(r):
+    return [(t["name"], t["artists"][0]["name"], t["duration_ms"],
+             t["album"]["images"][0]["url"] if t["album"]["images"] else None, t["external_urls"]["spotify"])
+            for t in r.json().get("tracks", [])]
+
+
+def _new_spotify(r):
+    return [(t.name, t.artists[0].name, t.duration_ms,
+             t.album.images[0].url if t.album.images else None, t.external_urls.spotify)
+            for t in decode(r, SpotifyTopTracks).tracks]
+
+
+def main(repeat=200):
+    cases = [
+        ("deezer /artist/top (100 tracks)", _deezer_top_payload(), _old_deezer, _new_deezer),
+        ("spotify /top-tracks (10 tracks)", _spotify_top_payload(), _old_spotify, _new_spotify),
+    ]
+    for name, payload, old, new in cases:
+        # .json() caches nothing on httpx.Response, so reuse is a fair comparison
+        r = _response(payload)
+        assert old(r) == new(r)
+        t_old = min(timeit.repeat(lambda: old(r), number=repeat, repeat=5)) / repeat
+        t_new = min(timeit.repeat(lambda: new(r), number=repeat, repeat=5)) / repeat
+        print(f"{name} ({len(r.content) / 1024:.0f} KiB)")
+        print(f"  json + dict picking: {t_old * 1e6:8.1f} us")
+        print(f"  typed projection:    {t_new * 1e6:8.1f} us  ({t_old / t_new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,317 @@
+"""
+Regression guard for the CPU-side code every request runs.
+
+    python -m benchmarks.bench_hot_paths [--sizes 10000,100000,1000000] [--only merge_tracks,...]
+    python -m benchmarks.bench_hot_paths --update-baseline
+
+Each case runs on synthetic candidate sets of each size. The suite records
+the median wall time and the tracemalloc peak. Each timed run follows a run
+of a reference case (plain dict/str work that touches no code from this
+repo), and the case is scored by the median of those per-pair ratios, so
+benchmarks/baseline.json holds "relative" times that carry over between
+machines and shrug off load that comes and goes. The suite exits 1 if any
+case got slower relative to the reference by more than --threshold, or
+allocates more than the baseline by more than --alloc-threshold. Sizes
+whose reference runs in under MIN_REFERENCE_SECONDS are reported but not
+compared; absolute "seconds" are stored for reading only.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from endpoints.feeling_lucky import _to_track, _track_key
+from utils.make import make_track
+from utils.merge import combine_and_deduplicate_tracks, merge_tracks, pull_tracks
+from utils.normalize import get_all_recommended_artists, normalize_artist_entry
+from utils.providers import Provider
+from utils.spotify import CANONICAL_MAP, MOOD_TO_GENRES, SPOTIFY_GENRE_SEEDS, _pick_seed_genres
+from utils.track import SOURCE_FLAGS, Track
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+# below this a timing is mostly timer and scheduler noise
+MIN_REFERENCE_SECONDS = 0.005
+# share of candidates that duplicate an earlier one, as seen across providers
+DUPLICATE_SHARE = 0.3
+
+
+def _unique(n):
+    return max(1, int(n * (1 - DUPLICATE_SHARE)))
+
+
+def _tracks(n, seed=0):
+    rng = random.Random(seed)
+    flags = list(SOURCE_FLAGS.values())[:4]
+    u = _unique(n)
+    out = []
+    for i in range(n):
+        k = rng.randrange(u)
+        out.append(Track(
+            f"Song {k}",
+            f"Artist {k % 997}",
+            duration_ms=180_000 + k,
+            cover_url=f"https://img.example/{k}.jpg" if i % 3 else None,
+            spotify_url=f"https://open.spotify.com/track/{k}" if i % 2 else None,
+            deezer_url=f"https://www.deezer.com/track/{k}" if i % 5 else None,
+            sources=rng.choice(flags),
+        ))
+    return out
+
+
+def _track_dicts(n):
+    return [
+        {**make_track(t), "cover": t.cover_url}
+        for t in _tracks(n)
+    ]
+
+
+def _artists(n):
+    u = _unique(n)
+    return [
+        {
+            "name": f"Artist {i % u}",
+            "image_url": f"https://img.example/a{i}.jpg",
+            "genres": ["rock", "indie"],
+            "links": {"spotify": f"https://open.spotify.com/artist/{i}"},
+            "source": "Spotify",
+        }
+        for i in range(n)
+    ]
+
+
+def _spotify_items(n):
+    u = _unique(n)
+    return [
+        {
+            "id": str(i),
+            "name": f"Song {i % u}",
+            "artists": [{"id": f"a{i % 997}", "name": f"Artist {i % 997}"}],
+            "album": {"images": [{"url": f"https://i.scdn.co/{i}/640"}, {"url": f"https://i.scdn.co/{i}/300"}]},
+            "external_urls": {"spotify": f"https://open.spotify.com/track/{i}"},
+            "preview_url": None,
+        }
+        for i in range(n)
+    ]
+
+
+def _tags(n):
+    vocabulary = sorted(SPOTIFY_GENRE_SEEDS) + sorted(MOOD_TO_GENRES) + sorted(CANONICAL_MAP) + ["unknown tag"]
+    rng = random.Random(1)
+    return [rng.choice(vocabulary).upper() for _ in range(n)]
+
+
+# --- reference: the same kind of work as the cases, with none of the repo's code ---
+
+def _reference_setup(n):
+    u = _unique(n)
+    return [(f"Song {i % u}", f"Artist {i % 997}", i) for i in range(n)]
+
+
+def _run_reference(rows):
+    seen = {}
+    for title, artist, i in rows:
+        key = (title.lower(), artist.lower())
+        if key not in seen:
+            seen[key] = json.dumps({"title": title, "artist": artist, "url": f"https://example.com/{i}"})
+
+
+# --- cases: name -> (setup(n) -> input, run(input)) ---
+
+def _run_merge(tracks):
+    merge_tracks(tracks)
+
+
+def _run_combine(dicts):
+    combine_and_deduplicate_tracks(dicts)
+
+
+def _run_make_track(tracks):
+    for t in tracks:
+        make_track(t)
+
+
+def _run_normalize(artists):
+    seen = set()
+    for a in artists:
+        normalize_artist_entry(a, seen)
+
+
+def _related_artists_setup(n):
+    artists = _artists(n)
+    chunk = max(1, n // 4)
+
+    def adapter(part):
+        async def related(ctx):
+            return part
+        return related
+
+    return [Provider(f"p{i}", related_artists=adapter(artists[i * chunk:(i + 1) * chunk])) for i in range(4)]
+
+
+def _run_related_artists(providers):
+    asyncio.run(get_all_recommended_artists("Seed", None, None, {}, None, None, providers))
+
+
+def _pull_setup(n):
+    tracks = _tracks(n)
+    return [tracks[i::4] for i in range(4)]
+
+
+def _run_pull(parts):
+    async def stream(part):
+        for t in part:
+            yield t
+
+    want = sum(map(len, parts)) // 2
+    asyncio.run(pull_tracks([stream(p) for p in parts], want))
+
+
+def _run_pick_seed_genres(tags):
+    # called per request with a handful of tags; slice the set into request-sized calls
+    for i in range(0, len(tags), 8):
+        _pick_seed_genres(tags[i:i + 8])
+
+
+def _run_feeling_lucky(items):
+    seen = set()
+    for item in items:
+        key = _track_key(item)
+        if key not in seen:
+            seen.add(key)
+            _to_track(item)
+
+
+def _run_sse(tracks):
+    for t in tracks:
+        "data: " + json.dumps({"track": make_track(t)}) + "\n\n"
+
+
+CASES = {
+    "merge_tracks": (_tracks, _run_merge),
+    "combine_and_deduplicate_tracks": (_track_dicts, _run_combine),
+    "make_track": (_tracks, _run_make_track),
+    "normalize_artist_entry": (_artists, _run_normalize),
+    "get_all_recommended_artists": (_related_artists_setup, _run_related_artists),
+    "pull_tracks": (_pull_setup, _run_pull),
+    "pick_seed_genres": (_tags, _run_pick_seed_genres),
+    "feeling_lucky_key_and_track": (_spotify_items, _run_feeling_lucky),
+    "sse_track_events": (_tracks, _run_sse),
+}
+
+
+def _timed(run, data):
+    # like timeit: no collections mid-run, so earlier cases' garbage doesn't land on this one
+    gc.collect()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        run(data)
+        return time.perf_counter() - started
+    finally:
+        gc.enable()
+
+
+def _repeats(n):
+    return 9 if n <= 10_000 else 5 if n <= 100_000 else 3
+
+
+def measure(setup, run, n):
+    rows = _reference_setup(n)
+    references, times = [], []
+    for _ in range(_repeats(n)):
+        # alternate with the reference so each pair sees the same machine load
+        references.append(_timed(_run_reference, rows))
+        times.append(_timed(run, setup(n)))
+    ratios = [t / r for t, r in zip(times, references)]
+
+    data = setup(n)
+    tracemalloc.start()
+    try:
+        run(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "seconds": statistics.median(times),
+        "reference_seconds": statistics.median(references),
+        "relative": statistics.median(ratios),
+        "peak_bytes": peak,
+    }
+
+
+def _timeable(result):
+    return result.get("reference_seconds", 0) >= MIN_REFERENCE_SECONDS
+
+
+def compare(results, baseline, threshold, alloc_threshold):
+    regressions = []
+    for key, now in results.items():
+        before = baseline.get(key)
+        if not before or "relative" not in before:
+            continue
+        timeable = _timeable(before) and _timeable(now)
+        if timeable and now["relative"] > before["relative"] * (1 + threshold):
+            regressions.append(f"{key}: {before['relative']:.2f}x -> {now['relative']:.2f}x reference")
+        if now["peak_bytes"] > before["peak_bytes"] * (1 + alloc_threshold):
+            regressions.append(f"{key}: peak {before['peak_bytes']:,} B -> {now['peak_bytes']:,} B")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--only", help="comma-separated case names")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="allowed slowdown relative to the reference case (0.5 = 50%%)")
+    parser.add_argument("--alloc-threshold", type=float, default=0.10, help="allowed growth of the allocation peak")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    names = args.only.split(",") if args.only else list(CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+
+    results = {}
+    print(f"{'case':34} {'n':>9} {'time':>11} {'per item':>10} {'vs ref':>8} {'peak alloc':>14}")
+    for name in names:
+        setup, run = CASES[name]
+        for n in sizes:
+            r = results[f"{name}/{n}"] = measure(setup, run, n)
+            print(f"{name:34} {n:>9,} {r['seconds'] * 1e3:>9.2f}ms {r['seconds'] / n * 1e9:>8.0f}ns "
+                  f"{r['relative']:>7.2f}x {r['peak_bytes']:>12,} B")
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --update-baseline first")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold, args.alloc_threshold)
+    for line in regressions:
+        print("REGRESSION", line)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
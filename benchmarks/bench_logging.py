@@ -0,0 +1,70 @@
+"""
+What logging costs the code that logs, per event.
+
+    python -m benchmarks.bench_logging [--events 20000] > /dev/null
+    python -m benchmarks.bench_logging | (sleep 3; cat > /dev/null)   # a reader that falls behind
+
+Compares the print() calls the request path used to make with log.info()
+and log.sampled() from utils.log, for the same per-track event. Only the
+caller's side is timed: print() writes (and, on a slow pipe, waits) before
+returning, while the logger only queues the record for the listener thread.
+Records go to stdout, so redirect it; results are written to stderr.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("LOG_FORMAT", "json")
+
+from utils.log import get_logger  # noqa: E402
+
+log = get_logger("bench")
+
+
+def _print(i):
+    print(f"[Last.fm URL] Song {i} -> https://www.last.fm/music/Artist+{i % 97}/_/Song+{i}", flush=True)
+
+
+def _info(i):
+    log.info("Track enriched", title=f"Song {i}", lastfm_url=f"https://www.last.fm/music/Artist+{i % 97}/_/Song+{i}")
+
+
+def _sampled(i):
+    log.sampled("Track enriched", title=f"Song {i}", lastfm_url=f"https://www.last.fm/music/Artist+{i % 97}/_/Song+{i}")
+
+
+CASES = {"print": _print, "log.info": _info, "log.sampled": _sampled}
+
+
+def run(fn, events):
+    times = []
+    for i in range(events):
+        start = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        "mean_us": statistics.fmean(times) * 1e6,
+        "p50_us": times[len(times) // 2] * 1e6,
+        "p99_us": times[int(len(times) * 0.99)] * 1e6,
+        "max_ms": times[-1] * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=20_000)
+    args = parser.parse_args()
+
+    for name, fn in CASES.items():
+        result = run(fn, args.events)
+        # let the listener drain so one case's backlog doesn't slow the next
+        time.sleep(0.5)
+        print(f"{name:<12} mean {result['mean_us']:7.2f} us  p50 {result['p50_us']:7.2f} us  "
+              f"p99 {result['p99_us']:7.2f} us  max {result['max_ms']:8.2f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+CI check: no hot path may hold the event loop longer than a threshold.
+
+    python -m benchmarks.bench_loop_lag [--size 2000] [--threshold-ms 50] [--only merge_tracks,...]
+
+Each case runs on a request-sized synthetic input inside a running event
+loop with utils.loopwatch probing it every millisecond. Synchronous steps
+are called straight from a coroutine, as the request path calls them.
+Async steps are awaited, so only their longest stretch between awaits
+counts. The check exits 1 if any case kept the loop busy past the threshold,
+and prints the stack the watchdog captured while the loop was blocked.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+import httpx
+
+from benchmarks.bench_decode import _deezer_top_payload
+from benchmarks.bench_hot_paths import _artists, _pull_setup, _related_artists_setup, _spotify_items, _tracks
+from endpoints.feeling_lucky import _to_track, _track_key
+from utils.loopwatch import LoopWatch
+from utils.make import make_track
+from utils.merge import combine_and_deduplicate_tracks, merge_tracks, pull_tracks
+from utils.normalize import get_all_recommended_artists, normalize_artist_entry
+from utils.schemas import DeezerTrackList, decode
+
+
+# --- cases: name -> (setup(n) -> input, async run(input)) ---
+
+async def _merge(tracks):
+    merge_tracks(tracks)
+
+
+async def _combine(tracks):
+    combine_and_deduplicate_tracks([make_track(t) for t in tracks])
+
+
+async def _sse_page(tracks):
+    for t in tracks:
+        "data: " + json.dumps({"track": make_track(t)}) + "\n\n"
+
+
+async def _normalize(artists):
+    seen = set()
+    for a in artists:
+        normalize_artist_entry(a, seen)
+
+
+async def _related(providers):
+    await get_all_recommended_artists("Seed", None, None, {}, None, None, providers)
+
+
+async def _pull(parts):
+    async def stream(part):
+        for t in part:
+            yield t
+            await asyncio.sleep(0)
+
+    await pull_tracks([stream(p) for p in parts], sum(map(len, parts)) // 2)
+
+
+def _payload_setup(n):
+    body = json.dumps(_deezer_top_payload(n)).encode()
+    return httpx.Response(200, content=body, request=httpx.Request("GET", "https://api.deezer.com/artist/1/top"))
+
+
+async def _decode(response):
+    decode(response, DeezerTrackList)
+
+
+async def _feeling_lucky(items):
+    seen = set()
+    for item in items:
+        key = _track_key(item)
+        if key not in seen:
+            seen.add(key)
+            _to_track(item)
+
+
+def _dump_setup(n):
+    # main is only imported for this case; importing it opens the app's stores
+    from main import _dump_debug
+
+    return _dump_debug, [make_track(t) for t in _tracks(n)]
+
+
+async def _debug_dump(args):
+    _dump_debug, rows = args
+    with tempfile.TemporaryDirectory() as tmp:
+        await _dump_debug(os.path.join(tmp, "debug_tracks.json"), rows)
+
+
+CASES = {
+    "merge_tracks": (_tracks, _merge),
+    "combine_and_deduplicate_tracks": (_tracks, _combine),
+    "sse_track_events": (_tracks, _sse_page),
+    "normalize_artist_entry": (_artists, _normalize),
+    "get_all_recommended_artists": (_related_artists_setup, _related),
+    "pull_tracks": (_pull_setup, _pull),
+    "decode_provider_payload": (_payload_setup, _decode),
+    "feeling_lucky_key_and_track": (_spotify_items, _feeling_lucky),
+    "debug_dump": (_dump_setup, _debug_dump),
+}
+
+
+async def measure(cases, size, threshold):
+    watch = LoopWatch(interval=0.001, threshold=threshold)
+    watch.start()
+    results = {}
+    try:
+        for name, (setup, run) in cases.items():
+            data = setup(size)
+            # let the probe settle so the case starts on a fresh heartbeat
+            await asyncio.sleep(0.01)
+            watch.peak = 0.0
+            seen = len(watch.stalls)
+            await run(data)
+            await asyncio.sleep(0.01)
+            stalls = list(watch.stalls)[seen:]
+            results[name] = (watch.peak, stalls)
+    finally:
+        await watch.stop()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2000, help="candidates per case (a large request)")
+    parser.add_argument("--threshold-ms", type=float, default=50.0)
+    parser.add_argument("--only", help="comma-separated case names")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+
+    threshold = args.threshold_ms / 1000
+    results = asyncio.run(measure({n: CASES[n] for n in names}, args.size, threshold))
+
+    failed = []
+    print(f"{'case':34} {'max loop lag':>13}")
+    for name, (peak, stalls) in results.items():
+        print(f"{name:34} {peak * 1e3:>11.2f}ms")
+        if peak > threshold:
+            failed.append((name, peak, stalls))
+    for name, peak, stalls in failed:
+        print(f"BLOCKING {name}: held the loop for {peak * 1e3:.1f} ms (threshold {args.threshold_ms:g} ms)")
+        for stall in stalls[:1]:
+            print(stall["stack"], end="")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""
+Production-shaped load against recorded upstream traffic, with no network.
+
+    python -m benchmarks.bench_replay record --tracks seeds.txt
+    python -m benchmarks.bench_replay replay [--requests 200] [--concurrency 8] [--out after.json]
+    python -m benchmarks.bench_replay replay --compare before.json
+
+`record` starts the API with UPSTREAM_MODE=record and sends one
+/recommendations/by-track request per seed (one "Title - Artist" per line of
+--tracks) plus a few /feeling-lucky draws, against the real upstream APIs.
+Their traffic goes to the cassettes, and the workload goes to workload.json
+next to them. `replay` starts the API with UPSTREAM_MODE=replay on the same
+cassettes and sends --requests requests from that workload, --concurrency at
+a time. It reports p50/p99 time to the first event and to the end of the
+stream, per endpoint. --out saves the results. --compare prints them next
+to results saved from another build.
+
+The API runs with CACHE_DISABLED=1 and without a snapshot, so every request
+reaches the (replayed) upstreams instead of the response cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+from dotenv import dotenv_values
+
+DEFAULT_CASSETTES = "cassettes"
+LUCKY_SHARE = 0.2
+# Credentials decide which providers run, so replay sets (placeholders for) the ones recording had
+CREDENTIALS = (
+    "SPOTIFY_CLIENT_ID", "SPOTIFY_CLIENT_SECRET", "LASTFM_API_KEY", "SOUNDCLOUD_CLIENT_ID",
+    "DISCOGS_CONSUMER_KEY", "DISCOGS_CONSUMER_SECRET",
+)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(mode, cassettes, speed, credentials=()):
+    port = _free_port()
+    env = dict(
+        os.environ,
+        **{name: "replay" for name in credentials},
+        UPSTREAM_MODE=mode,
+        CASSETTE_DIR=cassettes,
+        REPLAY_SPEED=str(speed),
+        CACHE_DISABLED="1",
+        SNAPSHOT_PATH="",
+        CLUSTER_NODES="",
+        LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+        # the API's own logs stay out of the report
+        stdout=sys.stderr,
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(base + "/metrics", timeout=1)
+            return proc, base
+        except httpx.HTTPError:
+            if proc.poll() is not None:
+                raise SystemExit("API exited during startup")
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("API did not start within 30s")
+
+
+def stop_api(proc):
+    # SIGTERM runs the shutdown handlers, which write what's left of the recording
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+async def timed(client, path, params):
+    """(status, seconds to the first event, seconds to the end of the stream)."""
+    start = time.perf_counter()
+    first = None
+    async with client.stream("GET", path, params=params) as resp:
+        async for line in resp.aiter_lines():
+            if first is None and line.startswith("data: "):
+                first = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return resp.status_code, first if first is not None else total, total
+
+
+def workload(spec, n, seed=0):
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(n):
+        if rng.random() < LUCKY_SHARE:
+            requests.append(("/feeling-lucky", {"limit": spec["lucky_limit"]}))
+        else:
+            requests.append(("/recommendations/by-track", {"track": rng.choice(spec["tracks"]), "limit": spec["limit"]}))
+    return requests
+
+
+async def drive(base, requests, concurrency):
+    results = {}
+    queue = list(reversed(requests))
+
+    async def worker(client):
+        while queue:
+            path, params = queue.pop()
+            try:
+                status, first, total = await timed(client, path, params)
+            except httpx.HTTPError:
+                status, first, total = "error", None, None
+            results.setdefault(path, []).append((status, first, total))
+
+    async with httpx.AsyncClient(base_url=base, timeout=120) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return results
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+
+def summarize(results):
+    out = {}
+    for path, rows in results.items():
+        ok = [r for r in rows if r[0] == 200]
+        statuses = {}
+        for status, _, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        out[path] = {
+            "requests": len(rows),
+            "statuses": statuses,
+            "first_p50_ms": _ms(_percentile([r[1] for r in ok], 0.5)),
+            "first_p99_ms": _ms(_percentile([r[1] for r in ok], 0.99)),
+            "total_p50_ms": _ms(_percentile([r[2] for r in ok], 0.5)),
+            "total_p99_ms": _ms(_percentile([r[2] for r in ok], 0.99)),
+        }
+    return out
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def report(summary, baseline=None):
+    columns = ("first_p50_ms", "first_p99_ms", "total_p50_ms", "total_p99_ms")
+    print(f"{'endpoint':28} {'n':>5} " + " ".join(f"{c[:-3]:>18}" for c in columns))
+    for path, row in summary.items():
+        cells = []
+        for c in columns:
+            now = row[c]
+            before = (baseline or {}).get(path, {}).get(c)
+            if now is None:
+                cells.append(f"{'-':>18}")
+            elif before:
+                cells.append(f"{now:>9.1f} ({(now - before) / before:+5.0%})")
+            else:
+                cells.append(f"{now:>18.1f}")
+        print(f"{path:28} {row['requests']:>5} " + " ".join(cells) + f"  {row['statuses']}")
+
+
+def record(args):
+    with open(args.tracks, encoding="utf-8") as f:
+        tracks = [line.strip() for line in f if line.strip()]
+    configured = {**dotenv_values(), **os.environ}
+    spec = {
+        "tracks": tracks,
+        "limit": args.limit,
+        "lucky_limit": args.lucky_limit,
+        "credentials": [name for name in CREDENTIALS if configured.get(name)],
+    }
+    proc, base = start_api("record", args.cassettes, 1)
+    try:
+        requests = [("/recommendations/by-track", {"track": t, "limit": args.limit}) for t in tracks]
+        requests += [("/feeling-lucky", {"limit": args.lucky_limit})] * args.lucky
+        summary = summarize(asyncio.run(drive(base, requests, args.concurrency)))
+    finally:
+        stop_api(proc)
+    os.makedirs(args.cassettes, exist_ok=True)
+    with open(os.path.join(args.cassettes, "workload.json"), "w", encoding="utf-8") as f:
+        json.dump(spec, f, indent=2)
+    report(summary)
+    return 0
+
+
+def replay(args):
+    with open(os.path.join(args.cassettes, "workload.json"), encoding="utf-8") as f:
+        spec = json.load(f)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    proc, base = start_api("replay", args.cassettes, args.speed, spec.get("credentials", ()))
+    try:
+        # one pass to load cassettes and fill process-level state before measuring
+        asyncio.run(drive(base, workload(spec, args.concurrency, seed=1), args.concurrency))
+        summary = summarize(asyncio.run(drive(base, workload(spec, args.requests), args.concurrency)))
+        # how well the cassettes covered the traffic; "miss" calls failed as if the host were down
+        matches = [line for line in httpx.get(base + "/metrics").text.splitlines()
+                   if line.startswith("upstream_replayed_total")]
+    finally:
+        stop_api(proc)
+    report(summary, baseline)
+    print("\n".join(matches))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=("record", "replay"))
+    parser.add_argument("--cassettes", default=os.getenv("CASSETTE_DIR", DEFAULT_CASSETTES))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--tracks", help="record: file with one seed per line")
+    parser.add_argument("--limit", type=int, default=20, help="record: tracks per by-track request")
+    parser.add_argument("--lucky", type=int, default=10, help="record: /feeling-lucky draws")
+    parser.add_argument("--lucky-limit", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200, help="replay: requests to send")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay: multiplier on recorded latencies")
+    parser.add_argument("--out", help="replay: save results as JSON")
+    parser.add_argument("--compare", help="replay: results saved from another build")
+    args = parser.parse_args(argv)
+    if args.mode == "record":
+        if not args.tracks:
+            parser.error("record needs --tracks")
+        return record(args)
+    return replay(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
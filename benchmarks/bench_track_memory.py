@@ -0,0 +1,61 @@
+"""
+Per-track memory: provider dicts vs. the slotted Track.
+
+    python -m benchmarks.bench_track_memory [n]
+"""
+import sys
+import tracemalloc
+
+from utils.make import make_track
+from utils.track import DEEZER, Track
+
+
+def _dict_track(i):
+    # the shape every provider module used to build
+    return {
+        "title": f"Track {i}",
+        "artist": f"Artist {i % 500}",
+        "duration_sec": 200,
+        "cover": f"https://e-cdns-images.dzcdn.net/images/cover/{i}/500x500.jpg",
+        "preview_url": None,
+        "spotify_url": None,
+        "deezer_url": f"https://www.deezer.com/track/{i}",
+        "soundcloud_url": None,
+        "source": ["Deezer"],
+    }
+
+
+def _slotted_track(i):
+    return Track(
+        f"Track {i}",
+        f"Artist {i % 500}",
+        duration_ms=200000,
+        cover_url=f"https://e-cdns-images.dzcdn.net/images/cover/{i}/500x500.jpg",
+        deezer_url=f"https://www.deezer.com/track/{i}",
+        sources=DEEZER,
+    )
+
+
+def measure(build, n):
+    tracemalloc.start()
+    tracks = [build(i) for i in range(n)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tracks
+    return current, peak
+
+
+def main(n=50_000):
+    # old pipeline: provider dict, then a make_track() copy kept alongside it
+    dicts, dicts_peak = measure(lambda i: (lambda t: (t, make_track(t)))(_dict_track(i)), n)
+    slots, slots_peak = measure(_slotted_track, n)
+
+    print(f"{n} tracks")
+    print(f"  dict + make_track copy: {dicts / n:8.1f} B/track  (peak {dicts_peak / 2**20:.1f} MiB)")
+    print(f"  Track (__slots__):      {slots / n:8.1f} B/track  (peak {slots_peak / 2**20:.1f} MiB)")
+    print(f"  ratio: {dicts / slots:.2f}x")
+    return dicts, slots
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse
+
+from utils.autocomplete import AUTOCOMPLETE_TTL, start_autocomplete, suggest
+
+router = APIRouter()
+
+
+@router.on_event("startup")
+async def _start_autocomplete():
+    start_autocomplete()
+
+
+@router.get("/autocomplete")
+async def autocomplete(
+    q: str = Query(..., max_length=200, description="What the user has typed so far"),
+    limit: int = Query(10, ge=1, le=50),
+):
+    """
+    Tracks and artists we have seen from the providers whose names contain
+    every word of `q` (the last one as a prefix), most often seen first.
+    Each result's `seed` can be passed as `track` to /recommendations/by-track.
+    """
+    results = await suggest(q, limit)
+    return JSONResponse({"query": q, "results": results},
+                        headers={"Cache-Control": f"public, max-age={int(AUTOCOMPLETE_TTL)}"})
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import Response
+
+from utils.cache import MISS, cache, dumps
+from utils.cluster import EXPIRES_HEADER, authorized, cluster
+
+router = APIRouter()
+
+
+def _check(secret):
+    if cluster is None:
+        raise HTTPException(status_code=404, detail="Not in cluster mode")
+    if not authorized(secret):
+        raise HTTPException(status_code=403, detail="Bad cluster secret")
+
+
+# Peers' cache tier: only this host's tiers are read and written, never the ring again
+
+@router.get("/cluster/cache/{key}", include_in_schema=False)
+async def cluster_cache_get(key: str, x_cluster_secret: str = Header(None)):
+    _check(x_cluster_secret)
+    value, expires = await cache.get_entry(key, remote=False)
+    if value is MISS:
+        return Response(status_code=404)
+    return Response(dumps(value), media_type="application/octet-stream", headers={EXPIRES_HEADER: repr(expires)})
+
+
+@router.put("/cluster/cache/{key}", include_in_schema=False)
+async def cluster_cache_put(key: str, request: Request, x_cluster_secret: str = Header(None),
+                            x_cache_expires: float = Header(...)):
+    _check(x_cluster_secret)
+    await cache.store(key, await request.body(), x_cache_expires)
+    return Response(status_code=204)
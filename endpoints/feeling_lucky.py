@@ -1,10 +1,21 @@
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Request
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 import asyncio, json, random, httpx
+from collections import deque
 
 from utils.get_spotify_token import get_spotify_token
+from utils.http import upstream_client
+from utils.admission import controller as admission
+from utils.autocomplete import note_tracks
+from utils.images import proxied
+from utils.log import get_logger, redact
+from utils.streaming import cancel_on_disconnect
 
 router = APIRouter()
+log = get_logger("reservoir")
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
 
 def _track_key(item):
     name = (item.get("name") or "").strip().lower()
@@ -48,8 +59,7 @@ async def _spotify_search(client: httpx.AsyncClient, token: str, q: str, limit:
     params = {"q": q, "type": "track", "limit": str(limit), "offset": str(offset)}
     headers = {"Authorization": "Bearer " + token}
     r = await client.get(url, params=params, headers=headers)
-    if r.status_code != 200:
-        return []
+    r.raise_for_status()
     data = r.json()
     tracks = data.get("tracks") or {}
     items = tracks.get("items") or []
@@ -57,65 +67,181 @@ async def _spotify_search(client: httpx.AsyncClient, token: str, q: str, limit:
         return []
     return items
 
-@router.get("/feeling-lucky")
-async def feeling_lucky_stream(
-    limit: int = Query(10, ge=1, le=50),
-):
-    async def event_generator():
-        try:
-            token = await get_spotify_token()
-        except Exception:
-            yield "data: " + json.dumps({"error": "Spotify token error"}) + "\n\n"
-            yield "data: [DONE]\n\n"
-            return
-
-        yield "data: " + json.dumps({"info": {"source": "spotify", "limit": limit}}) + "\n\n"
-
-        # Randomness knobs
-        letters = "abcdefghijklmnopqrstuvwxyz"
-        per_request = 50
+# Pool rows are plain tuples in this field order (the keys of _to_track);
+# a dict is only rebuilt when a track is handed out.
+_ROW_FIELDS = ("title", "artist", "cover_url", "spotify_url", "preview_url", "id")
+
+
+class TrackReservoir:
+    """
+    In-memory pool of random Spotify tracks for /feeling-lucky.
+
+    Tracks are drawn without replacement (swap-remove on a list, O(1) per
+    draw). When the pool drops below `low_water` a background task runs
+    `searches_per_refill` random searches concurrently and tops it back up.
+    """
+
+    def __init__(self, capacity=1500, low_water=400, searches_per_refill=8,
+                 per_search=50, max_per_artist=3, recent_size=5000):
+        self.capacity = capacity
+        self.low_water = low_water
+        self.searches_per_refill = searches_per_refill
+        self.per_search = per_search
+        self.max_per_artist = max_per_artist
+
+        self._pool = []
+        self._keys = set()
+        self._artist_counts = {}
+        # keys handed out recently, so a refill doesn't put them straight back
+        self._recent = deque(maxlen=recent_size)
+        self._recent_keys = set()
+        self._refill_task = None
+        # why the last refill stopped early, for draws that come back empty
+        self.refill_error = None
+
+    def __len__(self):
+        return len(self._pool)
+
+    def _add(self, key, row):
+        if key in self._keys or key in self._recent_keys:
+            return False
+        artist = row[1].lower()
+        # cap tracks per artist so one prolific artist can't crowd the pool
+        if self._artist_counts.get(artist, 0) >= self.max_per_artist:
+            return False
+        self._pool.append((key, row))
+        self._keys.add(key)
+        self._artist_counts[artist] = self._artist_counts.get(artist, 0) + 1
+        return True
+
+    def _pop(self, i):
+        pool = self._pool
+        pool[i], pool[-1] = pool[-1], pool[i]
+        key, row = pool.pop()
+        self._keys.discard(key)
+        artist = row[1].lower()
+        n = self._artist_counts.get(artist, 1) - 1
+        if n:
+            self._artist_counts[artist] = n
+        else:
+            self._artist_counts.pop(artist, None)
+
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_keys.discard(self._recent[0])
+        self._recent.append(key)
+        self._recent_keys.add(key)
+        return row
+
+    async def refill(self):
+        token = await get_spotify_token()
+        # distinct letters per refill so the searches don't overlap
+        letters = random.sample(LETTERS, min(self.searches_per_refill, len(LETTERS)))
+
+        async with upstream_client(timeout=httpx.Timeout(12.0)) as client:
+            # Spotify offset max is effectively 1000-ish for search; stay safe
+            results = await asyncio.gather(
+                *[_spotify_search(client, token, q, self.per_search, random.randint(0, 950)) for q in letters],
+                return_exceptions=True,
+            )
+
+        failed = [r for r in results if isinstance(r, Exception)]
+        if len(failed) == len(results):
+            raise failed[0]
+        added = 0
+        for items in results:
+            if isinstance(items, Exception):
+                continue
+            for item in items:
+                if len(self._pool) >= self.capacity:
+                    return added
+                if not isinstance(item, dict):
+                    continue
+                k = _track_key(item)
+                track_obj = _to_track(item)
+                # basic sanity
+                if not track_obj["title"] or not track_obj["artist"]:
+                    continue
+                note_tracks([(track_obj["title"], track_obj["artist"])])
+                if self._add(k, tuple(track_obj[f] for f in _ROW_FIELDS)):
+                    added += 1
+        return added
+
+    async def _refill_until_full(self):
+        # bounded, so an upstream that keeps returning duplicates can't spin forever
+        self.refill_error = None
+        for _ in range(4):
+            try:
+                added = await self.refill()
+            except Exception as e:
+                log.warning("Refill failed", error=repr(e))
+                self.refill_error = e
+                return
+            if added == 0 or len(self._pool) >= self.capacity:
+                return
+
+    def ensure_refill(self):
+        """Start a background refill unless one is already running."""
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill_until_full())
+        return self._refill_task
+
+    async def draw(self, n):
+        """
+        Take up to `n` random tracks out of the pool. Raises the refill's
+        error when the pool is empty because refilling failed.
+        """
+        if len(self._pool) < n:
+            # Cold or drained pool: wait for the shared refill (starting one if
+            # needed) so this request isn't empty, then take what there is
+            await asyncio.shield(self.ensure_refill())
+            if not self._pool and self.refill_error is not None:
+                raise self.refill_error
 
-        seen = set()
         picked = []
+        while self._pool and len(picked) < n:
+            row = self._pop(random.randrange(len(self._pool)))
+            picked.append(dict(zip(_ROW_FIELDS, row)))
 
-        async with httpx.AsyncClient(timeout=httpx.Timeout(12.0)) as client:
-            # Try multiple rounds until we collect enough unique tracks
-            # (Spotify search result quality varies wildly depending on query)
-            rounds = 0
-            while len(picked) < limit and rounds < 12:
-                rounds += 1
+        if len(self._pool) < self.low_water:
+            self.ensure_refill()
+        return picked
 
-                q = random.choice(letters)
-                # Spotify offset max is effectively 1000-ish for search; stay safe
-                offset = random.randint(0, 950)
 
-                try:
-                    items = await _spotify_search(client, token, q, per_request, offset)
-                except Exception:
-                    items = []
+reservoir = TrackReservoir()
 
-                if len(items) == 0:
-                    continue
 
-                random.shuffle(items)
+@router.on_event("startup")
+async def _prefill_reservoir():
+    reservoir.ensure_refill()
 
-                for item in items:
-                    k = _track_key(item)
-                    if not k or k in seen:
-                        continue
-                    seen.add(k)
 
-                    track_obj = _to_track(item)
-                    # basic sanity
-                    if not track_obj["title"] or not track_obj["artist"]:
-                        continue
+@router.get("/feeling-lucky")
+async def feeling_lucky_stream(
+    request: Request,
+    limit: int = Query(10, ge=1, le=50),
+):
+    async def event_generator():
+        try:
+            picked = await reservoir.draw(limit)
+        except Exception as e:
+            yield "data: " + json.dumps({"error": f"Could not draw tracks: {redact(str(e) or repr(e))}"}) + "\n\n"
+            yield "data: [DONE]\n\n"
+            return
 
-                    picked.append(track_obj)
-                    yield "data: " + json.dumps({"track": track_obj}) + "\n\n"
+        yield "data: " + json.dumps({"info": {"source": "spotify", "limit": limit}}) + "\n\n"
 
-                    if len(picked) >= limit:
-                        break
+        for track_obj in picked:
+            track_obj["cover_url"] = proxied(track_obj["cover_url"])
+            yield "data: " + json.dumps({"track": track_obj}) + "\n\n"
 
         yield "data: [DONE]\n\n"
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
\ No newline at end of file
+    gate = admission("feeling-lucky")
+    permit = await gate.acquire()
+    try:
+        stream = cancel_on_disconnect(request, event_generator(), "feeling-lucky")
+        return StreamingResponse(gate.stream(permit, stream), media_type="text/event-stream",
+                                 background=BackgroundTask(permit.release))
+    except BaseException:
+        permit.release()
+        raise
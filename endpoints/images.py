@@ -0,0 +1,23 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response
+
+from utils.images import ImageError, get_image
+from utils.log import get_logger
+
+router = APIRouter()
+log = get_logger("images")
+
+# Keys are derived from the source URL, so a key's content never changes
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+@router.get("/images/{key}")
+async def image_proxy(key: str, w: int = Query(0, ge=0, le=4096, description="Width wanted (0: original)")):
+    try:
+        content_type, data = await get_image(key, w)
+    except ImageError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
+    except Exception as e:
+        log.warning("Fetch failed", error=repr(e))
+        raise HTTPException(status_code=502, detail="Image unavailable")
+    return Response(data, media_type=content_type, headers={"Cache-Control": IMMUTABLE})
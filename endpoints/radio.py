@@ -0,0 +1,76 @@
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from utils.admission import controller as admission
+from utils.get_spotify_token import get_spotify_token
+from utils.http import upstream_client
+from utils.providers import UnknownSourceError, select_providers
+from utils.radio import RadioSession, parse_event_id, play, sessions
+from utils.seeds import resolve_seed
+from utils.streaming import cancel_on_disconnect
+
+router = APIRouter()
+
+
+def _split(track):
+    if " - " in track:
+        title, artist = map(str.strip, track.split(" - ", 1))
+        return title, artist
+    return track, None
+
+
+async def radio_stream(track, session_id, resume_after, ahead, providers):
+    async with upstream_client() as client:
+        # starting (or resuming) is the expensive part, and the only part that waits for a slot
+        permit = await admission("radio").acquire()
+        try:
+            token = await get_spotify_token()
+            headers = {"Authorization": f"Bearer {token}"}
+            session = sessions.get(session_id) if session_id else None
+            if session is None:
+                resume_after = None
+                title, artist = _split(track)
+                try:
+                    artist_id, artist_name = await resolve_seed(client, headers, title, artist)
+                except Exception:
+                    yield "data: " + json.dumps({"error": "Could not determine artist"}) + "\n\n"
+                    return
+                session = RadioSession(providers, artist_id, artist_name, title)
+                sessions.add(session)
+        finally:
+            permit.release()
+
+        async for chunk in play(session, client, headers, token, ahead, resume_after):
+            yield chunk
+
+
+@router.get("/radio")
+async def radio(
+    request: Request,
+    track: str = Query(..., description='Seed, "Title - Artist"'),
+    ahead: int = Query(3, ge=1, le=10, description="Tracks sent ahead of playback"),
+    session: Optional[str] = Query(None, description="Radio session to resume"),
+    sources: Optional[str] = Query(None, description="Comma-separated providers to use (default: all)"),
+    exclude_sources: Optional[str] = Query(None, description="Comma-separated providers to skip"),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    An endless SSE stream of recommendations starting from `track`, paced so
+    the client holds `ahead` tracks it hasn't played yet. To pause, close the
+    stream. To resume, reconnect: EventSource sends Last-Event-ID by itself.
+    Otherwise pass `session` from the first event. A resumed stream carries
+    on with the same session and skips what was already played.
+    """
+    try:
+        providers = select_providers(sources, exclude_sources)
+    except UnknownSourceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    session_id, resume_after = parse_event_id(last_event_id)
+    if session_id is None and session:
+        # no event id to replay from; the stream restarts with a fresh header event
+        session_id = session
+    stream = radio_stream(track, session_id, resume_after, ahead, providers)
+    return StreamingResponse(cancel_on_disconnect(request, stream, "radio"), media_type="text/event-stream")
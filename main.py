@@ -1,23 +1,60 @@
 
 import json
-from fastapi.responses import StreamingResponse
-from fastapi import FastAPI, Query
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from dotenv import load_dotenv
 import os
-import httpx
 import base64
 from fastapi.middleware.cors import CORSMiddleware
 from utils.normalize import get_all_recommended_artists
-from utils.deezer import fetch_deezer_related_tracks, fetch_deezer_tracks
-from utils.lastfm import fetch_lastfm_similar_tracks, fetch_lastfm_tracks
 from utils.make import make_track
-from utils.spotify import extract_artist_info_from_spotify, fetch_spotify_tracks_and_metadata
+from utils.merge import pull_tracks
+from utils.schemas import SpotifyArtistSearch, decode
+from utils.track import LOCAL, ORIGINAL, Track
+from utils.spotify import fetch_spotify_artist_metadata
+from utils.seeds import resolve_seed
 from utils.enrich import enrich_artist_metadata, enrich_track
-from utils.soundcloud import get_soundcloud_recommendations
+from utils.providers import (
+    ARTIST_METADATA,
+    LINK_LOOKUP,
+    SeedContext,
+    UnknownSourceError,
+    provider_names,
+    select_providers,
+    track_streams,
+)
+from typing import Optional
 import asyncio
 import random
+import threading
+import time
 from endpoints.feeling_lucky import router as feeling_lucky_router
+from endpoints.images import router as images_router
+from endpoints.cluster import router as cluster_router
+from endpoints.autocomplete import router as autocomplete_router
+from endpoints.radio import router as radio_router
 from utils.get_spotify_token import get_spotify_token
+from utils.singleflight import coalesce, normalize_query
+from utils.snapshot import open_snapshot
+from utils.cache import cache, make_key, MISS
+from utils.http_cache import cache_control, canonical_json, content_etag, etag_matches
+from utils.admission import controller as admission
+from utils import metrics
+from utils.budget import DEPTH_FANOUT, MAX_BUDGET, Budget, CostModel, current_budget, default_budget
+from utils.http import upstream_client
+from utils.streaming import cancel_on_disconnect
+from utils import profiling
+from utils.profiling import span, traced
+from utils.stages import Pipeline, StopPipeline
+from utils.images import with_proxied_image
+from utils.cooccurrence import basket_edges, record, related_edges
+from utils.autocomplete import note_artists, note_tracks
+from utils.popularity import REFRESH_MARGIN, refresher, start_refresher, tracker as popularity
+from utils.loopwatch import start_loopwatch
+from utils.cluster import forward
+from utils import cassettes
+from utils.log import DEBUG_DUMPS, RequestIdMiddleware, get_logger
 
 
 load_dotenv()
@@ -25,9 +62,18 @@ SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 LASTFM_API_KEY = os.getenv("LASTFM_API_KEY")
 SOUNDCLOUD_CLIENT_ID = os.getenv("SOUNDCLOUD_CLIENT_ID")
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshot.bin")
+# How long a computed JSON result is reused and may be cached downstream
+RESULT_TTL = int(os.getenv("RESULT_TTL", "600"))
+
+log = get_logger("api")
 
 app = FastAPI()
 app.include_router(feeling_lucky_router)
+app.include_router(images_router)
+app.include_router(cluster_router)
+app.include_router(autocomplete_router)
+app.include_router(radio_router)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # or "*" to allow all during dev
@@ -35,232 +81,587 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestIdMiddleware)
 session_cache = {}
+# Precomputed results for popular seeds (see precompute.py)
+snapshot = open_snapshot(SNAPSHOT_PATH)
+
+
+@app.on_event("startup")
+async def _start_refresher():
+    start_refresher()
+
+
+@app.on_event("startup")
+async def _start_loopwatch():
+    start_loopwatch()
+
+
+@app.on_event("shutdown")
+async def _flush_cassettes():
+    await cassettes.flush()
+
+
+def _write_json(path, rows):
+    # concurrent requests each write their own temp file; the last replace wins whole
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+async def _dump_debug(path, rows):
+    # indent=2 dumps of a few hundred tracks take long enough to stall every other stream
+    try:
+        await asyncio.to_thread(_write_json, path, rows)
+        log.debug("Dumped debug tracks", path=path, tracks=len(rows))
+    except Exception as e:
+        log.warning("Debug dump failed", path=path, error=repr(e))
+
 
 @app.get("/recommendations/by-track")
 async def recommendations_by_track_enriched_stream(
+    request: Request,
+    track: str = Query(...),
+    limit: int = Query(20),
+    offset: int = Query(0),
+    shuffle: bool = Query(False),
+    include_original: bool = Query(False),
+    depth: int = Query(1, ge=1, le=3),
+    sources: Optional[str] = Query(None, description="Comma-separated providers to use (default: all)"),
+    exclude_sources: Optional[str] = Query(None, description="Comma-separated providers to skip"),
+    budget: Optional[int] = Query(None, ge=1, le=MAX_BUDGET, description="Max upstream calls (default: from depth and limit)"),
+    x_profile: Optional[str] = Header(None, description='"1" for a timing span tree, "chrome" to add a Chrome trace'),
+    x_debug_key: Optional[str] = Header(None),
+):
+    providers = _select_providers_or_400(sources, exclude_sources)
+    relayed = await forward(request, normalize_query(track))
+    if relayed is not None:
+        return relayed
+    if not shuffle:
+        _count_seed("by-track", track, limit, offset, include_original, depth, providers, budget)
+    gate = admission("by-track")
+    permit = await gate.acquire()
+    try:
+        profile = profiling.requested(x_profile, x_debug_key)
+        stream = by_track_stream(track, limit, offset, shuffle, include_original, depth, providers, budget, profile)
+        stream = cancel_on_disconnect(request, stream, "by-track")
+        return StreamingResponse(gate.stream(permit, stream), media_type="text/event-stream",
+                                 background=BackgroundTask(permit.release))
+    except BaseException:
+        # no response to give the slot back; don't leak it
+        permit.release()
+        raise
+
+
+@app.get("/recommendations/by-track/json")
+async def recommendations_by_track_json(
+    request: Request,
     track: str = Query(...),
     limit: int = Query(20),
     offset: int = Query(0),
     shuffle: bool = Query(False),
     include_original: bool = Query(False),
     depth: int = Query(1, ge=1, le=3),
+    sources: Optional[str] = Query(None, description="Comma-separated providers to use (default: all)"),
+    exclude_sources: Optional[str] = Query(None, description="Comma-separated providers to skip"),
+    budget: Optional[int] = Query(None, ge=1, le=MAX_BUDGET, description="Max upstream calls (default: from depth and limit)"),
+    if_none_match: Optional[str] = Header(None),
 ):
-    async def event_generator(track_query: str):
-        
-        print("Request for recommendations by track:", track_query, 
-              "limit:", limit, "offset:", offset, "shuffle:", shuffle,
-              "include_original:", include_original, "depth:", depth)
-        # Split input into title / artist
-        if " - " in track_query:
-            track_title, track_artist = map(str.strip, track_query.split(" - ", 1))
+    """
+    Same results as /recommendations/by-track, collected into one JSON
+    document with an ETag. Results are kept for RESULT_TTL seconds, and a
+    matching If-None-Match is answered with 304 without recomputing.
+    """
+    providers = _select_providers_or_400(sources, exclude_sources)
+    relayed = await forward(request, normalize_query(track))
+    if relayed is not None:
+        return relayed
+
+    async def compute():
+        permit = await admission("by-track-json").acquire()
+        try:
+            return await collect_result(
+                by_track_stream(track, limit, offset, shuffle, include_original, depth, providers, budget)
+            )
+        finally:
+            permit.release()
+
+    if shuffle:
+        # a fresh random order each time; nothing worth caching
+        result = await compute()
+        return Response(canonical_json(result), media_type="application/json",
+                        headers={"Cache-Control": "no-store"})
+
+    key = _result_key(track, limit, offset, include_original, depth, providers, budget)
+    _count_seed("by-track-json", track, limit, offset, include_original, depth, providers, budget)
+    cached_result = await cache.get(key)
+    if cached_result is MISS:
+        result = await compute()
+        if "error" in result:
+            status = 404 if result["error"] == "Could not determine artist" else 502
+            return Response(canonical_json(result), status_code=status, media_type="application/json",
+                            headers={"Cache-Control": "no-store"})
+        body = canonical_json(result)
+        etag = content_etag(body)
+        await cache.set(key, (etag, body), RESULT_TTL)
+    else:
+        etag, body = cached_result
+
+    headers = {"ETag": etag, "Cache-Control": cache_control(RESULT_TTL)}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _result_key(track, limit, offset, include_original, depth, providers, budget):
+    return make_key("by_track_result", normalize_query(track), limit, offset, include_original, depth,
+                    provider_names(providers), budget)
+
+
+def _count_seed(kind, track, limit, offset, include_original, depth, providers, budget):
+    params = (limit, offset, include_original, depth, provider_names(providers), budget)
+    popularity.hit(kind, (normalize_query(track),) + params, (track,) + params)
+
+
+@refresher("by-track")
+async def _refresh_by_track(params, allowance):
+    """Re-run a hot seed so its expiring provider and enrichment entries are fetched again."""
+    track, limit, offset, include_original, depth, sources, budget = params
+    providers = select_providers(sources)
+    stream = by_track_event_generator(
+        track, limit, offset, False, include_original, depth, providers, min(budget or allowance, allowance)
+    )
+    result = await collect_result(stream, keep_stats=True)
+    return result.get("stats", {}).get("spent", 0)
+
+
+@refresher("by-track-json")
+async def _refresh_by_track_json(params, allowance):
+    """Recompute a hot JSON result if its cached copy expires within the refresh margin."""
+    track, limit, offset, include_original, depth, sources, budget = params
+    providers = select_providers(sources)
+    key = _result_key(track, limit, offset, include_original, depth, providers, budget)
+    cached_result, expires = await cache.get_entry(key)
+    if cached_result is not MISS and expires - time.time() > REFRESH_MARGIN:
+        return 0
+    stream = by_track_event_generator(
+        track, limit, offset, False, include_original, depth, providers, min(budget or allowance, allowance)
+    )
+    result = await collect_result(stream, keep_stats=True)
+    stats = result.pop("stats", {})
+    # a result cut short by the allowance is not what a request would get
+    if "error" not in result and not stats.get("denied") and not stats.get("dropped"):
+        body = canonical_json(result)
+        await cache.set(key, (content_etag(body), body), RESULT_TTL)
+    return stats.get("spent", 0)
+
+
+@refresher("artist")
+async def _refresh_artist(params, allowance):
+    """Refresh a hot artist's related-artist listings and metadata enrichment."""
+    artist_id, artist_name, sources = params
+    providers = select_providers(sources)
+    budget = Budget(allowance)
+    current_budget.set(budget)
+    token = await get_spotify_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    async with upstream_client() as client:
+        await get_all_recommended_artists(
+            artist_name, artist_id, client, headers, LASTFM_API_KEY, SOUNDCLOUD_CLIENT_ID, providers
+        )
+        await enrich_artist_metadata(
+            artist_name, LASTFM_API_KEY, SOUNDCLOUD_CLIENT_ID, token,
+            sources=provider_names(providers, ARTIST_METADATA),
+        )
+    return budget.spent
+
+
+def _select_providers_or_400(sources, exclude_sources):
+    try:
+        return select_providers(sources, exclude_sources)
+    except UnknownSourceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def by_track_stream(track, limit, offset, shuffle, include_original, depth, providers, budget=None, profile=None):
+    """SSE chunks for a by-track request, from the snapshot or a (shared) live computation."""
+    # Exact-seed hit in the precomputed snapshot: no upstream calls at all
+    if snapshot is not None and not shuffle and snapshot.matches(
+        limit=limit, offset=offset, include_original=include_original, depth=depth,
+        sources=list(provider_names(providers)),
+    ):
+        events = snapshot.get(track)
+        if events is not None:
+            return snapshot_event_generator(events)
+
+    # Identical concurrent requests share one upstream computation
+    key = ("by-track", normalize_query(track), limit, offset, shuffle, include_original, depth,
+           provider_names(providers), budget, profile)
+    return coalesce(
+        key,
+        lambda: by_track_event_generator(
+            track, limit, offset, shuffle, include_original, depth, providers, budget, profile
+        ),
+    )
+
+
+async def collect_result(stream, keep_stats=False):
+    """Fold a by-track SSE stream into a single result document."""
+    result = {"artist": None, "tracks": [], "depth_tracks": [], "recommended_artists": []}
+    async for chunk in stream:
+        payload = chunk[len("data: "):].strip()
+        if payload == "[DONE]":
+            break
+        event = json.loads(payload)
+        if "error" in event:
+            return {"error": event["error"]}
+        if "stats" in event and keep_stats:
+            result["stats"] = event["stats"]
+            continue
+        if "stats" in event or "timing" in event:
+            # per-run accounting, not part of the result
+            continue
+        if "track" in event:
+            result["tracks"].append(event["track"])
+        elif "depth_track" in event:
+            result["depth_tracks"].append(event["depth_track"])
         else:
-            track_title, track_artist = track_query, None
+            result.update(event)
+    return result
+
+
+async def snapshot_event_generator(events):
+    for event in events:
+        yield "data: " + json.dumps(event) + "\n\n"
+    yield "data: [DONE]\n\n"
+
+
+async def by_track_event_generator(track_query, limit, offset, shuffle, include_original, depth, providers=None,
+                                   call_budget=None, profile=None):
+    providers = providers if providers is not None else select_providers()
+    link_sources = provider_names(providers, LINK_LOOKUP)
+    metadata_sources = provider_names(providers, ARTIST_METADATA)
+    costs = CostModel(providers, limit, depth, link_sources, metadata_sources)
+    budget = Budget(min(call_budget, MAX_BUDGET) if call_budget else default_budget(costs))
+    current_budget.set(budget)
+    root_span = profiling.start("by-track", track=track_query, limit=limit, depth=depth) if profile else None
+    log.info("By-track request", track=track_query, limit=limit, offset=offset, shuffle=shuffle,
+             include_original=include_original, depth=depth)
+    # Split input into title / artist
+    if " - " in track_query:
+        track_title, track_artist = map(str.strip, track_query.split(" - ", 1))
+    else:
+        track_title, track_artist = track_query, None
+
+    def event(payload):
+        return "data: " + json.dumps(payload) + "\n\n"
+
+    # If include_original is False, skip tracks by the original artist (fuzzy match)
+    keep = None
+    if not include_original and track_artist:
+        ta = track_artist.lower().strip()
+        def is_same_artist(candidate: str) -> bool:
+            cand = candidate.lower().strip()
+            return cand == ta or ta in cand or cand in ta
+        keep = lambda t: not is_same_artist(t.artist)
+
+    # upstream calls still owed to the page's track enrichment, which outranks
+    # artist enrichment and depth tracks now that they run at the same time
+    owed = {"tracks": limit * costs.enrich_track}
+
+    async with upstream_client() as client:
+        # Each stage starts as soon as its inputs are ready; events still go out in declaration order
+        pipeline = Pipeline(on_error=lambda name, message: event({"error": f"{name} {message}", "stage": name}))
 
         # --- Auth ---
-        try:
-            token = await get_spotify_token()
-            headers = {"Authorization": f"Bearer {token}"}
-        except Exception:
-            yield "data: " + json.dumps({"error": "Spotify token error"}) + "\n\n"
-            return
+        @pipeline.stage("auth")
+        async def auth(emit):
+            try:
+                token = await get_spotify_token()
+            except Exception:
+                emit(event({"error": "Spotify token error"}))
+                raise StopPipeline
+            return token, {"Authorization": f"Bearer {token}"}
 
-        async with httpx.AsyncClient() as client:
-            # --- Artist info ---
+        # --- Artist info ---
+        @pipeline.stage("seed", after=["auth"])
+        async def seed(emit, auth):
             try:
-                artist_id, artist_name = await extract_artist_info_from_spotify(
-                    client, headers, track_title, track_artist
+                artist_id, artist_name = await traced(
+                    "seed_resolution", resolve_seed(client, auth[1], track_title, track_artist)
                 )
             except Exception:
-                yield "data: " + json.dumps({"error": "Could not determine artist"}) + "\n\n"
-                return
+                emit(event({"error": "Could not determine artist"}))
+                raise StopPipeline
+            popularity.hit("artist", normalize_query(artist_name), (artist_id, artist_name, provider_names(providers)))
+            note_artists([artist_name])
 
             # Optionally yield original track
             if include_original and track_artist:
                 try:
-                    orig_track = {
-                        "title": track_title,
-                        "artist": track_artist,
-                        "source": ["original"]
-                    }
+                    orig_track = Track(track_title, track_artist, sources=ORIGINAL)
                     # Minimal enrichment (just make_track)
-                    yield "data: " + json.dumps({"original_track": make_track(orig_track)}) + "\n\n"
+                    emit(event({"original_track": make_track(orig_track)}))
                 except Exception:
                     pass
-
-            # --- Fetch data from all sources in parallel ---
-            tasks = [
-                fetch_spotify_tracks_and_metadata(client, headers, artist_id, artist_name, offset=offset, limit=limit),
-                fetch_deezer_tracks(client, artist_name, limit=limit, offset=offset),
-                fetch_deezer_related_tracks(client, artist_name, limit=limit, offset=offset),
-                fetch_lastfm_tracks(client, artist_name, LASTFM_API_KEY, limit=limit, offset=offset),
-                fetch_lastfm_similar_tracks(client, artist_name, track_title, LASTFM_API_KEY, limit=limit),
-                get_soundcloud_recommendations(track_title, artist_name, client, SOUNDCLOUD_CLIENT_ID, offset=offset, limit=limit),
-            ]
-
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-
-            spotify_data = results[0] if not isinstance(results[0], Exception) else {"tracks": [], "artist_metadata": None}
-
-            all_tracks_raw = []
-            for r in results:
-                if isinstance(r, dict) and "tracks" in r:
-                    all_tracks_raw += r["tracks"]
-                elif isinstance(r, list):
-                    all_tracks_raw += r
-
-            # --- Deduplicate ---
-            def unique_key(t): return (t["title"].lower(), t["artist"].lower())
-            unique = {unique_key(t): t for t in all_tracks_raw}
-            all_unique = list(unique.values())
+            return artist_id, artist_name
+
+        # --- Stream initial artist metadata ---
+        @pipeline.stage("artist", after=["auth", "seed"])
+        async def artist(emit, auth, seed):
+            artist_id, artist_name = seed
+            metadata = await traced(
+                "artist_metadata", _seed_artist_metadata(client, auth[1], artist_id, artist_name, providers)
+            )
+            emit(event({"artist": with_proxied_image(metadata)}))
+
+        # --- Pull from the selected sources in parallel, only as far as this page needs ---
+        @pipeline.stage("candidates", after=["auth", "seed"])
+        async def candidates(emit, auth, seed):
+            artist_id, artist_name = seed
+            ctx = SeedContext(client, auth[1], artist_id, artist_name, track_title, limit=limit, offset=offset,
+                              own_tracks=keep is None)
+            secondary = budget.affords(costs.primary + costs.secondary)
+            if not secondary:
+                budget.drop("secondary_sources", sum(len(p.secondary_track_fetchers) for p in providers))
+            all_unique = await traced("merge", pull_tracks(track_streams(providers, ctx, secondary), offset + limit, keep, limit))
+
+            # what the upstream sources returned together feeds the local embeddings
+            upstream = [t for t in all_unique if t.sources != LOCAL]
+            await record(basket_edges(track_title, artist_name, upstream))
+            note_tracks((t.title, t.artist) for t in upstream)
 
             # --- Debug logging ---
-            try:
-                with open("debug_tracks.json", "w", encoding="utf-8") as f:
-                    import json as _json
-                    _json.dump(all_unique, f, ensure_ascii=False, indent=2)
-                print(f"[DEBUG] Dumped {len(all_unique)} tracks to debug_tracks.json")
-            except Exception as e:
-                print("[DEBUG] Failed to write debug_tracks.json:", e)
-
-            # If include_original is False, filter out tracks by the original artist (fuzzy match)
-            if not include_original and track_artist:
-                ta = track_artist.lower().strip()
-                def is_same_artist(candidate: str) -> bool:
-                    cand = candidate.lower().strip()
-                    return cand == ta or ta in cand or cand in ta
-                all_unique = [t for t in all_unique if not is_same_artist(t.get("artist", ""))]
+            if DEBUG_DUMPS:
+                await _dump_debug("debug_tracks.json", [make_track(t) for t in all_unique])
 
             if shuffle:
                 random.shuffle(all_unique)
 
-            # Slice limit
-            sliced = all_unique[:limit]
+            # Slice the page; offset counts into the merged list, not into each provider's results
+            sliced = all_unique[offset:offset + limit]
+            owed["tracks"] = len(sliced) * costs.enrich_track
+            return sliced
 
-            # --- Stream initial artist metadata ---
-            yield "data: " + json.dumps({"artist": spotify_data.get("artist_metadata")}) + "\n\n"
-
-          # --- Enrich and stream tracks one by one ---
+        @pipeline.stage("related", after=["auth", "seed"])
+        async def related(emit, auth, seed):
+            artist_id, artist_name = seed
+            try:
+                all_artists = await traced("related_artists", get_all_recommended_artists(
+                    artist_name, artist_id, client, auth[1], LASTFM_API_KEY, SOUNDCLOUD_CLIENT_ID, providers
+                ))
+            except Exception as e:
+                log.warning("Related artist listing failed", error=repr(e))
+                return None
+            await _record_related(artist_name, all_artists)
+            return all_artists
+
+        # --- Enrich and stream tracks one by one ---
+        @pipeline.stage("tracks", after=["auth", "candidates"])
+        async def tracks(emit, auth, candidates):
+            token = auth[0]
             enriched_debug = []
-            for t in sliced:
+            for t in candidates:
+                owed["tracks"] -= costs.enrich_track
                 try:
-                    enriched = await enrich_track(t, token)  # <- use the new track-by-track function
-                    
-                    if enriched.get("image_url") and "2a96cbd8b46e442fc41c2b86b821562f" in enriched["image_url"]:
-                        enriched["image_url"] = enriched.get("cover_url")
-                    print(f" ENRICHED LASTFM URL: {enriched.get('lastfm_url')}")
-                    if not enriched.get("lastfm_url"):
-                        enriched["lastfm_url"] = f"https://www.last.fm/music/{enriched['artist'].replace(' ', '+')}/_/{enriched['title'].replace(' ', '+')}"
-                        print(f"[Last.fm URL] {enriched['title']} -> {enriched['lastfm_url']}")
+                    if budget.affords(costs.enrich_track, reserve=costs.related_listing):
+                        enriched = await traced("enrich_track", enrich_track(t, token, sources=link_sources), title=t.title)
+                    else:
+                        budget.drop("track_enrichment")
+                        enriched = t
+
+                    if not enriched.lastfm_url:
+                        enriched.lastfm_url = f"https://www.last.fm/music/{enriched.artist.replace(' ', '+')}/_/{enriched.title.replace(' ', '+')}"
+                    log.sampled("Track enriched", title=enriched.title, lastfm_url=enriched.lastfm_url)
                     track_obj = make_track(enriched)
-                    enriched_debug.append(track_obj)
-                    yield "data: " + json.dumps({"track": track_obj}) + "\n\n"
+                    if DEBUG_DUMPS:
+                        enriched_debug.append(track_obj)
+                    emit(event({"track": track_obj}))
                 except Exception:
-                    yield "data: " + json.dumps({"track": {"error": "enrichment failed"}}) + "\n\n"
-                        # --- Debug logging after enrichment ---
-            try:
-                with open("debug_enriched_tracks.json", "w", encoding="utf-8") as f:
-                    json.dump(enriched_debug, f, ensure_ascii=False, indent=2)
-                print(f"[DEBUG] Dumped {len(enriched_debug)} enriched tracks to debug_enriched_tracks.json")
-            except Exception as e:
-                print("[DEBUG] Failed to write debug_enriched_tracks.json:", e)
-            # --- For depth > 1, recursively fetch related artists' tracks ---
-            if depth > 1:
-                # Helper function defined above
+                    emit(event({"track": {"error": "enrichment failed"}}))
+            # --- Debug logging after enrichment ---
+            if DEBUG_DUMPS:
+                await _dump_debug("debug_enriched_tracks.json", enriched_debug)
+
+        # --- For depth > 1, recursively fetch related artists' tracks, alongside the page's enrichment ---
+        if depth > 1:
+            @pipeline.stage("depth_candidates", after=["auth", "seed", "related"])
+            async def depth_candidates(emit, auth, seed, related):
+                artist_id, artist_name = seed
                 try:
-                    related_tracks = await fetch_related_tracks_recursive(
-                        artist_name, artist_id, client, headers, depth-1, limit
-                    )
-                    # Deduplicate with already yielded tracks
-                    existing_keys = set(unique_key(t) for t in sliced)
-                    seen_keys = set(existing_keys)
-                    for t in related_tracks:
-                        k = unique_key(t)
-                        if k in seen_keys:
-                            continue
-                        seen_keys.add(k)
-                        try:
-                            enriched = await safe_enrich(t, client)
-                            yield "data: " + json.dumps({"depth_track": make_track(enriched)}) + "\n\n"
-                        except Exception:
-                            yield "data: " + json.dumps({"depth_track": {"error": "enrichment failed"}}) + "\n\n"
-                except Exception:
-                    yield "data: " + json.dumps({"depth_track": {"error": "depth recursion failed"}}) + "\n\n"
-
-            # --- Stream recommended artists ---
+                    return await traced("depth", fetch_related_tracks_recursive(
+                        artist_name, artist_id, client, auth[1], depth-1, limit, providers, costs,
+                        related=related, owed=owed
+                    ))
+                except Exception as e:
+                    log.warning("Depth recursion failed", error=repr(e))
+                    return None
+
+            @pipeline.stage("depth_tracks", after=["auth", "candidates", "depth_candidates"])
+            async def depth_tracks(emit, auth, candidates, depth_candidates):
+                if depth_candidates is None:
+                    emit(event({"depth_track": {"error": "depth recursion failed"}}))
+                    return
+                # Deduplicate with the page's tracks
+                seen_keys = set(t.key for t in candidates)
+                for t in depth_candidates:
+                    k = t.key
+                    if k in seen_keys:
+                        continue
+                    seen_keys.add(k)
+                    try:
+                        if budget.affords(costs.enrich_track, reserve=costs.artists + owed["tracks"]):
+                            enriched = await traced(
+                                "enrich_track", enrich_track(t, auth[0], sources=link_sources), title=t.title
+                            )
+                        else:
+                            budget.drop("depth_track_enrichment")
+                            enriched = t
+                        emit(event({"depth_track": make_track(enriched)}))
+                    except Exception:
+                        emit(event({"depth_track": {"error": "enrichment failed"}}))
+
+        # --- Stream recommended artists ---
+        @pipeline.stage("recommended_artists", after=["auth", "related"])
+        async def recommended_artists(emit, auth, related):
+            if related is None:
+                emit(event({"recommended_artists": "error"}))
+                return
             try:
-                all_artists = await get_all_recommended_artists(
-                    artist_name, artist_id, client, headers, LASTFM_API_KEY, SOUNDCLOUD_CLIENT_ID
-                )
-                enriched_artists = await asyncio.gather(
-                    *[
-                        enrich_artist_metadata(
-                            name, client,
-                            {"lastfm": LASTFM_API_KEY, "soundcloud": SOUNDCLOUD_CLIENT_ID},
-                            token
-                        )
-                        for name in all_artists
-                    ]
-                )
-                yield "data: " + json.dumps({"recommended_artists": enriched_artists}) + "\n\n"
+                # enrich as many artists as the budget covers after the page's tracks; the rest go out as listed
+                spare = max(0, budget.remaining - owed["tracks"])
+                affordable = spare // costs.enrich_artist if costs.enrich_artist else len(related)
+                if affordable < len(related):
+                    budget.drop("artist_enrichment", len(related) - affordable)
+                with span("artist_enrichment", artists=min(affordable, len(related))):
+                    enriched_artists = await asyncio.gather(
+                        *[
+                            traced("enrich_artist", enrich_artist_metadata(
+                                artist["name"], LASTFM_API_KEY, SOUNDCLOUD_CLIENT_ID, auth[0], sources=metadata_sources
+                            ), artist=artist["name"])
+                            for artist in related[:affordable]
+                        ]
+                    )
+                enriched_artists += [_listed_artist(artist) for artist in related[affordable:]]
+                emit(event({"recommended_artists": [with_proxied_image(a) for a in enriched_artists]}))
             except Exception:
-                yield "data: " + json.dumps({"recommended_artists": "error"}) + "\n\n"
+                emit(event({"recommended_artists": "error"}))
+
+        async for chunk in pipeline.run():
+            yield chunk
+        if pipeline.stopped:
+            return
+
+        yield event({"stats": budget.stats()})
+        if root_span is not None:
+            yield event({"timing": profiling.report(root_span, profile)})
+
+        # --- Final signal ---
+        yield "data: [DONE]\n\n"
+
+
+async def _seed_artist_metadata(client, headers, artist_id, artist_name, providers):
+    if not artist_id or "spotify" not in provider_names(providers):
+        return None
+    try:
+        return await fetch_spotify_artist_metadata(client, headers, artist_id, artist_name)
+    except Exception as e:
+        log.warning("Seed artist metadata failed", error=repr(e))
+        return None
+
+
+async def _record_related(artist_name, artists):
+    names = [a["name"] for a in artists if a["source"] != "Local"]
+    await record(related_edges(artist_name, names))
+    note_artists(names)
 
-            # --- Final signal ---
-            yield "data: [DONE]\n\n"
 
-    return StreamingResponse(event_generator(track), media_type="text/event-stream")
+def _listed_artist(artist):
+    """A normalized related artist in the shape enrich_artist_metadata returns."""
+    listed = {"name": artist["name"], "image_url": artist["image_url"], "genres": artist["genres"]}
+    for source, url in artist["links"].items():
+        if url:
+            listed[f"{source}_url"] = url
+    return listed
+
 
 # Helper for recursive related tracks
-async def fetch_related_tracks_recursive(artist_name, artist_id, client, headers, depth, limit):
+async def fetch_related_tracks_recursive(artist_name, artist_id, client, headers, depth, limit, providers=None,
+                                         costs=None, related=None, owed=None):
+    """
+    Tracks of the artist's related artists, `depth` levels out. A whole level is
+    followed before the next one starts, so a short budget gives up the deepest
+    artists first. `related` is the artist's related-artist listing, if the caller
+    already has it; `owed` holds the calls still promised to the page's tracks.
+    """
     collected = []
     if depth <= 0:
         return collected
+    budget = current_budget.get()
+    providers = providers if providers is not None else select_providers()
     # get related artists
-    related = await get_all_recommended_artists(
-        artist_name, artist_id, client, headers, LASTFM_API_KEY, SOUNDCLOUD_CLIENT_ID
-    )
-    for rel_name in related[:5]:
-        try:
-            # fetch rel artist id
-            search_resp = await client.get("https://api.spotify.com/v1/search",
-                headers=headers, params={"q": f'artist:"{rel_name}"', "type": "artist", "limit": 1})
-            items = search_resp.json().get("artists", {}).get("items", [])
-            if not items:
-                continue
-            rel_id = items[0]["id"]
-            rel_artist_name = items[0]["name"]
-            # fetch tracks
-            tasks = [
-                fetch_spotify_tracks_and_metadata(client, headers, rel_id, rel_artist_name, limit=limit),
-                fetch_deezer_tracks(client, rel_artist_name, limit=limit),
-                fetch_deezer_related_tracks(client, rel_artist_name, limit=limit),
-                fetch_lastfm_tracks(client, rel_artist_name, LASTFM_API_KEY, limit=limit),
-                fetch_lastfm_similar_tracks(client, rel_artist_name, "", LASTFM_API_KEY, limit=limit),
-                get_soundcloud_recommendations("", rel_artist_name, client, SOUNDCLOUD_CLIENT_ID, limit=limit),
-            ]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            for r in results:
-                if isinstance(r, dict) and "tracks" in r:
-                    collected += r["tracks"]
-                elif isinstance(r, list):
-                    collected += r
-            # recursive deeper
-            deeper = await fetch_related_tracks_recursive(rel_artist_name, rel_id, client, headers, depth-1, limit)
-            collected += deeper
-        except Exception:
-            continue
+    if related is None:
+        related = await get_all_recommended_artists(
+            artist_name, artist_id, client, headers, LASTFM_API_KEY, SOUNDCLOUD_CLIENT_ID, providers
+        )
+        await _record_related(artist_name, related)
+    listings = [related]
+    for levels_left in range(depth, 0, -1):
+        next_listings = []
+        for listing in listings:
+            followed = listing[:DEPTH_FANOUT]
+            for i, rel in enumerate(followed):
+                # deep levels are the first thing to give up when the budget runs low
+                if budget is not None and costs is not None:
+                    cost = costs.depth_artist + (costs.related_listing if levels_left > 1 else 0)
+                    reserve = costs.artists + (owed["tracks"] if owed else 0)
+                    if not budget.affords(cost, reserve=reserve):
+                        budget.drop("depth_artists", len(followed) - i)
+                        return collected
+                rel_name = rel["name"]
+                try:
+                    with span("depth_artist", artist=rel_name, levels_left=levels_left):
+                        rel_id, rel_artist_name = None, rel_name
+                        if "spotify" in provider_names(providers):
+                            # fetch rel artist id (only Spotify's adapters need it)
+                            search_resp = await client.get("https://api.spotify.com/v1/search",
+                                headers=headers, params={"q": f'artist:"{rel_name}"', "type": "artist", "limit": 1})
+                            items = decode(search_resp, SpotifyArtistSearch).artists.items
+                            if not items:
+                                continue
+                            rel_id = items[0].id
+                            rel_artist_name = items[0].name
+                        # fetch tracks from the primary sources only, as the cost model counts them
+                        ctx = SeedContext(client, headers, rel_id, rel_artist_name, limit=limit)
+                        collected += await pull_tracks(track_streams(providers, ctx, secondary=False), limit)
+                        # list its related artists for the next level
+                        if levels_left > 1:
+                            deeper = await get_all_recommended_artists(
+                                rel_artist_name, rel_id, client, headers, LASTFM_API_KEY, SOUNDCLOUD_CLIENT_ID,
+                                providers
+                            )
+                            await _record_related(rel_artist_name, deeper)
+                            next_listings.append(deeper)
+                except Exception:
+                    continue
+        listings = next_listings
     return collected
 
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return metrics.render()
+
+
 @app.get("/token")
 async def get_spotify_tokenn():
     auth_header = base64.b64encode(
         f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()
     ).decode()
 
-    async with httpx.AsyncClient() as client:
+    async with upstream_client(budgeted=False) as client:
         res = await client.post(
             "https://accounts.spotify.com/api/token",
             headers={"Authorization": f"Basic {auth_header}"},
@@ -0,0 +1,119 @@
+"""
+Precompute by-track recommendations for a list of seeds.
+
+    python precompute.py seeds.txt -o snapshot.bin --concurrency 8 [--ndjson out.ndjson]
+
+Seeds are read one per line ("Title - Artist"); blank lines and lines
+starting with # are skipped. Each seed runs through the same pipeline as
+/recommendations/by-track, and the results are written to a snapshot the
+API memory-maps at startup (SNAPSHOT_PATH).
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from main import by_track_event_generator
+from utils.providers import UnknownSourceError, provider_names, select_providers
+from utils.singleflight import normalize_query
+from utils.snapshot import write_snapshot
+
+
+def read_seeds(path):
+    seeds = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            key = normalize_query(line)
+            if key in seen:
+                continue
+            seen.add(key)
+            seeds.append(line)
+    return seeds
+
+
+def parse_event(chunk):
+    payload = chunk[len("data: "):].strip()
+    if payload == "[DONE]":
+        return None
+    return json.loads(payload)
+
+
+async def compute_seed(seed, params, providers):
+    events = []
+    async for chunk in by_track_event_generator(
+        seed, params["limit"], params["offset"], False, params["include_original"], params["depth"], providers
+    ):
+        event = parse_event(chunk)
+        if event is None or "stats" in event or "timing" in event:
+            continue
+        if "error" in event:
+            raise RuntimeError(event["error"])
+        events.append(event)
+    return events
+
+
+async def precompute(seeds, params, providers, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    records = {}
+    failed = []
+
+    async def run(seed):
+        async with semaphore:
+            try:
+                records[seed] = await compute_seed(seed, params, providers)
+            except Exception as e:
+                failed.append((seed, str(e)))
+
+    await asyncio.gather(*[run(seed) for seed in seeds])
+    return records, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("seeds", help="file with one seed per line")
+    parser.add_argument("-o", "--output", default="snapshot.bin")
+    parser.add_argument("--ndjson", help="also export the results as NDJSON to this path")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=1, choices=(1, 2, 3))
+    parser.add_argument("--include-original", action="store_true")
+    parser.add_argument("--sources")
+    parser.add_argument("--exclude-sources")
+    args = parser.parse_args(argv)
+
+    seeds = read_seeds(args.seeds)
+    try:
+        providers = select_providers(args.sources, args.exclude_sources)
+    except UnknownSourceError as e:
+        parser.error(str(e))
+    params = {
+        "limit": args.limit,
+        "offset": 0,
+        "include_original": args.include_original,
+        "depth": args.depth,
+        "sources": list(provider_names(providers)),
+    }
+
+    started = time.perf_counter()
+    records, failed = asyncio.run(precompute(seeds, params, providers, max(1, args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    written = write_snapshot(args.output, params, records)
+    if args.ndjson:
+        with open(args.ndjson, "w", encoding="utf-8") as f:
+            for seed, events in records.items():
+                f.write(json.dumps({"seed": seed, "params": params, "events": events}, ensure_ascii=False) + "\n")
+
+    print(f"{written}/{len(seeds)} seeds written to {args.output} in {elapsed:.1f}s")
+    for seed, error in failed:
+        print(f"  failed: {seed}: {error}", file=sys.stderr)
+    return 0 if written else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
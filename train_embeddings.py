@@ -0,0 +1,47 @@
+"""
+Train the local similarity model from the co-occurrence store.
+
+    python train_embeddings.py -o embeddings.npz --dim 64 --min-degree 2
+
+Reads the edges the API has recorded (CACHE_DIR/cooccurrence.sqlite3),
+builds artist, track and tag vectors, and writes them where the API loads
+them from (EMBEDDINGS_PATH). Restart the API to pick up a new model.
+"""
+import argparse
+import sys
+import time
+
+from utils.cooccurrence import store
+from utils.embeddings import np, train, write_embeddings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", default="embeddings.npz")
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--min-degree", type=float, default=2.0, help="drop nodes with less total edge weight")
+    parser.add_argument("--min-weight", type=float, default=0.0, help="drop edges lighter than this")
+    parser.add_argument("--power-iters", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    if np is None:
+        print("NumPy is required to train embeddings", file=sys.stderr)
+        return 1
+    if store is None:
+        print("No co-occurrence store (caching or recording is disabled)", file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    nodes, vectors = train(store.iter_edges(args.min_weight), args.dim, args.min_degree, args.power_iters)
+    elapsed = time.perf_counter() - started
+    if not len(nodes):
+        print("Not enough co-occurrence data to train on yet", file=sys.stderr)
+        return 1
+
+    written = write_embeddings(args.output, nodes, vectors, store.labels())
+    print(f"{written} vectors ({vectors.shape[1]} dims) written to {args.output} in {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Admission control for the expensive endpoints.
+
+Each endpoint gets a cap on concurrent requests and a bounded FIFO wait
+queue. A request that finds the queue full, or waits longer than the
+queue timeout, is shed with 503 + Retry-After instead of slowing down
+everyone already admitted.
+"""
+import asyncio
+import math
+import os
+import time
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from utils import metrics
+
+load_dotenv()
+
+MAX_STREAMS = int(os.getenv("ADMISSION_MAX_STREAMS", "32"))
+MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+
+metrics.describe("admission_active", "Requests currently admitted")
+metrics.describe("admission_queued", "Requests waiting for a slot")
+metrics.describe("admission_admitted_total", "Requests admitted")
+metrics.describe("admission_shed_total", "Requests rejected with 503")
+metrics.describe("admission_wait_seconds_total", "Time admitted requests spent queued")
+
+
+class Permit:
+    __slots__ = ("controller", "started", "released")
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.started = time.perf_counter()
+        self.released = False
+
+    def release(self):
+        # called from both the stream's finally and the response's background task
+        if not self.released:
+            self.released = True
+            self.controller._release(time.perf_counter() - self.started)
+
+
+class AdmissionController:
+    def __init__(self, name, max_active=MAX_STREAMS, max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT):
+        self.name = name
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self._slots = asyncio.Semaphore(max_active)
+        # smoothed time a request holds its slot, for Retry-After
+        self._hold_seconds = 1.0
+
+    def _update_gauges(self):
+        metrics.set_gauge("admission_active", self.active, endpoint=self.name)
+        metrics.set_gauge("admission_queued", self.queued, endpoint=self.name)
+
+    def retry_after(self):
+        backlog = (self.queued + 1) / max(1, self.max_active)
+        return max(1, math.ceil(backlog * self._hold_seconds))
+
+    def _shed(self, reason):
+        metrics.inc("admission_shed_total", endpoint=self.name, reason=reason)
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, try again shortly",
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    async def acquire(self):
+        """Wait for a slot and return a Permit, or raise 503."""
+        if self.active >= self.max_active and self.queued >= self.max_queue:
+            self._shed("queue_full")
+        self.queued += 1
+        self._update_gauges()
+        waited = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._shed("timeout")
+        finally:
+            self.queued -= 1
+            self._update_gauges()
+        metrics.inc("admission_wait_seconds_total", time.perf_counter() - waited, endpoint=self.name)
+        metrics.inc("admission_admitted_total", endpoint=self.name)
+        self.active += 1
+        self._update_gauges()
+        return Permit(self)
+
+    def _release(self, held):
+        self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held
+        self.active -= 1
+        self._slots.release()
+        self._update_gauges()
+
+    async def stream(self, permit, source):
+        """Pass `source` through, giving the slot back when the stream ends or is closed."""
+        try:
+            async for chunk in source:
+                yield chunk
+        finally:
+            permit.release()
+
+
+_controllers = {}
+
+
+def controller(name):
+    if name not in _controllers:
+        _controllers[name] = AdmissionController(name)
+    return _controllers[name]
@@ -0,0 +1,231 @@
+"""
+Seed suggestions from the tracks and artists providers have returned to us.
+
+Every candidate track and related artist the pipeline sees is counted in
+an in-memory batch. A background task flushes the batch every
+AUTOCOMPLETE_FLUSH_INTERVAL seconds (sooner once it holds
+AUTOCOMPLETE_FLUSH_SIZE names) into a SQLite FTS5 index next to the
+response cache, from a worker thread. A query matches names containing
+all of its words, the last one as a prefix, ranked by how often each name
+has been seen. Answering never costs an upstream call.
+"""
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from utils import metrics
+from utils.cache import CACHE_DIR, CACHE_DISABLED, MISS, MemoryCache, refresh_margin
+from utils.log import get_logger
+
+load_dotenv()
+
+log = get_logger("autocomplete")
+
+AUTOCOMPLETE_DISABLED = os.getenv("AUTOCOMPLETE_DISABLED", "").lower() in ("1", "true", "yes")
+AUTOCOMPLETE_FLUSH_INTERVAL = float(os.getenv("AUTOCOMPLETE_FLUSH_INTERVAL", "5"))
+AUTOCOMPLETE_FLUSH_SIZE = int(os.getenv("AUTOCOMPLETE_FLUSH_SIZE", "2000"))
+# Answers per query string are reused this long
+AUTOCOMPLETE_TTL = float(os.getenv("AUTOCOMPLETE_TTL", "30"))
+
+TRACK = "track"
+ARTIST = "artist"
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+metrics.describe("autocomplete_queries_total", "Autocomplete queries, by whether the answer was memoized")
+metrics.describe("autocomplete_flushed_total", "Names written to the autocomplete index")
+
+
+def _norm(text):
+    return " ".join((text or "").lower().split())
+
+
+def match_expression(query):
+    """FTS5 MATCH for `query`: every word required, the last one as a prefix unless the user typed past it."""
+    words = _WORD.findall(query.lower())
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    if not query[-1:].isspace():
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+class AutocompleteIndex:
+    """Seen counts per name plus a contentless FTS5 index over them, shared by every worker on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS names ("
+            " id INTEGER PRIMARY KEY,"
+            " key TEXT NOT NULL UNIQUE,"
+            " kind TEXT NOT NULL,"
+            " title TEXT,"
+            " artist TEXT NOT NULL,"
+            " seen INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS names_fts USING fts5("
+            " text, content='', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')"
+        )
+        # names never change, so the index only ever needs new rows
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS names_indexed AFTER INSERT ON names BEGIN"
+            " INSERT INTO names_fts (rowid, text) VALUES (new.id, coalesce(new.title || ' ', '') || new.artist);"
+            " END"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, rows):
+        """Add `(key, kind, title, artist, count)` rows, summing counts of names already indexed."""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO names (key, kind, title, artist, seen) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET seen = seen + excluded.seen",
+                rows,
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def search(self, expression, limit):
+        return self._conn().execute(
+            "SELECT kind, title, artist, seen FROM names"
+            " WHERE id IN (SELECT rowid FROM names_fts WHERE names_fts MATCH ?)"
+            " ORDER BY seen DESC LIMIT ?",
+            (expression, limit),
+        ).fetchall()
+
+
+def _open_index():
+    if CACHE_DISABLED or AUTOCOMPLETE_DISABLED:
+        return None
+    try:
+        return AutocompleteIndex(os.path.join(CACHE_DIR, "autocomplete.sqlite3"))
+    except Exception as e:
+        log.warning("Index unavailable, suggestions disabled", error=repr(e))
+        return None
+
+
+index = _open_index()
+
+# key -> [kind, title, artist, count] seen since the last flush
+_pending = {}
+_answers = MemoryCache(max_entries=4096)
+
+
+def _note(kind, title, artist):
+    artist = (artist or "").strip()
+    if not artist:
+        return
+    key = f"{kind}:{_norm(title)}|{_norm(artist)}" if kind == TRACK else f"{kind}:{_norm(artist)}"
+    entry = _pending.get(key)
+    if entry is None:
+        _pending[key] = [kind, title, artist, 1]
+    else:
+        entry[3] += 1
+
+
+def note_tracks(tracks):
+    """Count (title, artist) pairs the providers returned."""
+    if index is None or refresh_margin.get() is not None:
+        return
+    for title, artist in tracks:
+        if title:
+            _note(TRACK, title.strip(), artist)
+            _note(ARTIST, None, artist)
+    if len(_pending) >= AUTOCOMPLETE_FLUSH_SIZE:
+        _schedule_flush()
+
+
+def note_artists(names):
+    if index is None or refresh_margin.get() is not None:
+        return
+    for name in names:
+        _note(ARTIST, None, name)
+    if len(_pending) >= AUTOCOMPLETE_FLUSH_SIZE:
+        _schedule_flush()
+
+
+async def flush():
+    """Write everything counted so far to the index."""
+    global _pending
+    if index is None or not _pending:
+        return
+    batch, _pending = _pending, {}
+    rows = [(key, kind, title, artist, count) for key, (kind, title, artist, count) in batch.items()]
+    try:
+        await asyncio.to_thread(index.add, rows)
+    except Exception as e:
+        log.warning("Write failed", error=repr(e))
+        return
+    metrics.inc("autocomplete_flushed_total", len(rows))
+
+
+_flush_task = None
+
+
+def _schedule_flush():
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(flush())
+
+
+async def suggest(query, limit=10):
+    """Up to `limit` tracks and artists matching `query`, most seen first."""
+    expression = match_expression(query)
+    if index is None or expression is None:
+        return []
+    memo_key = (expression, limit)
+    results, _ = _answers.get_entry(memo_key)
+    if results is not MISS:
+        metrics.inc("autocomplete_queries_total", memoized="true")
+        return results
+    metrics.inc("autocomplete_queries_total", memoized="false")
+    rows = await asyncio.to_thread(index.search, expression, limit)
+    results = [
+        {"type": TRACK, "title": title, "artist": artist, "seed": f"{title} - {artist}", "seen": seen}
+        if kind == TRACK else
+        {"type": ARTIST, "name": artist, "seed": artist, "seen": seen}
+        for kind, title, artist, seen in rows
+    ]
+    _answers.set(memo_key, results, time.time() + AUTOCOMPLETE_TTL)
+    return results
+
+
+async def _run_forever():
+    while True:
+        await asyncio.sleep(AUTOCOMPLETE_FLUSH_INTERVAL)
+        await flush()
+
+
+_task = None
+
+
+def start_autocomplete():
+    """Start the background flush loop (once per process)."""
+    global _task
+    if index is None or (_task is not None and not _task.done()):
+        return _task
+    _task = asyncio.create_task(_run_forever())
+    return _task
@@ -0,0 +1,95 @@
+"""
+Per-request upstream call budget.
+
+A by-track request carries a Budget in a context variable; every request
+made through utils.http.upstream_client is charged against it, including
+those made from gathered tasks. Cache hits are free. When the budget is
+spent further calls raise BudgetExceeded, but the pipeline checks
+`affords()` first and drops its lowest-value work before that happens:
+deep levels, then enrichment, then secondary sources.
+"""
+import contextvars
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Hard ceiling for any single request, whatever it asks for
+MAX_BUDGET = int(os.getenv("UPSTREAM_BUDGET_MAX", "600"))
+
+# Rough call counts for the cost model
+SEED_CALLS = 3            # loose and strict Spotify searches, Deezer search
+ENRICH_CALLS = 1          # Discogs, plus one per link source
+DEPTH_FANOUT = 5          # related artists followed per level
+DEPTH_SEARCH_CALLS = 1    # Spotify id lookup per followed artist
+
+current_budget = contextvars.ContextVar("upstream_budget", default=None)
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class Budget:
+    __slots__ = ("limit", "spent", "denied", "dropped")
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.spent = 0
+        self.denied = 0
+        self.dropped = {}
+
+    @property
+    def remaining(self):
+        return max(0, self.limit - self.spent)
+
+    def charge(self, request=None):
+        if self.spent >= self.limit:
+            self.denied += 1
+            raise BudgetExceeded(f"upstream budget of {self.limit} calls spent")
+        self.spent += 1
+
+    def affords(self, cost, reserve=0):
+        """True if `cost` more calls fit while keeping `reserve` for higher-value work."""
+        return self.remaining - reserve >= cost
+
+    def drop(self, what, count=1):
+        self.dropped[what] = self.dropped.get(what, 0) + count
+
+    def stats(self):
+        return {
+            "budget": self.limit,
+            "spent": self.spent,
+            "remaining": self.remaining,
+            "denied": self.denied,
+            "dropped": dict(self.dropped),
+        }
+
+
+class CostModel:
+    """Estimated upstream calls for each stage of a by-track request."""
+
+    def __init__(self, providers, limit, depth, link_sources, metadata_sources):
+        from utils.providers import fetch_calls, related_artist_calls, related_artist_count
+
+        self.primary = SEED_CALLS + fetch_calls(providers)
+        self.secondary = fetch_calls(providers, secondary=True) - fetch_calls(providers)
+        self.enrich_track = ENRICH_CALLS + len(link_sources)
+        self.related_listing = related_artist_calls(providers)
+        self.enrich_artist = len(metadata_sources)
+        self.artists = self.related_listing + related_artist_count(providers) * self.enrich_artist
+        # following one related artist: id lookup and its primary fetches; its listing
+        # when there is a level below, and its tracks' enrichment, are counted apart
+        self.depth_artist = DEPTH_SEARCH_CALLS + fetch_calls(providers)
+        followed = sum(DEPTH_FANOUT ** level for level in range(1, depth))
+        listed = sum(DEPTH_FANOUT ** level for level in range(1, depth - 1))
+        self.deep = (
+            followed * (self.depth_artist + limit * self.enrich_track)
+            + listed * self.related_listing
+        )
+        self.full = self.primary + self.secondary + limit * self.enrich_track + self.artists + self.deep
+
+
+def default_budget(costs):
+    return min(MAX_BUDGET, costs.full)
@@ -0,0 +1,287 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import inspect
+import marshal
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from utils.budget import current_budget
+from utils.log import get_logger
+
+load_dotenv()
+
+log = get_logger("cache")
+
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CACHE_L1_SIZE = int(os.getenv("CACHE_L1_SIZE", "2048"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(6 * 3600)))
+CACHE_DISABLED = os.getenv("CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+# Values above this size are zlib-compressed before hitting disk
+COMPRESS_MIN_BYTES = 512
+# Run the size check every N writes rather than on each one
+EVICT_EVERY = 64
+
+# Bump when the shape of cached values changes so stale rows are never decoded
+CACHE_VERSION = 2
+
+MISS = object()
+
+# Set while refreshing ahead of expiry (see utils.popularity): cached calls
+# then go upstream for entries with less than this many seconds left.
+refresh_margin = contextvars.ContextVar("cache_refresh_margin", default=None)
+
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+
+
+def dumps(value):
+    data = marshal.dumps(value)
+    if len(data) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(data, 3)
+        if len(packed) < len(data):
+            return _ZLIB + packed
+    return _RAW + data
+
+
+def loads(blob):
+    if blob[:1] == _ZLIB:
+        return marshal.loads(zlib.decompress(blob[1:]))
+    return marshal.loads(blob[1:])
+
+
+class MemoryCache:
+    """
+    Per-process LRU with per-entry expiry (the L1 tier). Values are kept
+    serialized so callers can't mutate what's cached.
+    """
+
+    def __init__(self, max_entries=CACHE_L1_SIZE):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+
+    def get(self, key):
+        return self.get_entry(key)[0]
+
+    def get_entry(self, key):
+        """(value, expires), or (MISS, 0)."""
+        entry = self._data.get(key)
+        if entry is None:
+            return MISS, 0
+        expires, value = entry
+        if expires < time.time():
+            del self._data[key]
+            return MISS, 0
+        self._data.move_to_end(key)
+        return value, expires
+
+    def set(self, key, value, expires):
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+
+class DiskCache:
+    """
+    SQLite (WAL mode) key/value store shared by every worker on the host
+    (the L2 tier). Entries survive restarts; the file is kept under
+    `max_bytes` by evicting the least recently read entries.
+    """
+
+    def __init__(self, path, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " expires REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return MISS, 0
+        blob, expires = row
+        now = time.time()
+        if expires < now:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return MISS, 0
+        conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return bytes(blob), expires
+
+    def set(self, key, blob, expires):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, blob, len(blob), expires, time.time()),
+        )
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def evict(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM entries WHERE expires < ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        # Trim to 90% so we don't evict again on the very next write
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        evicted = 0
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            if freed >= target:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            freed += size
+            evicted += 1
+        return evicted
+
+
+class TieredCache:
+    """L1 in-process cache in front of the shared on-disk L2 (and, in cluster mode, the owning peer)."""
+
+    def __init__(self, l1, l2, peers=None):
+        self.l1 = l1
+        self.l2 = l2
+        # In cluster mode, the caches of the nodes owning each key (see utils.cluster)
+        self.peers = peers
+
+    async def get(self, key):
+        return (await self.get_entry(key))[0]
+
+    async def get_entry(self, key, remote=True):
+        """(value, expires), or (MISS, 0). `remote=False` skips the peers."""
+        blob, expires = self.l1.get_entry(key)
+        if blob is not MISS:
+            return loads(blob), expires
+        blob = MISS
+        if self.l2 is not None:
+            try:
+                blob, expires = await asyncio.to_thread(self.l2.get, key)
+            except Exception as e:
+                log.warning("L2 read failed", error=repr(e))
+        if blob is MISS and remote and self.peers is not None:
+            blob, expires = await self.peers.get(key)
+        if blob is MISS:
+            return MISS, 0
+        self.l1.set(key, blob, expires)
+        return loads(blob), expires
+
+    async def set(self, key, value, ttl=CACHE_TTL, remote=True):
+        expires = time.time() + ttl
+        blob = dumps(value)
+        await self.store(key, blob, expires)
+        if remote and self.peers is not None:
+            self.peers.put(key, blob, expires)
+
+    async def store(self, key, blob, expires):
+        """Keep an already serialized entry in this host's tiers."""
+        self.l1.set(key, blob, expires)
+        if self.l2 is None:
+            return
+        try:
+            await asyncio.to_thread(self.l2.set, key, blob, expires)
+        except Exception as e:
+            log.warning("L2 write failed", error=repr(e))
+
+    async def delete(self, key):
+        self.l1.delete(key)
+        if self.l2 is not None:
+            await asyncio.to_thread(self.l2.delete, key)
+
+
+def _open_l2():
+    if CACHE_DISABLED:
+        return None
+    try:
+        return DiskCache(os.path.join(CACHE_DIR, "l2.sqlite3"))
+    except Exception as e:
+        log.warning("L2 unavailable, running with L1 only", error=repr(e))
+        return None
+
+
+cache = TieredCache(MemoryCache(), _open_l2())
+
+# Arguments that never change what an upstream call returns
+_SKIP_ARGS = {"client", "headers", "api_key", "lastfm_key", "soundcloud_id",
+              "soundcloud_client_id", "spotify_token", "SPOTIFY_TOKEN", "deezer_client",
+              "debug"}
+
+
+def make_key(namespace, *parts):
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    return f"v{CACHE_VERSION}:{namespace}:{digest}"
+
+
+def cached(namespace, ttl=CACHE_TTL, encode=None, decode=None):
+    """
+    Read-through cache for an async function. The key is built from the
+    call's arguments, minus clients, headers and credentials. `encode` and
+    `decode` convert results that marshal can't store as-is. Under
+    `refresh_margin`, entries close to expiry are fetched again.
+    """
+    def decorator(fn):
+        sig = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if CACHE_DISABLED:
+                return await fn(*args, **kwargs)
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            parts = tuple(
+                (name, value.lower().strip() if isinstance(value, str) else value)
+                for name, value in bound.arguments.items()
+                if name not in _SKIP_ARGS
+            )
+            key = make_key(namespace, *parts)
+
+            margin = refresh_margin.get()
+            value, expires = await cache.get_entry(key)
+            if value is not MISS and (margin is None or expires - time.time() > margin):
+                return decode(value) if decode else value
+            budget = current_budget.get()
+            denied = budget.denied if budget else 0
+            value = await fn(*args, **kwargs)
+            # a result cut short by the request's call budget must not outlive the request
+            if budget is None or budget.denied == denied:
+                await cache.set(key, encode(value) if encode else value, ttl)
+            return value
+
+        return wrapper
+    return decorator
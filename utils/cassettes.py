@@ -0,0 +1,238 @@
+"""
+Record and replay upstream HTTP traffic.
+
+With UPSTREAM_MODE=record, every request made through utils.http goes out
+as usual, and the exchange is appended to a gzipped JSON-lines cassette
+per upstream host under CASSETTE_DIR. Request headers are never stored.
+Secrets are redacted from URLs and bodies (see utils.log.redact), and
+response bodies are stored decoded. The full response time is stored too.
+
+With UPSTREAM_MODE=replay, nothing reaches the network. Each request is
+answered from the cassettes after waiting the time the recorded response
+took (scaled by REPLAY_SPEED; 0 answers at once). A request with no exact
+recording gets one recorded for the same path, in turn, so searches with
+random letters or offsets still get production-shaped answers. A request
+for a path never recorded fails like an unreachable host.
+"""
+import asyncio
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import httpx
+from dotenv import load_dotenv
+
+from utils import metrics
+from utils.log import get_logger, redact
+
+load_dotenv()
+
+log = get_logger("cassettes")
+
+UPSTREAM_MODE = os.getenv("UPSTREAM_MODE", "").lower()
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "cassettes")
+# Recorded latencies are multiplied by this on replay
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "1"))
+# Exchanges held in memory before they are appended to the cassettes
+CASSETTE_FLUSH_SIZE = int(os.getenv("CASSETTE_FLUSH_SIZE", "50"))
+
+RECORD = "record"
+REPLAY = "replay"
+
+metrics.describe("upstream_recorded_total", "Upstream exchanges written to cassettes")
+metrics.describe("upstream_replayed_total", "Upstream requests answered from cassettes, by how they matched")
+
+
+def _path(host):
+    return os.path.join(CASSETTE_DIR, host.replace(":", "_") + ".jsonl.gz")
+
+
+def _key(method, url, body):
+    """Match key for a request; `url` is already redacted, so keys are the same with any credentials."""
+    key = f"{method} {url}"
+    if body:
+        key += " " + hashlib.blake2b(redact(body.decode("utf-8", "replace")).encode(), digest_size=8).hexdigest()
+    return key
+
+
+def _route(method, url):
+    parts = urlsplit(url)
+    return f"{method} {parts.netloc}{parts.path}"
+
+
+def _entry(request, response, body, seconds):
+    url = redact(str(request.url))
+    try:
+        text, encoded = redact(body.decode("utf-8")), False
+    except UnicodeDecodeError:
+        text, encoded = base64.b64encode(body).decode("ascii"), True
+    entry = {
+        "key": _key(request.method, url, request.content),
+        "route": _route(request.method, url),
+        "status": response.status_code,
+        "type": response.headers.get("content-type"),
+        "ms": round(seconds * 1000, 1),
+        "body": text,
+    }
+    if encoded:
+        entry["b64"] = True
+    return entry
+
+
+class Recorder:
+    """Buffers recorded exchanges per host and appends them to the cassettes in a worker thread."""
+
+    def __init__(self):
+        self._pending = defaultdict(list)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, host, entry):
+        self._pending[host].append(entry)
+        self._count += 1
+        metrics.inc("upstream_recorded_total", host=host)
+        if self._count >= CASSETTE_FLUSH_SIZE:
+            asyncio.get_running_loop().run_in_executor(None, self._write, self._take())
+
+    def _take(self):
+        batch, self._pending, self._count = self._pending, defaultdict(list), 0
+        return batch
+
+    def _write(self, batch):
+        with self._lock:
+            os.makedirs(CASSETTE_DIR, exist_ok=True)
+            for host, entries in batch.items():
+                # each flush adds a gzip member; readers see one continuous stream
+                with gzip.open(_path(host), "at", encoding="utf-8") as f:
+                    f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+
+    async def flush(self):
+        if self._count:
+            await asyncio.to_thread(self._write, self._take())
+
+    def flush_sync(self):
+        if self._count:
+            self._write(self._take())
+
+
+class Library:
+    """Recordings loaded per host on first use, looked up by exact key and then by route."""
+
+    def __init__(self):
+        self._hosts = {}
+        self._turns = defaultdict(int)
+
+    def _load(self, host):
+        exact, routes = defaultdict(list), defaultdict(list)
+        try:
+            with gzip.open(_path(host), "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    exact[entry["key"]].append(entry)
+                    routes[entry["route"]].append(entry)
+        except FileNotFoundError:
+            pass
+        return exact, routes
+
+    async def _recordings(self, host):
+        loading = self._hosts.get(host)
+        if loading is None:
+            # concurrent first requests for a host wait for the same load
+            loading = self._hosts[host] = asyncio.ensure_future(asyncio.to_thread(self._load, host))
+        return await loading
+
+    def _next(self, name, entries):
+        # recordings for the same request take turns, like the upstream's answers varied
+        turn = self._turns[name]
+        self._turns[name] = turn + 1
+        return entries[turn % len(entries)]
+
+    async def find(self, request):
+        exact, routes = await self._recordings(request.url.netloc.decode("ascii"))
+        url = redact(str(request.url))
+        key = _key(request.method, url, request.content)
+        if key in exact:
+            metrics.inc("upstream_replayed_total", match="exact")
+            return self._next(key, exact[key])
+        route = _route(request.method, url)
+        if route in routes:
+            metrics.inc("upstream_replayed_total", match="route")
+            return self._next(route, routes[route])
+        metrics.inc("upstream_replayed_total", match="miss")
+        return None
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, recorder):
+        self._inner = httpx.AsyncHTTPTransport()
+        self._recorder = recorder
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        start = time.perf_counter()
+        response = await self._inner.handle_async_request(request)
+        try:
+            raw = b"".join([chunk async for chunk in response.aiter_raw()])
+        finally:
+            await response.aclose()
+        seconds = time.perf_counter() - start
+        # decoded the same way the client will, so replay doesn't depend on content-encoding
+        decoded = httpx.Response(response.status_code, headers=response.headers, content=raw)
+        self._recorder.add(request.url.netloc.decode("ascii"),
+                           _entry(request, response, decoded.content, seconds))
+        return httpx.Response(response.status_code, headers=response.headers, stream=httpx.ByteStream(raw),
+                              extensions=response.extensions)
+
+    async def aclose(self):
+        await self._inner.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, library):
+        self._library = library
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        entry = await self._library.find(request)
+        if entry is None:
+            raise httpx.ConnectError(f"no recording for {request.method} {redact(str(request.url))}",
+                                     request=request)
+        if REPLAY_SPEED > 0:
+            await asyncio.sleep(entry["ms"] / 1000 * REPLAY_SPEED)
+        body = base64.b64decode(entry["body"]) if entry.get("b64") else entry["body"].encode("utf-8")
+        headers = {"content-type": entry["type"]} if entry["type"] else {}
+        return httpx.Response(entry["status"], headers=headers, content=body, request=request)
+
+
+recorder = Recorder() if UPSTREAM_MODE == RECORD else None
+library = Library() if UPSTREAM_MODE == REPLAY else None
+
+if recorder is not None:
+    atexit.register(recorder.flush_sync)
+    log.info("Recording upstream traffic", cassettes=CASSETTE_DIR)
+elif library is not None:
+    log.info("Replaying upstream traffic", cassettes=CASSETTE_DIR, speed=REPLAY_SPEED)
+elif UPSTREAM_MODE:
+    log.error("Unknown UPSTREAM_MODE; using the network", mode=UPSTREAM_MODE)
+
+
+def transport():
+    """The transport for a new upstream client, or None for httpx's own in normal mode."""
+    if recorder is not None:
+        return RecordingTransport(recorder)
+    if library is not None:
+        return ReplayTransport(library)
+    return None
+
+
+async def flush():
+    """Write recorded exchanges still in memory."""
+    if recorder is not None:
+        await recorder.flush()
@@ -0,0 +1,234 @@
+"""
+Optional cluster mode: each API node owns a consistent-hash shard of keys.
+
+CLUSTER_NODES lists every node's base URL (the same list on every node) and
+CLUSTER_SELF names this one. Keys are placed on a ring of CLUSTER_VNODES
+points per node, so adding or removing a node only moves that node's share.
+
+Two things are routed:
+  - requests, by their normalized seed: a node that doesn't own the seed
+    relays the request to the owner, so one node's result cache, single-
+    flight and popularity counts see all traffic for that seed;
+  - cache entries, by cache key: after a local miss, the owner's cache is
+    asked before going upstream, and new entries are pushed to the owner,
+    so the per-artist lookups any seed needs are fetched once per cluster.
+
+A peer that can't be reached is skipped for CLUSTER_RETRY_AFTER seconds:
+its keys fall to the next node on the ring, or are handled locally, so a
+node going down costs cache locality, never availability.
+"""
+import asyncio
+import bisect
+import hashlib
+import hmac
+import os
+import time
+
+import httpx
+from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from utils import metrics
+from utils.cache import MISS, cache
+from utils.log import get_logger
+
+load_dotenv()
+
+log = get_logger("cluster")
+
+CLUSTER_NODES = [n.strip().rstrip("/") for n in os.getenv("CLUSTER_NODES", "").split(",") if n.strip()]
+CLUSTER_SELF = os.getenv("CLUSTER_SELF", "").rstrip("/")
+CLUSTER_VNODES = int(os.getenv("CLUSTER_VNODES", "128"))
+# Shared secret peers send with cache calls; cluster mode stays off without one
+CLUSTER_SECRET = os.getenv("CLUSTER_SECRET", "")
+CLUSTER_RETRY_AFTER = float(os.getenv("CLUSTER_RETRY_AFTER", "10"))
+CLUSTER_CONNECT_TIMEOUT = float(os.getenv("CLUSTER_CONNECT_TIMEOUT", "0.5"))
+# A remote cache lookup slower than this counts as a miss
+CLUSTER_CACHE_TIMEOUT = float(os.getenv("CLUSTER_CACHE_TIMEOUT", "0.25"))
+
+# Set on relayed requests; a relayed request is always handled where it lands
+HOP_HEADER = "x-cluster-hop"
+SECRET_HEADER = "x-cluster-secret"
+EXPIRES_HEADER = "x-cache-expires"
+# Request headers that change the answer and are passed on to the owner
+_PASSED_HEADERS = ("accept", "accept-encoding", "if-none-match", "x-profile", "x-debug-key", "x-request-id")
+_HOP_BY_HOP = {"connection", "keep-alive", "transfer-encoding", "te", "trailer", "upgrade"}
+
+metrics.describe("cluster_forwarded_total", "Requests relayed to the node owning their seed")
+metrics.describe("cluster_peer_failures_total", "Calls to a peer that failed and marked it down")
+metrics.describe("cluster_remote_cache_total", "Cache lookups sent to the owning peer, by result")
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes, vnodes=CLUSTER_VNODES):
+        self.nodes = list(dict.fromkeys(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def preference(self, key):
+        """Every node, in the order they take over `key`: owner first, then clockwise."""
+        if not self._hashes:
+            return []
+        start = bisect.bisect(self._hashes, _hash(key))
+        order = []
+        for i in range(len(self._owners)):
+            node = self._owners[(start + i) % len(self._owners)]
+            if node not in order:
+                order.append(node)
+                if len(order) == len(self.nodes):
+                    break
+        return order
+
+
+class Cluster:
+    def __init__(self, nodes, self_url):
+        self.ring = HashRing(nodes)
+        self.self_url = self_url
+        self._down_until = {}
+        self._client = None
+        self._pushes = set()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(None, connect=CLUSTER_CONNECT_TIMEOUT),
+                headers={SECRET_HEADER: CLUSTER_SECRET},
+            )
+        return self._client
+
+    def owner(self, key):
+        """The node that should serve `key` now: its owner, or the next one up if the owner is down."""
+        now = time.monotonic()
+        order = self.ring.preference(key)
+        for node in order:
+            if node == self.self_url or self._down_until.get(node, 0) <= now:
+                return node
+        return self.self_url
+
+    def mark_down(self, node, error):
+        if self._down_until.get(node, 0) <= time.monotonic():
+            log.warning("Peer unavailable", peer=node, retry_after=CLUSTER_RETRY_AFTER, error=repr(error))
+        self._down_until[node] = time.monotonic() + CLUSTER_RETRY_AFTER
+        metrics.inc("cluster_peer_failures_total", peer=node)
+
+    # --- cache tier (plugged into utils.cache.cache.peers) ---
+
+    async def get(self, key):
+        """(blob, expires) from the owning peer's cache, or (MISS, 0)."""
+        node = self.owner(key)
+        if node == self.self_url:
+            return MISS, 0
+        try:
+            resp = await self.client.get(f"{node}/cluster/cache/{key}", timeout=CLUSTER_CACHE_TIMEOUT)
+        except httpx.TimeoutException:
+            # slow, not down: skip this lookup only
+            metrics.inc("cluster_remote_cache_total", result="timeout")
+            return MISS, 0
+        except httpx.HTTPError as e:
+            self.mark_down(node, e)
+            return MISS, 0
+        if resp.status_code != 200:
+            metrics.inc("cluster_remote_cache_total", result="miss")
+            return MISS, 0
+        metrics.inc("cluster_remote_cache_total", result="hit")
+        return resp.content, float(resp.headers[EXPIRES_HEADER])
+
+    def put(self, key, blob, expires):
+        """Hand a new entry to its owner in the background."""
+        node = self.owner(key)
+        if node == self.self_url:
+            return
+        task = asyncio.create_task(self._put(node, key, blob, expires))
+        self._pushes.add(task)
+        task.add_done_callback(self._pushes.discard)
+
+    async def _put(self, node, key, blob, expires):
+        try:
+            await self.client.put(f"{node}/cluster/cache/{key}", content=blob,
+                                  headers={EXPIRES_HEADER: repr(expires)}, timeout=CLUSTER_CACHE_TIMEOUT)
+        except httpx.TimeoutException:
+            pass
+        except httpx.HTTPError as e:
+            self.mark_down(node, e)
+
+    # --- request routing ---
+
+    async def forward(self, request, key):
+        """
+        The owner's response to `request` when another node owns `key`, or
+        None to handle it here (this node owns it, the request was already
+        relayed, or no owner could be reached).
+        """
+        if request.headers.get(HOP_HEADER):
+            return None
+        headers = {h: request.headers[h] for h in _PASSED_HEADERS if h in request.headers}
+        headers[HOP_HEADER] = self.self_url or "1"
+        while True:
+            node = self.owner(key)
+            if node == self.self_url:
+                return None
+            upstream = self.client.build_request(
+                request.method, node + request.url.path, params=request.query_params, headers=headers
+            )
+            try:
+                resp = await self.client.send(upstream, stream=True)
+            except httpx.HTTPError as e:
+                self.mark_down(node, e)
+                continue
+            if resp.status_code >= 500 and resp.status_code != 503:
+                # 503 is the owner shedding load, which the client should see; anything else is a broken node
+                await resp.aclose()
+                self.mark_down(node, RuntimeError(f"status {resp.status_code}"))
+                continue
+            metrics.inc("cluster_forwarded_total", peer=node)
+            out = {k: v for k, v in resp.headers.items() if k.lower() not in _HOP_BY_HOP}
+            out["x-served-by"] = node
+            return StreamingResponse(self._relay(node, resp), status_code=resp.status_code, headers=out,
+                                     background=BackgroundTask(resp.aclose))
+
+    async def _relay(self, node, resp):
+        try:
+            async for chunk in resp.aiter_raw():
+                yield chunk
+        except httpx.HTTPError as e:
+            # too late to fall back: the client already has part of the owner's answer
+            self.mark_down(node, e)
+
+
+def _open_cluster():
+    if not CLUSTER_NODES:
+        return None
+    if CLUSTER_SELF not in CLUSTER_NODES:
+        log.error("CLUSTER_SELF is not in CLUSTER_NODES; cluster mode off", self_url=CLUSTER_SELF)
+        return None
+    if not CLUSTER_SECRET:
+        # peers' cache entries are unmarshalled as they come, so nobody else may write them
+        log.error("CLUSTER_SECRET is not set; cluster mode off")
+        return None
+    return Cluster(CLUSTER_NODES, CLUSTER_SELF)
+
+
+cluster = _open_cluster()
+if cluster is not None:
+    cache.peers = cluster
+
+
+def authorized(secret):
+    """Whether a cluster-internal call carries the shared secret; never without one configured."""
+    if not CLUSTER_SECRET or secret is None:
+        return False
+    return hmac.compare_digest(secret.encode("utf-8"), CLUSTER_SECRET.encode("utf-8"))
+
+
+async def forward(request, key):
+    """See Cluster.forward; always None outside cluster mode."""
+    if cluster is None:
+        return None
+    return await cluster.forward(request, key)
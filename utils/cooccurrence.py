@@ -0,0 +1,188 @@
+"""
+Co-occurrence counts gathered from live traffic, for the local embeddings.
+
+Every by-track request records which tracks the providers returned together
+for its seed, every related-artist listing records which artists a provider
+considers similar, and artist enrichment records the Last.fm tags. Each
+observation becomes weighted edges between nodes ("a:<artist>",
+"t:<title>|<artist>", "g:<tag>") that are summed in a SQLite table next to
+the response cache. `train_embeddings.py` turns the table into vectors.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+
+from dotenv import load_dotenv
+
+from utils.cache import CACHE_DIR, CACHE_DISABLED, refresh_margin
+from utils.log import get_logger
+
+load_dotenv()
+
+log = get_logger("cooccurrence")
+
+COOCCURRENCE_DISABLED = os.getenv("COOCCURRENCE_DISABLED", "").lower() in ("1", "true", "yes")
+
+# Tracks within this many ranks of each other in one result count as co-occurring
+WINDOW = 5
+# Only the head of a result is recorded; the tail is mostly filler
+MAX_BASKET = 100
+
+ARTIST = "a"
+TRACK = "t"
+TAG = "g"
+
+# Track labels are "<title><LABEL_SEP><artist>"
+LABEL_SEP = "\x1f"
+
+
+def _norm(text):
+    return " ".join((text or "").lower().split())
+
+
+def artist_node(name):
+    return f"{ARTIST}:{_norm(name)}"
+
+
+def track_node(title, artist):
+    return f"{TRACK}:{_norm(title)}|{_norm(artist)}"
+
+
+def tag_node(tag):
+    return f"{TAG}:{_norm(tag)}"
+
+
+class Edges:
+    """Edge weights and display labels for one observation, before they are stored."""
+
+    __slots__ = ("weights", "labels")
+
+    def __init__(self):
+        self.weights = {}
+        self.labels = {}
+
+    def __len__(self):
+        return len(self.weights)
+
+    def node(self, node, label):
+        self.labels.setdefault(node, label)
+        return node
+
+    def add(self, a, b, weight=1.0):
+        if a == b:
+            return
+        # one undirected edge, stored once
+        key = (a, b) if a < b else (b, a)
+        self.weights[key] = self.weights.get(key, 0.0) + weight
+
+
+def basket_edges(seed_title, seed_artist, tracks):
+    """Edges for the `Track`s the providers returned together for one seed."""
+    edges = Edges()
+    seed_a = edges.node(artist_node(seed_artist), seed_artist)
+    seed_t = None
+    if seed_title:
+        seed_t = edges.node(track_node(seed_title, seed_artist), seed_title + LABEL_SEP + seed_artist)
+    nodes = []
+    for track in tracks[:MAX_BASKET]:
+        t = edges.node(track_node(track.title, track.artist), track.title + LABEL_SEP + track.artist)
+        a = edges.node(artist_node(track.artist), track.artist)
+        edges.add(t, a)
+        edges.add(seed_a, a)
+        if seed_t is not None:
+            edges.add(seed_t, t)
+        for prev in nodes[-WINDOW:]:
+            edges.add(prev, t, 0.5)
+        nodes.append(t)
+    if seed_t is not None:
+        edges.add(seed_t, seed_a)
+    return edges
+
+
+def related_edges(artist_name, related_names):
+    edges = Edges()
+    a = edges.node(artist_node(artist_name), artist_name)
+    for name in related_names:
+        edges.add(a, edges.node(artist_node(name), name))
+    return edges
+
+
+def tag_edges(artist_name, tags):
+    edges = Edges()
+    a = edges.node(artist_node(artist_name), artist_name)
+    for tag in tags:
+        edges.add(a, edges.node(tag_node(tag), tag))
+    return edges
+
+
+class CooccurrenceStore:
+    """Summed edge weights and node labels in SQLite (WAL mode), shared by every worker on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS edges ("
+            " a TEXT NOT NULL,"
+            " b TEXT NOT NULL,"
+            " weight REAL NOT NULL,"
+            " PRIMARY KEY (a, b)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS nodes (node TEXT PRIMARY KEY, label TEXT NOT NULL) WITHOUT ROWID")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, edges):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO edges (a, b, weight) VALUES (?, ?, ?)"
+                " ON CONFLICT (a, b) DO UPDATE SET weight = weight + excluded.weight",
+                [(a, b, w) for (a, b), w in edges.weights.items()],
+            )
+            conn.executemany("INSERT OR IGNORE INTO nodes (node, label) VALUES (?, ?)", edges.labels.items())
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def iter_edges(self, min_weight=0.0):
+        return self._conn().execute("SELECT a, b, weight FROM edges WHERE weight >= ?", (min_weight,))
+
+    def labels(self):
+        return dict(self._conn().execute("SELECT node, label FROM nodes"))
+
+
+def _open_store():
+    if CACHE_DISABLED or COOCCURRENCE_DISABLED:
+        return None
+    try:
+        return CooccurrenceStore(os.path.join(CACHE_DIR, "cooccurrence.sqlite3"))
+    except Exception as e:
+        log.warning("Store unavailable, not recording", error=repr(e))
+        return None
+
+
+store = _open_store()
+
+
+async def record(edges):
+    """Add one observation's edges to the store; failures only cost the observation."""
+    # refreshes re-run requests that were already recorded
+    if store is None or not edges or refresh_margin.get() is not None:
+        return
+    try:
+        await asyncio.to_thread(store.add, edges)
+    except Exception as e:
+        log.warning("Write failed", error=repr(e))
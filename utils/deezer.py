@@ -1,21 +1,30 @@
-async def fetch_deezer_recommended_artists(client, artist_name):
+from utils.cache import cached
+from utils.log import get_logger
+from utils.schemas import DeezerArtistList, DeezerTrackList, decode
+from utils.track import DEEZER, Track, pack_tracks, unpack_tracks
+
+log = get_logger("deezer")
+
+
+@cached("deezer_related_artists")
+async def fetch_deezer_recommended_artists(client, artist_name, limit=10):
     rec_artists = []
 
     search = await client.get("https://api.deezer.com/search/artist", params={"q": artist_name})
-    data = search.json().get("data", [])
+    data = decode(search, DeezerArtistList).data
     if not data:
         return rec_artists
 
-    artist_id = data[0].get("id")
+    artist_id = data[0].id
     related = await client.get(f"https://api.deezer.com/artist/{artist_id}/related")
 
-    for a in related.json().get("data", [])[:10]:
+    for a in decode(related, DeezerArtistList).data[:limit]:
         rec_artists.append({
-            "name": a["name"],
-            "image_url": a.get("picture_xl") or a.get("picture"),
+            "name": a.name,
+            "image_url": a.picture_xl or a.picture,
             "genres": [],  # Deezer API does not include genre here
             "links": {
-                "deezer": a.get("link")
+                "deezer": a.link
             },
             "source": "Deezer"
         })
@@ -23,80 +32,72 @@ async def fetch_deezer_recommended_artists(client, artist_name):
     return rec_artists
 
 
-async def fetch_deezer_tracks(client, artist_name: str, limit: int = 20, offset: int = 0):
-    tracks = []
+async def search_deezer_seed(client, track_title, track_artist):
+    """(None, artist_name) of the top Deezer hit for a track; Deezer has no Spotify id to offer."""
+    query = f'artist:"{track_artist}" track:"{track_title}"'
+    resp = await client.get("https://api.deezer.com/search/track", params={"q": query, "limit": 1})
+    data = decode(resp, DeezerTrackList).data
+    return (None, data[0].artist.name) if data else None
 
-    # Step 1: Search for artist by name
-    d_search = await client.get(f"https://api.deezer.com/search/artist", params={"q": artist_name})
-    data = d_search.json().get("data", [])
 
-    if not data:
-        return tracks
-
-    artist_id = data[0]["id"]
-
-    # Step 2: Fetch top tracks of the artist
-    top = await client.get(f"https://api.deezer.com/artist/{artist_id}/top", params={"limit": 100})
-    all_tracks = top.json().get("data", [])
-
-    # Step 3: Manual pagination
-    paginated = all_tracks[offset:offset + limit]
-
-    for t in paginated:
-        tracks.append({
-            "title": t["title"],
-            "artist": t["artist"]["name"],
-            "duration_sec": t["duration"],
-            "cover": t["album"]["cover_big"],
-            "preview_url": t.get("preview"),
-            "spotify_url": None,
-            "deezer_url": t["link"],
-            "soundcloud_url": None,
-            "source": ["Deezer"]
-        })
+# Deezer serves top tracks in pages; 100 is as deep as we go
+TOP_PAGE_SIZE = 25
+TOP_MAX = 100
 
-    return tracks
 
+@cached("deezer_artist_id")
+async def _deezer_artist_id(client, artist_name):
+    resp = await client.get("https://api.deezer.com/search/artist", params={"q": artist_name})
+    data = decode(resp, DeezerArtistList).data
+    return data[0].id if data else None
+
+
+@cached("deezer_top_page", encode=pack_tracks, decode=unpack_tracks)
+async def _deezer_top_page(client, artist_id, index=0, limit=TOP_PAGE_SIZE):
+    resp = await client.get(f"https://api.deezer.com/artist/{artist_id}/top", params={"index": index, "limit": limit})
+    return [
+        Track(
+            t.title,
+            t.artist.name,
+            duration_ms=t.duration * 1000,
+            cover_url=t.album.cover_big,
+            preview_url=t.preview,
+            deezer_url=t.link,
+            sources=DEEZER,
+        )
+        for t in decode(resp, DeezerTrackList).data
+    ]
 
-async def fetch_deezer_related_tracks(client, artist_name: str, limit: int = 20, offset: int = 0):
-    tracks = []
 
-    # Step 1: Find artist ID
-    search_resp = await client.get("https://api.deezer.com/search/artist", params={"q": artist_name})
-    artists = search_resp.json().get("data", [])
-    if not artists:
-        return tracks
+@cached("deezer_related_ids")
+async def _deezer_related_ids(client, artist_id):
+    resp = await client.get(f"https://api.deezer.com/artist/{artist_id}/related")
+    return [a.id for a in decode(resp, DeezerArtistList).data]
 
-    artist_id = artists[0]["id"]
 
-    # Step 2: Get related artists
-    related_resp = await client.get(f"https://api.deezer.com/artist/{artist_id}/related")
-    related_artists = related_resp.json().get("data", [])
+async def iter_deezer_tracks(client, artist_name: str):
+    """The artist's top tracks, one page at a time."""
+    artist_id = await _deezer_artist_id(client, artist_name)
+    if not artist_id:
+        return
 
-    all_related_tracks = []
+    for index in range(0, TOP_MAX, TOP_PAGE_SIZE):
+        page = await _deezer_top_page(client, artist_id, index)
+        for track in page:
+            yield track
+        if len(page) < TOP_PAGE_SIZE:
+            return
 
-    # Step 3: For each related artist, get their top tracks
-    for related in related_artists[:10]:  # limit number of related artists to reduce API load
-        rel_id = related["id"]
-        top_resp = await client.get(f"https://api.deezer.com/artist/{rel_id}/top", params={"limit": 3})
-        for t in top_resp.json().get("data", []):
-            all_related_tracks.append({
-                "title": t["title"],
-                "artist": t["artist"]["name"],
-                "duration_sec": t["duration"],
-                "cover": t["album"]["cover_big"],
-                "preview_url": t.get("preview"),
-                "spotify_url": None,
-                "deezer_url": t["link"],
-                "soundcloud_url": None,
-                "source": ["Deezer"]
-            })
 
-    # Step 4: Manual pagination
-    paginated = all_related_tracks[offset:offset + limit]
-    tracks.extend(paginated)
+async def iter_deezer_related_tracks(client, artist_name: str):
+    """Three top tracks from each related artist, fetched as they are needed."""
+    artist_id = await _deezer_artist_id(client, artist_name)
+    if not artist_id:
+        return
 
-    return tracks
+    for rel_id in (await _deezer_related_ids(client, artist_id))[:10]:  # limit number of related artists to reduce API load
+        for track in await _deezer_top_page(client, rel_id, 0, 3):
+            yield track
 
 
 import random
@@ -165,7 +166,7 @@ async def get_deezer_tracks_and_artists_by_genre(client, tags):
                     "source": ["Deezer"]
                 })
         except Exception as e:
-            print(f"[Deezer] Artist fetch failed for {genre}: {e}")
+            log.warning("Genre artist fetch failed", genre=genre, error=repr(e))
 
         # Try to fetch tracks via radios for that genre (works like mood playlists)
         try:
@@ -184,7 +185,7 @@ async def get_deezer_tracks_and_artists_by_genre(client, tags):
                         "source": ["Deezer Radio"]
                     })
         except Exception as e:
-            print(f"[Deezer] Radio fetch failed for {genre}: {e}")
+            log.warning("Genre radio fetch failed", genre=genre, error=repr(e))
 
         # If no tracks found, fall back to mood keyword search
         if not tracks:
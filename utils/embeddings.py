@@ -0,0 +1,197 @@
+"""
+Artist and track embeddings learned from the co-occurrence store.
+
+Training (offline, see train_embeddings.py) weighs the co-occurrence graph
+with positive PMI and factorizes it with a randomized SVD, so artists,
+tracks and tags share one vector space. The API loads the result from
+EMBEDDINGS_PATH on first use; nearest neighbours are a single matrix-vector
+product over the artist or track block, so a lookup costs well under a
+millisecond for a few hundred thousand nodes and makes no upstream calls.
+
+NumPy is only needed here; without it the local source stays empty.
+"""
+import os
+
+from dotenv import load_dotenv
+
+from utils.cooccurrence import ARTIST, LABEL_SEP, TRACK, artist_node, track_node
+from utils.log import get_logger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+load_dotenv()
+
+log = get_logger("embeddings")
+
+EMBEDDINGS_PATH = os.getenv("EMBEDDINGS_PATH", "embeddings.npz")
+
+# Nonzeros per block when multiplying the sparse matrix, to bound memory
+_CHUNK = 1 << 20
+
+
+# --- training ---
+
+def _coo(edges, min_degree):
+    """Symmetric COO arrays (rows, cols, weights) and node names from (a, b, weight) rows."""
+    names = {}
+    a_ids, b_ids, weights = [], [], []
+    for a, b, w in edges:
+        a_ids.append(names.setdefault(a, len(names)))
+        b_ids.append(names.setdefault(b, len(names)))
+        weights.append(w)
+    nodes = np.array(list(names), dtype=str)
+    rows = np.array(a_ids + b_ids, dtype=np.int64)
+    cols = np.array(b_ids + a_ids, dtype=np.int64)
+    vals = np.array(weights + weights, dtype=np.float64)
+
+    # drop nodes seen too rarely to place, and renumber the rest densely
+    degree = np.bincount(rows, weights=vals, minlength=len(nodes))
+    keep = degree >= min_degree
+    remap = np.cumsum(keep) - 1
+    mask = keep[rows] & keep[cols]
+    return remap[rows[mask]], remap[cols[mask]], vals[mask], nodes[keep]
+
+
+def _ppmi(rows, cols, vals, n):
+    """Positive PMI of each weight; keeps the matrix symmetric."""
+    degree = np.bincount(rows, weights=vals, minlength=n)
+    pmi = np.log(vals * degree.sum() / (degree[rows] * degree[cols]))
+    mask = pmi > 0
+    return rows[mask], cols[mask], pmi[mask].astype(np.float32)
+
+
+def _spmm(rows, cols, vals, n, dense):
+    """(sparse n x n in COO, rows sorted) @ dense, in blocks of nonzeros."""
+    out = np.zeros((n, dense.shape[1]), dtype=np.float32)
+    for start in range(0, len(rows), _CHUNK):
+        r = rows[start:start + _CHUNK]
+        contrib = vals[start:start + _CHUNK, None] * dense[cols[start:start + _CHUNK]]
+        heads = np.flatnonzero(np.r_[True, r[1:] != r[:-1]])
+        # rows are unique within `heads`, so fancy-index += is safe
+        out[r[heads]] += np.add.reduceat(contrib, heads, axis=0)
+    return out
+
+
+def train(edges, dim=64, min_degree=2.0, power_iters=4, seed=0):
+    """
+    (nodes, vectors) for co-occurrence `edges`: unit-length float32 rows,
+    one per node whose total edge weight is at least `min_degree`.
+    """
+    rows, cols, vals, nodes = _coo(edges, min_degree)
+    n = len(nodes)
+    if n == 0:
+        return nodes, np.zeros((0, dim), dtype=np.float32)
+    rows, cols, vals = _ppmi(rows, cols, vals, n)
+    order = np.argsort(rows, kind="stable")
+    rows, cols, vals = rows[order], cols[order], vals[order]
+
+    # randomized SVD (Halko et al.); the matrix is symmetric, so A.T @ Q == A @ Q
+    k = min(n, dim + 10)
+    rng = np.random.default_rng(seed)
+    q, _ = np.linalg.qr(_spmm(rows, cols, vals, n, rng.standard_normal((n, k)).astype(np.float32)))
+    for _ in range(power_iters):
+        q, _ = np.linalg.qr(_spmm(rows, cols, vals, n, q))
+    b = _spmm(rows, cols, vals, n, q).T
+    u, s, _ = np.linalg.svd(b, full_matrices=False)
+    d = min(dim, k)
+    vectors = (q @ u[:, :d]) * np.sqrt(s[:d])
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return nodes, (vectors / norms).astype(np.float32)
+
+
+def write_embeddings(path, nodes, vectors, labels):
+    """Save a trained model; `labels` maps node -> display label. Replaced atomically."""
+    tmp = path + ".tmp.npz"
+    np.savez(
+        tmp,
+        nodes=nodes,
+        vectors=vectors,
+        labels=np.array([labels.get(node, node[2:]) for node in nodes.tolist()], dtype=str),
+    )
+    os.replace(tmp, path)
+    return len(nodes)
+
+
+# --- serving ---
+
+class EmbeddingIndex:
+    """Exact top-k by cosine similarity over the artist block or the track block."""
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path, allow_pickle=False) as data:
+            nodes = data["nodes"]
+            vectors = data["vectors"]
+            labels = data["labels"]
+        self._vectors = vectors
+        self._rows = {node: i for i, node in enumerate(nodes.tolist())}
+        self._blocks = {}
+        for kind in (ARTIST, TRACK):
+            rows = np.flatnonzero(np.char.startswith(nodes, kind + ":"))
+            self._blocks[kind] = (
+                np.ascontiguousarray(vectors[rows]),
+                nodes[rows].tolist(),
+                labels[rows].tolist(),
+            )
+
+    def __len__(self):
+        return len(self._rows)
+
+    def vector(self, node):
+        i = self._rows.get(node)
+        return None if i is None else self._vectors[i]
+
+    def nearest(self, vector, kind, k, exclude=()):
+        """[(label, score)] of the `k` nodes of `kind` closest to `vector`, best first."""
+        matrix, nodes, labels = self._blocks[kind]
+        if not nodes or k <= 0:
+            return []
+        scores = matrix @ vector
+        n = min(len(nodes), k + len(exclude))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        return [(labels[i], float(scores[i])) for i in top if nodes[i] not in exclude][:k]
+
+    def similar_artists(self, artist_name, k=10):
+        node = artist_node(artist_name)
+        vector = self.vector(node)
+        if vector is None:
+            return []
+        return self.nearest(vector, ARTIST, k, exclude={node})
+
+    def similar_tracks(self, track_title, artist_name, k=20):
+        """[((title, artist), score)] near the seed track, or near its artist if the track is unknown."""
+        node = track_node(track_title, artist_name) if track_title else None
+        vector = self.vector(node) if node else None
+        if vector is None:
+            vector = self.vector(artist_node(artist_name))
+        if vector is None:
+            return []
+        return [
+            (tuple(label.split(LABEL_SEP, 1)), score)
+            for label, score in self.nearest(vector, TRACK, k, exclude={node})
+            if LABEL_SEP in label
+        ]
+
+
+def open_index(path):
+    if not path or not os.path.exists(path):
+        return None
+    if np is None:
+        log.warning("NumPy is not installed; ignoring embeddings", path=path)
+        return None
+    try:
+        index = EmbeddingIndex(path)
+    except Exception as e:
+        log.warning("Could not load embeddings", path=path, error=repr(e))
+        return None
+    log.info("Loaded embeddings", path=path, vectors=len(index))
+    return index
+
+
+index = open_index(EMBEDDINGS_PATH)
@@ -1,200 +1,270 @@
 import os
 from dotenv import load_dotenv
-import httpx
 import asyncio
 import json
+import threading
+
+import msgspec
+
+from utils.cache import cached
+from utils.cooccurrence import record, tag_edges
+from utils.http import upstream_client
+from utils.log import DEBUG_DUMPS, get_logger
+from utils.profiling import traced
+from utils.schemas import (
+    DeezerArtistList,
+    DeezerLinkList,
+    DiscogsSearch,
+    LastfmArtistInfo,
+    SoundcloudTrackList,
+    SoundcloudUserList,
+    SpotifyArtistSearch,
+    SpotifyTrackSearch,
+    decode,
+)
+from utils.track import Track
+
 load_dotenv()  # must be called first
 
+log = get_logger("enrich")
+
 DISCOGS_KEY = os.getenv("DISCOGS_CONSUMER_KEY")
 DISCOGS_SECRET = os.getenv("DISCOGS_CONSUMER_SECRET")
 SOUNDCLOUD_CLIENT_ID = os.getenv("SOUNDCLOUD_CLIENT_ID")
 
 
-async def enrich_track(track: dict, SPOTIFY_TOKEN=None, debug=False) -> dict:
+def _selected(sources, name):
+    return sources is None or name in sources
+
+
+def _write_bytes(path, data):
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+@cached("discogs_release")
+async def _discogs_release(client, query):
+    r = await client.get(
+        "https://api.discogs.com/database/search",
+        params={
+            "q": query,
+            "type": "release",
+            "per_page": 1,
+            "key": DISCOGS_KEY,
+            "secret": DISCOGS_SECRET
+        }
+    )
+
+    if DEBUG_DUMPS:
+        await asyncio.to_thread(_write_bytes, "discogs_response.json", r.content)
+    if r.status_code != 200:
+        # raise rather than return None so throttled responses aren't cached
+        raise RuntimeError(f"Discogs status {r.status_code}")
+    results = decode(r, DiscogsSearch).results
+    return msgspec.to_builtins(results[0]) if results else None
+
+
+@cached("spotify_track_url")
+async def _spotify_track_url(client, query, SPOTIFY_TOKEN):
+    headers = {"Authorization": f"Bearer {SPOTIFY_TOKEN}"}
+    r = await client.get(
+        "https://api.spotify.com/v1/search",
+        headers=headers,
+        params={"q": query, "type": "track", "limit": 1}
+    )
+    items = decode(r, SpotifyTrackSearch).tracks.items
+    return items[0].external_urls.spotify if items else None
+
+
+@cached("deezer_track_url")
+async def _deezer_track_url(client, query):
+    r = await client.get(f"https://api.deezer.com/search/track?q={query}")
+    data = decode(r, DeezerLinkList).data
+    return data[0].link if data else None
+
+
+@cached("soundcloud_track_url")
+async def _soundcloud_track_url(client, query):
+    r = await client.get(
+        "https://api-v2.soundcloud.com/search/tracks",
+        params={"q": query, "client_id": SOUNDCLOUD_CLIENT_ID, "limit": 1}
+    )
+    collection = decode(r, SoundcloudTrackList).collection
+    return collection[0].permalink_url if collection else None
+
+
+async def enrich_track(track: Track, SPOTIFY_TOKEN=None, debug=False, sources=None) -> Track:
     """
-    Enrich a single track with Discogs metadata and missing streaming links (Spotify, Deezer, SoundCloud).
+    Enrich a single track in place with Discogs metadata and missing streaming links (Spotify, Deezer, SoundCloud).
+    `sources` limits which providers are asked for links (all of them when None).
     """
    
-    query = f"{track.get('artist')} {track.get('title')}"
+    query = f"{track.artist} {track.title}"
     
-    async with httpx.AsyncClient(timeout=10) as client:
+    async with upstream_client(timeout=10) as client:
         # --- 1. Discogs enrichment ---
         try:
-            r = await client.get(
-                "https://api.discogs.com/database/search",
-                params={
-                    "q": query,
-                    "type": "release",
-                    "per_page": 1,
-                    "key": DISCOGS_KEY,
-                    "secret": DISCOGS_SECRET
-                }
-            )
-            
-            data = r.json()
-            with open("discogs_response.json", "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            if r.status_code == 200 and data.get("results"):
-                result = data["results"][0]
+            result = await traced("discogs", _discogs_release(client, query))
+            if result:
                 if debug:
-                    print(f"[Discogs Result] {track.get('title')} -> {result}")
+                    log.info("Discogs result", title=track.title, result=result)
 
                 def merge_list(field, new_values):
                     if new_values:
-                        track[field] = list(set(track.get(field, [])).union(new_values))
+                        setattr(track, field, list(set(getattr(track, field)).union(new_values)))
 
                 merge_list("genre", result.get("genre"))
                 merge_list("style", result.get("style"))
                 merge_list("label", result.get("label"))
                 merge_list("format", result.get("format"))
 
-                if not track.get("year"):
-                    track["year"] = result.get("year") or (result.get("released") or "").split("-")[0]
+                if not track.year:
+                    track.year = result.get("year") or (result.get("released") or "").split("-")[0]
 
                 # Cover image
-                if not track.get("cover_url") or "2a96cbd8b46e442fc41c2b86b821562f" in track.get("cover_url", ""):
+                if not track.cover_url or "2a96cbd8b46e442fc41c2b86b821562f" in track.cover_url:
                     if result.get("cover_image"):
-                        track["cover_url"] = result["cover_image"]
+                        track.cover_url = result["cover_image"]
 
                 if debug:
-                    print(f"[Discogs Enriched] {track.get('title')} -> cover: {track.get('cover_url')}")
+                    log.info("Discogs enriched", title=track.title, cover=track.cover_url)
 
             else:
                 if debug:
-                    print(f"[Discogs Empty] {track.get('title')} -> {data}")
+                    log.info("Discogs empty", title=track.title)
 
         except Exception as e:
-            print(f"[Discogs Error] {track.get('title')}: {e}")
+            log.sampled("Discogs lookup failed", title=track.title, error=repr(e))
 
         # --- 2. Spotify URL ---
-        if not track.get("spotify_url") and SPOTIFY_TOKEN:
+        if not track.spotify_url and SPOTIFY_TOKEN and _selected(sources, "spotify"):
             try:
-                headers = {"Authorization": f"Bearer {SPOTIFY_TOKEN}"}
-                r = await client.get(
-                    "https://api.spotify.com/v1/search",
-                    headers=headers,
-                    params={"q": query, "type": "track", "limit": 1}
-                )
-                items = r.json().get("tracks", {}).get("items", [])
-                if items:
-                    track["spotify_url"] = items[0]["external_urls"]["spotify"]
+                url = await traced("spotify_link", _spotify_track_url(client, query, SPOTIFY_TOKEN))
+                if url:
+                    track.spotify_url = url
                     if debug:
-                        print(f"[Spotify URL] {track['title']} -> {track['spotify_url']}")
+                        log.info("Spotify URL", title=track.title, url=track.spotify_url)
             except Exception as e:
                 if debug:
-                    print(f"[Spotify Error] {track.get('title')}: {e}")
+                    log.info("Spotify lookup failed", title=track.title, error=repr(e))
 
         # --- 3. Deezer URL ---
-        if not track.get("deezer_url"):
+        if not track.deezer_url and _selected(sources, "deezer"):
             try:
-                r = await client.get(f"https://api.deezer.com/search/track?q={query}")
-                data = r.json()
-                if data.get("data"):
-                    track["deezer_url"] = data["data"][0].get("link")
+                url = await traced("deezer_link", _deezer_track_url(client, query))
+                if url:
+                    track.deezer_url = url
                     if debug:
-                        print(f"[Deezer URL] {track['title']} -> {track['deezer_url']}")
+                        log.info("Deezer URL", title=track.title, url=track.deezer_url)
             except Exception as e:
                 if debug:
-                    print(f"[Deezer Error] {track.get('title')}: {e}")
+                    log.info("Deezer lookup failed", title=track.title, error=repr(e))
 
         # --- 4. SoundCloud URL ---
-        if not track.get("soundcloud_url") and SOUNDCLOUD_CLIENT_ID:
+        if not track.soundcloud_url and SOUNDCLOUD_CLIENT_ID and _selected(sources, "soundcloud"):
             try:
-                r = await client.get(
-                    "https://api-v2.soundcloud.com/search/tracks",
-                    params={"q": query, "client_id": SOUNDCLOUD_CLIENT_ID, "limit": 1}
-                )
-                collection = r.json().get("collection", [])
-                if collection:
-                    track["soundcloud_url"] = collection[0].get("permalink_url")
+                url = await traced("soundcloud_link", _soundcloud_track_url(client, query))
+                if url:
+                    track.soundcloud_url = url
                     if debug:
-                        print(f"[SoundCloud URL] {track['title']} -> {track['soundcloud_url']}")
+                        log.info("SoundCloud URL", title=track.title, url=track.soundcloud_url)
             except Exception as e:
                 if debug:
-                    print(f"[SoundCloud Error] {track.get('title')}: {e}")
+                    log.info("SoundCloud lookup failed", title=track.title, error=repr(e))
 
         # --- 5. Last.fm fallback link if missing ---
-        if not track.get("lastfm_url"):
-            track["lastfm_url"] = f"https://www.last.fm/music/{track.get('artist', '').replace(' ', '+')}/_/{track.get('title', '').replace(' ', '+')}"
+        if not track.lastfm_url:
+            track.lastfm_url = f"https://www.last.fm/music/{track.artist.replace(' ', '+')}/_/{track.title.replace(' ', '+')}"
             if debug:
-                print(f"[Last.fm URL] {track['title']} -> {track['lastfm_url']}")
+                log.info("Last.fm URL", title=track.title, url=track.lastfm_url)
 
     return track
-async def enrich_artist_metadata(artist_name: str, lastfm_key: str, soundcloud_client_id: str, spotify_token: str, deezer_client=None) -> dict:
-    """Enrich a single artist with Last.fm, Spotify, Deezer, SoundCloud URLs and image if available."""
+
+
+@cached("artist_lastfm")
+async def _lastfm_artist(artist_name, lastfm_key):
+    async with upstream_client() as client:
+        res = await client.get(
+            "http://ws.audioscrobbler.com/2.0/",
+            params={
+                "method": "artist.getinfo",
+                "artist": artist_name,
+                "api_key": lastfm_key,
+                "format": "json"
+            }
+        )
+    info = decode(res, LastfmArtistInfo).artist
+    await record(tag_edges(artist_name, [t.name for t in info.tags.tag]))
+    return {"lastfm_url": info.url, "genres": [t.name for t in info.tags.tag[:3]]}
+
+
+@cached("artist_deezer")
+async def _deezer_artist(artist_name):
+    async with upstream_client() as client:
+        res = await client.get(f"https://api.deezer.com/search/artist?q={artist_name}")
+    data = decode(res, DeezerArtistList).data
+    if not data:
+        return {}
+    return {"deezer_url": data[0].link, "image_url": data[0].picture_medium}
+
+
+@cached("artist_spotify")
+async def _spotify_artist(artist_name, spotify_token):
+    async with upstream_client() as client:
+        res = await client.get(
+            "https://api.spotify.com/v1/search",
+            params={"q": artist_name, "type": "artist", "limit": 1},
+            headers={"Authorization": f"Bearer {spotify_token}"}
+        )
+    items = decode(res, SpotifyArtistSearch).artists.items
+    if not items:
+        return {}
+    item = items[0]
+    return {"spotify_url": item.external_urls.spotify, "image_url": item.images[0].url if item.images else None}
+
+
+@cached("artist_soundcloud")
+async def _soundcloud_artist(artist_name, soundcloud_client_id):
+    async with upstream_client() as client:
+        res = await client.get(
+            "https://api-v2.soundcloud.com/search/users",
+            params={"q": artist_name, "client_id": soundcloud_client_id, "limit": 1},
+            timeout=10
+        )
+    collection = decode(res, SoundcloudUserList).collection
+    if not collection:
+        return {}
+    sc_artist = collection[0]
+    return {"soundcloud_url": f"https://soundcloud.com/{sc_artist.permalink}", "image_url": sc_artist.avatar_url}
+
+
+async def enrich_artist_metadata(artist_name: str, lastfm_key: str, soundcloud_client_id: str, spotify_token: str, deezer_client=None, sources=None) -> dict:
+    """
+    Enrich a single artist with Last.fm, Spotify, Deezer, SoundCloud URLs and image if available.
+    `sources` limits which providers are asked (all of them when None). Each
+    provider's answer is cached on its own, so one that fails (and isn't
+    cached) doesn't blank the others' for the cache's lifetime.
+    """
     enriched = {"name": artist_name}
+    lookups = (
+        ("lastfm", "Last.fm", lambda: _lastfm_artist(artist_name, lastfm_key)),
+        ("deezer", "Deezer", lambda: _deezer_artist(artist_name)),
+        ("spotify", "Spotify", lambda: _spotify_artist(artist_name, spotify_token)),
+        ("soundcloud", "SoundCloud", lambda: _soundcloud_artist(artist_name, soundcloud_client_id)),
+    )
+    for source, label, lookup in lookups:
+        if not _selected(sources, source):
+            continue
+        try:
+            found = await lookup()
+        except Exception as e:
+            log.warning(f"{label} artist lookup failed", artist=artist_name, error=repr(e))
+            continue
+        # the first provider with an image keeps it
+        if "image_url" in found:
+            enriched.setdefault("image_url", found.pop("image_url"))
+        enriched.update(found)
 
-    # --- Last.fm enrichment ---
-    try:
-        async with httpx.AsyncClient() as client:
-            res = await client.get(
-                "http://ws.audioscrobbler.com/2.0/",
-                params={
-                    "method": "artist.getinfo",
-                    "artist": artist_name,
-                    "api_key": lastfm_key,
-                    "format": "json"
-                }
-            )
-            if res.status_code == 200:
-                info = res.json().get("artist", {})
-                enriched["lastfm_url"] = info.get("url")
-                enriched["genres"] = [t["name"] for t in info.get("tags", {}).get("tag", [])[:3]]
-    except Exception as e:
-        print(f"[Last.fm Error] {artist_name}: {e}")
-        
-
-    # --- Deezer enrichment ---
-    try:
-        async with httpx.AsyncClient() as client:
-            search_res = await client.get(f"https://api.deezer.com/search/artist?q={artist_name}")
-            if search_res.status_code == 200 and search_res.json().get("data"):
-                artist_data = search_res.json()["data"][0]
-                enriched["deezer_url"] = artist_data.get("link")
-                enriched["image_url"] = artist_data.get("picture_medium")
-    except Exception as e:
-        print(f"[Deezer Error] {artist_name}: {e}")
-
-    # --- Spotify enrichment ---
-    try:
-        headers = {"Authorization": f"Bearer {spotify_token}"}
-        async with httpx.AsyncClient() as client:
-            res = await client.get(
-                "https://api.spotify.com/v1/search",
-                params={"q": artist_name, "type": "artist", "limit": 1},
-                headers=headers
-            )
-            items = res.json().get("artists", {}).get("items", [])
-            if items:
-                item = items[0]
-                enriched["spotify_url"] = item.get("external_urls", {}).get("spotify")
-                if "image_url" not in enriched:
-                    enriched["image_url"] = item.get("images", [{}])[0].get("url")
-    except Exception as e:
-        print(f"[Spotify Error] {artist_name}: {e}")
-        
-
-    # --- SoundCloud enrichment ---
-    # --- SoundCloud enrichment ---
-    try:
-        async with httpx.AsyncClient() as client:
-            res = await client.get(
-                "https://api-v2.soundcloud.com/search/users",
-                params={"q": artist_name, "client_id": soundcloud_client_id, "limit": 1},
-                timeout=10
-            )
-            if res.status_code == 200:
-                try:
-                    data = res.json()
-                    collection = data.get("collection", [])
-                    if collection:
-                        sc_artist = collection[0]
-                        enriched["soundcloud_url"] = f"https://soundcloud.com/{sc_artist.get('permalink')}"
-                        if "image_url" not in enriched:
-                            enriched["image_url"] = sc_artist.get("avatar_url")
-                except Exception:
-                    print(f"[SoundCloud Error] Failed to parse JSON for artist: {artist_name}")
-    except Exception:
-        print(f"[SoundCloud Error] Request failed for artist: {artist_name}")
-
-    return enriched
\ No newline at end of file
+    return enriched
@@ -1,20 +1,19 @@
 import base64
-import logging
-import httpx
 import os
 from dotenv import load_dotenv
 
+from utils.http import upstream_client
+from utils.log import get_logger
+
 load_dotenv()
 
+log = get_logger("spotify")
+
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
 
 async def get_spotify_token():
-    logging.info("Fetching Spotify token...")
-    logging.info("SPOTIFY_CLIENT_ID:", SPOTIFY_CLIENT_ID[:5] + "..." if SPOTIFY_CLIENT_ID else None)
-    logging.info("SPOTIFY_CLIENT_SECRET:", SPOTIFY_CLIENT_SECRET[:5] + "..." if SPOTIFY_CLIENT_SECRET else None)
-
     if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
         raise RuntimeError("❌ SPOTIFY_CLIENT_ID or SPOTIFY_CLIENT_SECRET is missing. Check your .env and load_dotenv()")
 
@@ -28,15 +27,13 @@ async def get_spotify_token():
 
     data = {"grant_type": "client_credentials"}
 
-    async with httpx.AsyncClient() as client:
+    # not charged to the request's budget: the cost model only counts provider calls
+    async with upstream_client(budgeted=False) as client:
         response = await client.post("https://accounts.spotify.com/api/token", headers=headers, data=data)
-        print("[Spotify] Status:", response.status_code)
-        print("[Spotify] Body:", response.text)
 
         if response.status_code != 200:
+            log.error("Token request failed", status=response.status_code, body=response.text[:200])
             raise RuntimeError("❌ Failed to get token from Spotify")
 
-        token = response.json().get("access_token")
-        print("[Spotify] Access token:", token[:10] + "...")
-
-        return token
+        log.debug("Fetched Spotify token")
+        return response.json().get("access_token")
@@ -0,0 +1,44 @@
+"""
+Shared construction of upstream HTTP clients.
+
+Every client made here charges its requests to the current request's
+upstream budget (see utils.budget) and, for profiled requests, records
+a span per call (see utils.profiling). Every client also records or
+replays its traffic when UPSTREAM_MODE asks for it (see utils.cassettes).
+"""
+import httpx
+
+from utils import profiling
+from utils.budget import current_budget
+from utils.cassettes import transport
+
+
+async def _charge(request):
+    budget = current_budget.get()
+    if budget is not None:
+        budget.charge(request)
+
+
+async def _start_span(request):
+    span = profiling.leaf(f"{request.method} {request.url.host}", path=request.url.path)
+    if span is not None:
+        request.extensions["profile_span"] = span
+
+
+async def _finish_span(response):
+    span = response.request.extensions.get("profile_span")
+    if span is not None:
+        # read here so the span covers the body download too
+        await response.aread()
+        span.attrs["status_code"] = response.status_code
+        span.finish("ok" if response.status_code < 400 else "error", len(response.content))
+
+
+def upstream_client(budgeted=True, **kwargs):
+    """An httpx.AsyncClient for upstream APIs; `budgeted=False` for calls the cost model doesn't count."""
+    request_hooks = [_charge, _start_span] if budgeted else [_start_span]
+    return httpx.AsyncClient(
+        event_hooks={"request": request_hooks, "response": [_finish_span]},
+        transport=transport(),
+        **kwargs,
+    )
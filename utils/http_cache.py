@@ -0,0 +1,25 @@
+import hashlib
+import json
+
+
+def canonical_json(value):
+    """Stable encoding, so the same result always hashes (and serializes) the same way."""
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def content_etag(body):
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """RFC 9110 weak comparison of an If-None-Match header against `etag`."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == bare for candidate in if_none_match.split(","))
+
+
+def cache_control(max_age):
+    return f"public, max-age={max_age}, stale-while-revalidate={max_age}"
@@ -0,0 +1,246 @@
+"""
+Cover art and artist images served through our own /images endpoint.
+
+An image key is the source URL, base64url-encoded, so any worker can serve
+any key without shared state; only hosts on IMAGE_HOSTS are ever fetched.
+The first request for a key downloads the original once (concurrent
+requests wait for the same download), stores it with its pre-sized
+variants in a size-bounded SQLite file next to the response cache, and
+every later request is answered from there.
+
+URLs in responses are only rewritten when IMAGE_PROXY_BASE (the public
+base URL of this API) is set.
+"""
+import asyncio
+import base64
+import binascii
+import io
+import os
+import time
+from urllib.parse import urljoin, urlsplit
+
+from dotenv import load_dotenv
+
+from utils.cache import CACHE_DIR, CACHE_DISABLED, MISS, DiskCache
+from utils.http import upstream_client
+from utils.log import get_logger
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+load_dotenv()
+
+log = get_logger("images")
+
+IMAGE_PROXY_BASE = os.getenv("IMAGE_PROXY_BASE", "").rstrip("/")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+IMAGE_TTL = int(os.getenv("IMAGE_TTL", str(30 * 86400)))
+# Originals larger than this are refused
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_HOSTS = tuple(
+    h.strip() for h in os.getenv(
+        "IMAGE_HOSTS",
+        "scdn.co,spotifycdn.com,dzcdn.net,lastfm.freetls.fastly.net,sndcdn.com,discogs.com,wikimedia.org",
+    ).split(",") if h.strip()
+)
+
+# Widths of the pre-generated variants; 0 is the original
+SIZES = (64, 160, 300, 640)
+DEFAULT_SIZE = 300
+# Redirects followed per download, each checked against IMAGE_HOSTS
+MAX_REDIRECTS = 5
+
+# The only types served; an original is identified by its bytes, never by the upstream's content-type
+_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "GIF": "image/gif", "WEBP": "image/webp"}
+_MAGIC = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+)
+
+
+class ImageError(Exception):
+    """The image can't be served; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=502):
+        super().__init__(message)
+        self.status = status
+
+
+def _allowed(url):
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    return parts.scheme in ("http", "https") and any(host == h or host.endswith("." + h) for h in IMAGE_HOSTS)
+
+
+def image_key(url):
+    return base64.urlsafe_b64encode(url.encode("utf-8")).rstrip(b"=").decode("ascii")
+
+
+def source_url(key):
+    """The URL behind `key`, or ImageError(400) if it isn't one we serve."""
+    try:
+        url = base64.urlsafe_b64decode(key + "=" * (-len(key) % 4)).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ImageError("Malformed image key", 400)
+    if not _allowed(url):
+        raise ImageError("Image host not allowed", 400)
+    return url
+
+
+def proxied(url, size=DEFAULT_SIZE):
+    """`url` rewritten to go through the proxy, when the proxy is configured and can serve it."""
+    if not url or not IMAGE_PROXY_BASE or not _allowed(url):
+        return url
+    return f"{IMAGE_PROXY_BASE}/images/{image_key(url)}?w={size}"
+
+
+def with_proxied_image(payload, field="image_url", size=DEFAULT_SIZE):
+    """A copy of an artist-style dict with its image going through the proxy (cached dicts stay untouched)."""
+    if not payload or not payload.get(field):
+        return payload
+    return {**payload, field: proxied(payload[field], size)}
+
+
+def snap_size(width):
+    """The smallest variant at least `width` wide, the largest one, or 0 for the original."""
+    if not width:
+        return 0
+    for size in SIZES:
+        if size >= width:
+            return size
+    return SIZES[-1]
+
+
+# --- storage ---
+
+def _pack(content_type, data):
+    return content_type.encode("ascii") + b"\n" + data
+
+
+def _unpack(blob):
+    content_type, _, data = blob.partition(b"\n")
+    return content_type.decode("ascii"), data
+
+
+def _open_store():
+    if CACHE_DISABLED:
+        return None
+    try:
+        return DiskCache(os.path.join(CACHE_DIR, "images.sqlite3"), max_bytes=IMAGE_CACHE_MAX_BYTES)
+    except Exception as e:
+        log.warning("Store unavailable, proxying without a cache", error=repr(e))
+        return None
+
+
+_store = _open_store()
+
+
+def _sniff(data):
+    """Format of `data` by its magic bytes, for when Pillow isn't installed."""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "WEBP"
+    for magic, fmt in _MAGIC:
+        if data.startswith(magic):
+            return fmt
+    return None
+
+
+def _variants(data):
+    """{width: (content_type, bytes)}: the original (0) and every variant narrower than it."""
+    if Image is None:
+        fmt = _sniff(data)
+        if fmt is None:
+            raise ImageError("Not an image")
+        return {0: (_FORMATS[fmt], data)}
+    try:
+        original = Image.open(io.BytesIO(data))
+        original.load()
+    except Exception as e:
+        raise ImageError(f"Could not decode image: {e!r}")
+    if original.format not in _FORMATS:
+        raise ImageError(f"Unsupported image format: {original.format}")
+    alpha = original.mode in ("RGBA", "LA") or (original.mode == "P" and "transparency" in original.info)
+    variants = {0: (_FORMATS[original.format], data)}
+    for size in SIZES:
+        if size >= original.width:
+            break
+        img = original.copy()
+        img.thumbnail((size, original.height), Image.LANCZOS)
+        out = io.BytesIO()
+        if alpha:
+            img.save(out, "PNG", optimize=True)
+            variants[size] = ("image/png", out.getvalue())
+        else:
+            img.convert("RGB").save(out, "JPEG", quality=82, optimize=True, progressive=True)
+            variants[size] = ("image/jpeg", out.getvalue())
+    return variants
+
+
+async def _download(url):
+    # redirects are followed here, not by httpx, so every hop is checked against IMAGE_HOSTS
+    async with upstream_client(timeout=10, follow_redirects=False) as client:
+        for _ in range(MAX_REDIRECTS + 1):
+            async with client.stream("GET", url) as resp:
+                if resp.is_redirect:
+                    url = urljoin(url, resp.headers["location"])
+                    if not _allowed(url):
+                        raise ImageError("Redirected to a host not allowed")
+                    continue
+                if resp.status_code != 200:
+                    raise ImageError(f"Upstream status {resp.status_code}", 404 if resp.status_code == 404 else 502)
+                chunks = []
+                size = 0
+                async for chunk in resp.aiter_bytes():
+                    size += len(chunk)
+                    if size > IMAGE_MAX_BYTES:
+                        raise ImageError("Image too large")
+                    chunks.append(chunk)
+                return b"".join(chunks)
+    raise ImageError("Too many redirects")
+
+
+async def _fetch_and_store(key, url):
+    """Download the original, build its variants and store them all; returns {width: (type, bytes)}."""
+    data = await _download(url)
+    variants = await asyncio.to_thread(_variants, data)
+    if _store is not None:
+        expires = time.time() + IMAGE_TTL
+
+        def write():
+            for size, (ctype, body) in variants.items():
+                _store.set(f"{key}:{size}", _pack(ctype, body), expires)
+
+        try:
+            await asyncio.to_thread(write)
+        except Exception as e:
+            log.warning("Write failed", error=repr(e))
+    return variants
+
+
+_inflight = {}
+
+
+async def get_image(key, width=None):
+    """(content_type, bytes) of the variant of image `key` closest to `width`."""
+    url = source_url(key)
+    size = snap_size(width)
+    if _store is not None:
+        blob, _ = await asyncio.to_thread(_store.get, f"{key}:{size}")
+        if blob is MISS and size:
+            # images narrower than the variant only have the original
+            blob, _ = await asyncio.to_thread(_store.get, f"{key}:0")
+        if blob is not MISS:
+            return _unpack(blob)
+
+    # one download per image, however many requests are waiting for it
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_and_store(key, url))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    variants = await asyncio.shield(task)
+    return variants.get(size) or variants[0]
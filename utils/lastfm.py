@@ -1,5 +1,11 @@
 
-async def fetch_lastfm_recommended_artists(client, artist_name, api_key):
+from utils.cache import cached
+from utils.schemas import LastfmSimilarArtists, LastfmSimilarTracks, LastfmTopTracks, decode
+from utils.track import LASTFM, Track, pack_tracks, unpack_tracks
+
+
+@cached("lastfm_related_artists")
+async def fetch_lastfm_recommended_artists(client, artist_name, api_key, limit=10):
     rec_artists = []
 
     resp = await client.get("http://ws.audioscrobbler.com/2.0/", params={
@@ -7,68 +13,64 @@ async def fetch_lastfm_recommended_artists(client, artist_name, api_key):
         "artist": artist_name,
         "api_key": api_key,
         "format": "json",
-        "limit": 10
+        "limit": limit
     })
 
-    for a in resp.json().get("similarartists", {}).get("artist", []):
+    for a in decode(resp, LastfmSimilarArtists).similarartists.artist:
         rec_artists.append({
-            "name": a["name"],
-            "image_url": a.get("image", [{}])[-1].get("#text") if a.get("image") else None,
+            "name": a.name,
+            "image_url": a.image[-1].text if a.image else None,
             "genres": [],
             "links": {
-                "lastfm": a.get("url")
+                "lastfm": a.url
             },
             "source": "Last.fm"
         })
 
     return rec_artists
 
-async def fetch_lastfm_tracks(client, artist_name: str, api_key: str, limit: int = 20, offset: int = 0):
-    tracks = []
-
-    # Step 1: Get similar artists
-    similar_resp = await client.get("http://ws.audioscrobbler.com/2.0/", params={
+@cached("lastfm_similar_artist_names")
+async def _lastfm_similar_artist_names(client, artist_name, api_key):
+    resp = await client.get("http://ws.audioscrobbler.com/2.0/", params={
         "method": "artist.getsimilar",
         "artist": artist_name,
         "api_key": api_key,
         "format": "json",
         "limit": 50  # Get more for local slicing
     })
-    similar_artists = similar_resp.json().get("similarartists", {}).get("artist", [])
-
-    all_related_tracks = []
-
-    # Step 2: Fetch top track of each similar artist
-    for artist in similar_artists:
-        top_resp = await client.get("http://ws.audioscrobbler.com/2.0/", params={
-            "method": "artist.gettoptracks",
-            "artist": artist["name"],
-            "api_key": api_key,
-            "format": "json",
-            "limit": 1
-        })
-        top_tracks = top_resp.json().get("toptracks", {}).get("track", [])
-        if top_tracks:
-            t = top_tracks[0]
-            all_related_tracks.append({
-                "title": t["name"],
-                "artist": artist["name"],
-                "duration_sec": int(t.get("duration", 0)),
-                "cover": t["image"][-1]["#text"] if t.get("image") else None,
-                "preview_url": None,
-                "spotify_url": None,
-                "deezer_url": t.get("url"),
-                "soundcloud_url": None,
-                "source": ["Last.fm"]
-            })
-
-    # Step 3: Manual pagination
-    paginated = all_related_tracks[offset:offset + limit]
-    tracks.extend(paginated)
-
-    return tracks
+    return [a.name for a in decode(resp, LastfmSimilarArtists).similarartists.artist]
 
 
+@cached("lastfm_top_track", encode=pack_tracks, decode=unpack_tracks)
+async def _lastfm_top_track(client, artist_name, api_key):
+    resp = await client.get("http://ws.audioscrobbler.com/2.0/", params={
+        "method": "artist.gettoptracks",
+        "artist": artist_name,
+        "api_key": api_key,
+        "format": "json",
+        "limit": 1
+    })
+    return [
+        Track(
+            t.name,
+            artist_name,
+            duration_ms=int(t.duration or 0) * 1000,
+            cover_url=t.image[-1].text if t.image else None,
+            lastfm_url=t.url,
+            sources=LASTFM,
+        )
+        for t in decode(resp, LastfmTopTracks).toptracks.track[:1]
+    ]
+
+
+async def iter_lastfm_tracks(client, artist_name: str, api_key: str):
+    """The top track of each similar artist, looked up only when it is needed."""
+    for name in await _lastfm_similar_artist_names(client, artist_name, api_key):
+        for track in await _lastfm_top_track(client, name, api_key):
+            yield track
+
+
+@cached("lastfm_similar_tracks", encode=pack_tracks, decode=unpack_tracks)
 async def fetch_lastfm_similar_tracks(client, artist_name: str, track_title: str, api_key: str, limit: int = 20):
     tracks = []
     resp = await client.get("http://ws.audioscrobbler.com/2.0/", params={
@@ -79,24 +81,27 @@ async def fetch_lastfm_similar_tracks(client, artist_name: str, track_title: str
         "format": "json",
         "limit": limit
     })
-    similar = resp.json().get("similartracks", {}).get("track", [])
+    similar = decode(resp, LastfmSimilarTracks).similartracks.track
 
     for t in similar:
-        tracks.append({
-            "title": t["name"],
-            "artist": t["artist"]["name"],
-            "duration_sec": 0,
-            "cover": t.get("image", [{}])[-1].get("#text"),
-            "preview_url": None,
-            "spotify_url": None,
-            "deezer_url": None,
-            "soundcloud_url": None,
-            "source": ["Last.fm"]
-        })
+        tracks.append(Track(
+            t.name,
+            t.artist.name,
+            cover_url=t.image[-1].text if t.image else None,
+            sources=LASTFM,
+        ))
 
     return tracks
 
 
+async def iter_lastfm_similar_tracks(client, artist_name: str, track_title: str, api_key: str, limit: int = 20):
+    # a single call; `limit` is how many the caller expects to need
+    if not track_title:
+        return
+    for track in await fetch_lastfm_similar_tracks(client, artist_name, track_title, api_key, limit):
+        yield track
+
+
 async def get_lastfm_tracks_and_artists_by_tag(client, tags, api_key):
  
     tracks = []
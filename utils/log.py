@@ -0,0 +1,200 @@
+"""
+Structured logging that never writes on the request path.
+
+`get_logger(name)` loggers put records on a bounded in-memory queue. A
+listener thread formats them (JSON lines, or text with LOG_FORMAT=text) and
+writes them to stdout. When the queue is full a record is dropped and
+counted rather than waited for. Each record carries the ID of the request
+it was logged under (X-Request-ID, taken from the request or generated),
+and tokens, keys and secrets are redacted from messages and fields before
+they are written. Per-item events go through `sampled()`, which keeps only
+LOG_SAMPLE_RATE of them.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+from utils import metrics
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# JSON dumps of upstream results in the working directory, for local debugging only
+DEBUG_DUMPS = LOG_LEVEL == "DEBUG"
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+metrics.describe("log_dropped_total", "Log records dropped because the log queue was full")
+
+REDACTED = "[REDACTED]"
+# Field names whose values are never written
+_SECRET_FIELD = re.compile(r"token|secret|password|authorization|api_?key|client_?id|^key$", re.I)
+_SECRET_TEXT = (
+    (re.compile(r"\b(Bearer|Basic)\s+[A-Za-z0-9._~+/=-]+", re.I), r"\1 " + REDACTED),
+    (re.compile(r"""(["']?(?:access_token|refresh_token|client_secret|api_key|secret|token)["']?\s*[:=]\s*["']?)"""
+                r"""[^"'&\s,}]+""", re.I), r"\1" + REDACTED),
+    (re.compile(r"([?&](?:key|secret|api_key|client_id|client_secret|token)=)[^&\s\"']+", re.I), r"\1" + REDACTED),
+)
+
+
+def redact(text):
+    for pattern, replacement in _SECRET_TEXT:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _redact_fields(fields):
+    return {
+        key: REDACTED if _SECRET_FIELD.search(key) else redact(value) if isinstance(value, str) else value
+        for key, value in fields.items()
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": redact(record.getMessage()),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(_redact_fields(fields))
+        if record.exc_info:
+            entry["exc"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        stamp = time.strftime("%H:%M:%S", time.localtime(record.created))
+        line = f"{stamp} {record.levelname:<7} [{record.name}] {redact(record.getMessage())}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in _redact_fields(fields).items())
+        if getattr(record, "request_id", None):
+            line += f" rid={record.request_id}"
+        if record.exc_info:
+            line += "\n" + redact(self.formatException(record.exc_info))
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # formatting happens on the listener thread; only what can't wait is captured here
+        record.request_id = request_id.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_dropped_total")
+
+
+def _configure():
+    # the formatters never show source locations or thread names, so don't collect them
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger("app")
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(_QueueHandler(records))
+    root.propagate = False
+    return listener
+
+
+_listener = _configure()
+
+
+class Logger:
+    """`event` is a short fixed message; what varies goes in keyword fields."""
+
+    __slots__ = ("_logger",)
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(f"app.{name}")
+
+    def _log(self, level, event, fields, exc_info=None):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={"fields": fields}, exc_info=exc_info)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+    def sampled(self, event, rate=None, **fields):
+        """An info record for only `rate` (default LOG_SAMPLE_RATE) of calls, for per-track noise."""
+        rate = LOG_SAMPLE_RATE if rate is None else rate
+        if rate < 1 and random.random() >= rate:
+            return
+        fields["sample_rate"] = rate
+        self._log(logging.INFO, event, fields)
+
+
+def get_logger(name):
+    return Logger(name)
+
+
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class RequestIdMiddleware:
+    """Tags everything a request logs with its X-Request-ID (the caller's, if sane) and echoes it back."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        rid = incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex[:16]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), (b"x-request-id", rid.encode("ascii"))]
+            await send(message)
+
+        token = request_id.set(rid)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
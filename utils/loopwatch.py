@@ -0,0 +1,112 @@
+"""
+Event-loop lag and blocking-call detection.
+
+A probe task sleeps LOOP_PROBE_INTERVAL at a time and measures how late it
+wakes up: that delay is how long something else held the loop, and it is
+exported as `event_loop_lag_seconds`. A watchdog thread watches the probe's
+heartbeat; once the loop has been stuck for LOOP_BLOCK_THRESHOLD it grabs
+the loop thread's stack right away, while the blocking call is still running.
+It prints the stack and keeps the most recent ones in `watch.stalls`.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from dotenv import load_dotenv
+
+from utils import metrics
+from utils.log import get_logger
+
+load_dotenv()
+
+log = get_logger("loop")
+
+LOOP_WATCH_DISABLED = os.getenv("LOOP_WATCH_DISABLED", "").lower() in ("1", "true", "yes")
+LOOP_PROBE_INTERVAL = float(os.getenv("LOOP_PROBE_INTERVAL", "0.05"))
+# A callback holding the loop this long gets its stack captured
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.1"))
+# Innermost frames printed per stall
+LOOP_STACK_DEPTH = int(os.getenv("LOOP_STACK_DEPTH", "12"))
+
+metrics.describe("event_loop_lag_seconds", "How late the last loop probe woke up")
+metrics.describe("event_loop_lag_seconds_total", "Summed probe lateness (divide by probes for the mean)")
+metrics.describe("event_loop_probes_total", "Loop probes run")
+metrics.describe("event_loop_stalls_total", "Times the loop was blocked past LOOP_BLOCK_THRESHOLD")
+
+
+class LoopWatch:
+    def __init__(self, interval=LOOP_PROBE_INTERVAL, threshold=LOOP_BLOCK_THRESHOLD, keep=32):
+        self.interval = interval
+        self.threshold = threshold
+        # {"at", "blocked_ms", "stack"} per stall, newest last
+        self.stalls = deque(maxlen=keep)
+        # worst lag seen since this was last reset
+        self.peak = 0.0
+        self._beat = None
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    async def _probe(self):
+        while True:
+            beat = self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - beat - self.interval)
+            self.peak = max(self.peak, lag)
+            metrics.set_gauge("event_loop_lag_seconds", round(lag, 6))
+            metrics.inc("event_loop_lag_seconds_total", lag)
+            metrics.inc("event_loop_probes_total")
+            stall = self.stalls[-1] if self.stalls else None
+            if stall is not None and stall["beat"] == beat:
+                # the watchdog saw this one while it was happening; now we know how long it lasted
+                stall["blocked_ms"] = round(lag * 1000, 1)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(min(self.interval, self.threshold) / 2):
+            beat = self._beat
+            if beat is None or beat == reported:
+                continue
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = traceback.format_stack(frame)[-LOOP_STACK_DEPTH:] if frame is not None else []
+            self.stalls.append({"beat": beat, "at": time.time(), "blocked_ms": round(blocked * 1000, 1),
+                                "stack": "".join(stack)})
+            metrics.inc("event_loop_stalls_total")
+            log.warning("Event loop blocked", blocked_ms=round(blocked * 1000), stack="".join(stack))
+
+    def start(self):
+        """Start probing the running loop (idempotent)."""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._probe(), name="loopwatch")
+        self._thread = threading.Thread(target=self._watch, name="loopwatch", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._beat = None
+
+
+watch = LoopWatch()
+
+
+def start_loopwatch():
+    """Start the process-wide watchdog on the running loop, unless disabled."""
+    if not LOOP_WATCH_DISABLED:
+        watch.start()
+    return watch
@@ -1,4 +1,16 @@
+from utils.images import proxied
+from utils.track import Track
+
+
 def make_track(t):
+    track = _track_dict(t)
+    track["cover_url"] = proxied(track["cover_url"])
+    return track
+
+
+def _track_dict(t):
+    if isinstance(t, Track):
+        return t.to_dict()
     return {
             "title": t.get("title", "").strip(),
             "artist": t.get("artist", "").strip(),
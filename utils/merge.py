@@ -1,5 +1,115 @@
+import asyncio
+import math
 from collections import defaultdict
 
+from utils.log import get_logger
+from utils.profiling import span
+
+log = get_logger("merge")
+
+# Share of pulled tracks that turn out unique and usable, learned across
+# requests; sizes each pull round so most pages need only one.
+_pull_yield = 0.7
+
+
+def merge_tracks(tracks):
+    """
+    Deduplicate `Track`s by (title, artist), merging duplicates into the
+    first seen: its fields win and later copies only fill the gaps (the
+    old dict-based dedupe kept the last copy's fields).
+    """
+    merged = {}
+    for track in tracks:
+        key = track.key
+        existing = merged.get(key)
+        if existing is None:
+            merged[key] = track
+        else:
+            existing.merge(track)
+    return list(merged.values())
+
+
+async def _take(stream, n):
+    """Up to `n` more tracks from `stream`, and whether it has run dry."""
+    items = []
+    with span("pull " + getattr(stream, "__name__", "tracks"), requested=n) as s:
+        try:
+            async for track in stream:
+                items.append(track)
+                if len(items) >= n:
+                    return items, False
+        except Exception as e:
+            # a failing provider just stops contributing
+            log.warning("Track stream failed", error=repr(e))
+            if s is not None:
+                s.finish("error")
+        finally:
+            if s is not None:
+                s.attrs["got"] = len(items)
+    return items, True
+
+
+def _interleave(buffers, depth):
+    for i in range(depth):
+        for buf in buffers:
+            if i < len(buf):
+                yield buf[i]
+
+
+async def pull_tracks(streams, want, keep=None, max_rejected=None):
+    """
+    Pull from lazy track `streams` until `want` unique tracks (that pass
+    `keep`) are in hand, or every stream is exhausted. A stream that yields
+    `max_rejected` (default `want`) tracks in a row that `keep` rejects is
+    not pulled any further.
+
+    Streams are pulled concurrently in rounds, each sized from the learned
+    dedupe yield. The result interleaves the streams rank by rank, rather
+    than listing one provider after another, and only up to the depth
+    every live stream has reached, so it depends on what the providers
+    returned and not on how the rounds happened to fall. Duplicates are
+    merged into the first copy, as in `merge_tracks`.
+    """
+    global _pull_yield
+    buffers = [[] for _ in streams]
+    exhausted = [False] * len(streams)
+    rejected = [0] * len(streams)
+    max_rejected = max_rejected or want
+    result = []
+    try:
+        while True:
+            live = [i for i, done in enumerate(exhausted) if not done]
+            depth = min((len(buffers[i]) for i in live), default=max(map(len, buffers), default=0))
+            merged = merge_tracks(_interleave(buffers, depth))
+            result = [t for t in merged if keep is None or keep(t)]
+            if len(result) >= want or not live:
+                break
+            # ask each live stream for its share of what's missing, padded by the expected loss
+            target = depth + math.ceil((want - len(result)) / len(live) / _pull_yield)
+            behind = [i for i in live if len(buffers[i]) < target]
+            pulled = await asyncio.gather(*[_take(streams[i], target - len(buffers[i])) for i in behind])
+            for i, (items, dry) in zip(behind, pulled):
+                buffers[i] += items
+                exhausted[i] = dry
+                if keep is not None:
+                    for track in items:
+                        rejected[i] = 0 if keep(track) else rejected[i] + 1
+                    if rejected[i] >= max_rejected:
+                        log.debug("Stream stopped after rejected tracks", stream=i, rejected=rejected[i])
+                        exhausted[i] = True
+    finally:
+        for stream in streams:
+            # a stream still mid-await belongs to a _take being cancelled with us; it closes itself
+            if not stream.ag_running:
+                await stream.aclose()
+
+    pulled_total = sum(map(len, buffers))
+    if pulled_total:
+        observed = max(0.05, min(1.0, len(result) / pulled_total))
+        _pull_yield = 0.8 * _pull_yield + 0.2 * observed
+    return result
+
+
 def combine_and_deduplicate_tracks(track_lists):
     merged = {}
     
@@ -0,0 +1,54 @@
+"""
+Process-local counters and gauges, rendered in the Prometheus text format
+by GET /metrics. Each worker reports its own numbers.
+"""
+from collections import defaultdict
+
+_counters = defaultdict(float)
+_gauges = {}
+_help = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+def inc(name, value=1, **labels):
+    _counters[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    _gauges[_key(name, labels)] = value
+
+
+def value(name, **labels):
+    key = _key(name, labels)
+    if key in _gauges:
+        return _gauges[key]
+    return _counters.get(key, 0)
+
+
+def _format(name, labels, val):
+    if labels:
+        name += "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+    if isinstance(val, float) and val.is_integer():
+        val = int(val)
+    return f"{name} {val}"
+
+
+def render():
+    lines = []
+    for kind, series in (("counter", _counters), ("gauge", _gauges)):
+        seen = set()
+        for (name, labels), val in sorted(series.items()):
+            if name not in seen:
+                seen.add(name)
+                if name in _help:
+                    lines.append(f"# HELP {name} {_help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+            lines.append(_format(name, labels, val))
+    return "\n".join(lines) + "\n"
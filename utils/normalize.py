@@ -1,10 +1,12 @@
-from utils.deezer import fetch_deezer_recommended_artists
-from utils.lastfm import fetch_lastfm_recommended_artists
-from utils.soundcloud import fetch_soundcloud_recommended_artists
-from utils.spotify import fetch_spotify_recommended_artists
+import asyncio
+
+from utils.log import get_logger
+from utils.providers import SeedContext, select_providers
 import httpx
 from typing import Optional
 
+log = get_logger("related")
+
 def normalize(t):
     return (t["title"].lower().strip(), t["artist"].lower().strip())
 
@@ -28,26 +30,38 @@ def normalize_artist_entry(artist, seen_names):
         return None
     seen_names.add(name)
 
+    # providers hand back a `links` dict; older entries carry flat `<source>_url` keys
+    links = artist.get("links") or {}
     return {
         "name": artist["name"],
         "image_url": artist.get("image_url"),
         "genres": artist.get("genres", []),
         "links": {
-            "spotify": artist.get("spotify_url"),
-            "deezer": artist.get("deezer_url"),
-            "soundcloud": artist.get("soundcloud_url"),
-            "lastfm": artist.get("lastfm_url"),
+            "spotify": links.get("spotify") or artist.get("spotify_url"),
+            "deezer": links.get("deezer") or artist.get("deezer_url"),
+            "soundcloud": links.get("soundcloud") or artist.get("soundcloud_url"),
+            "lastfm": links.get("lastfm") or artist.get("lastfm_url"),
         },
         "source": artist.get("source", [])
     }
     
-async def get_all_recommended_artists(artist_name, artist_id, client, headers, lastfm_key, soundcloud_id):
-    spotify = await fetch_spotify_recommended_artists(client, headers, artist_id)
-    deezer = await fetch_deezer_recommended_artists(client, artist_name)
-    lastfm = await fetch_lastfm_recommended_artists(client, artist_name, lastfm_key)
-    soundcloud = await fetch_soundcloud_recommended_artists(client, artist_name, soundcloud_id)
+async def get_all_recommended_artists(artist_name, artist_id, client, headers, lastfm_key, soundcloud_id, providers=None):
+    if providers is None:
+        providers = select_providers()
+    ctx = SeedContext(client, headers, artist_id, artist_name, lastfm_key=lastfm_key, soundcloud_id=soundcloud_id)
 
-    combined = spotify + deezer + lastfm + soundcloud
+    # all providers at once; results are combined in registry order
+    listings = await asyncio.gather(
+        *[p.related_artists(ctx) for p in providers if p.related_artists],
+        return_exceptions=True,
+    )
+    combined = []
+    for listing in listings:
+        if isinstance(listing, BaseException):
+            # a throttled or failing provider just doesn't contribute
+            log.warning("Related artist listing failed", error=repr(listing))
+            continue
+        combined += listing
     seen = set()
     normalized = []
 
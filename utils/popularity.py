@@ -0,0 +1,201 @@
+"""
+Request popularity, and refreshing what popular requests depend on.
+
+Hits per seed and per resolved artist go into a count-min sketch of fixed
+size whose counters are halved every POPULARITY_HALF_LIFE seconds, so old
+popularity fades. The keys with the highest estimates are kept in a small
+candidate table together with what it takes to recompute them.
+
+A background task wakes every REFRESH_INTERVAL seconds and re-runs the
+hottest keys with `cache.refresh_margin` set: every cached provider call,
+enrichment lookup and merged result that would expire within the margin is
+fetched again, everything else is read from cache as usual. Each round may
+spend at most REFRESH_SHARE of the UPSTREAM_QUOTA_PER_MINUTE upstream calls.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from array import array
+
+from dotenv import load_dotenv
+
+from utils import metrics
+from utils.cache import refresh_margin
+from utils.log import get_logger
+
+load_dotenv()
+
+log = get_logger("refresh")
+
+SKETCH_WIDTH = int(os.getenv("POPULARITY_SKETCH_WIDTH", "4096"))
+SKETCH_DEPTH = int(os.getenv("POPULARITY_SKETCH_DEPTH", "4"))
+HOT_KEYS = int(os.getenv("POPULARITY_HOT_KEYS", "256"))
+HALF_LIFE = float(os.getenv("POPULARITY_HALF_LIFE", "3600"))
+
+REFRESH_DISABLED = os.getenv("REFRESH_DISABLED", "").lower() in ("1", "true", "yes")
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", "60"))
+# How many of the hottest keys each round looks at
+REFRESH_TOP = int(os.getenv("REFRESH_TOP", "32"))
+# Keys estimated below this many (decayed) hits are never refreshed
+REFRESH_MIN_HITS = float(os.getenv("REFRESH_MIN_HITS", "3"))
+# Entries with less time left than this are refreshed; must exceed the interval
+REFRESH_MARGIN = float(os.getenv("REFRESH_MARGIN", str(3 * REFRESH_INTERVAL)))
+UPSTREAM_QUOTA_PER_MINUTE = int(os.getenv("UPSTREAM_QUOTA_PER_MINUTE", "1200"))
+REFRESH_SHARE = float(os.getenv("REFRESH_SHARE", "0.1"))
+
+metrics.describe("popularity_hits_total", "Requests counted by the popularity tracker")
+metrics.describe("popularity_hot_keys", "Keys in the hot-key table")
+metrics.describe("refresh_runs_total", "Hot keys refreshed ahead of expiry")
+metrics.describe("refresh_upstream_calls_total", "Upstream calls spent on refreshes")
+metrics.describe("refresh_skipped_total", "Hot keys not refreshed because the round's call share was spent")
+
+
+class CountMinSketch:
+    """
+    Approximate counts in `depth` rows of `width` float counters. Estimates
+    never undercount; collisions can only add to them.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.width = width
+        self.depth = depth
+        self._rows = [array("f", bytes(4 * width)) for _ in range(depth)]
+
+    def _slots(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key, count=1.0):
+        """Count `key` and return its new estimate."""
+        estimate = float("inf")
+        for row, slot in zip(self._rows, self._slots(key)):
+            row[slot] += count
+            estimate = min(estimate, row[slot])
+        return estimate
+
+    def estimate(self, key):
+        return min(row[slot] for row, slot in zip(self._rows, self._slots(key)))
+
+    def decay(self, factor):
+        for i, row in enumerate(self._rows):
+            self._rows[i] = array("f", (c * factor for c in row))
+
+
+class PopularityTracker:
+    """Sketch plus a table of the `capacity` hottest keys and how to refresh each."""
+
+    def __init__(self, capacity=HOT_KEYS, half_life=HALF_LIFE):
+        self.capacity = capacity
+        self.half_life = half_life
+        self.sketch = CountMinSketch()
+        # (kind, key) -> [estimate, payload]
+        self._hot = {}
+        self._decayed = time.monotonic()
+
+    def hit(self, kind, key, payload):
+        """Count a request for `key`; `payload` is what its refresher needs to recompute it."""
+        if refresh_margin.get() is not None:
+            # our own refreshes are not demand
+            return
+        self._maybe_decay()
+        metrics.inc("popularity_hits_total", kind=kind)
+        estimate = self.sketch.add(f"{kind}\x00{key}")
+        entry = self._hot.get((kind, key))
+        if entry is not None:
+            entry[0] = estimate
+            return
+        if len(self._hot) >= self.capacity:
+            coldest = min(self._hot, key=lambda k: self._hot[k][0])
+            if self._hot[coldest][0] >= estimate:
+                return
+            del self._hot[coldest]
+        self._hot[(kind, key)] = [estimate, payload]
+        metrics.set_gauge("popularity_hot_keys", len(self._hot))
+
+    def estimate(self, kind, key):
+        return self.sketch.estimate(f"{kind}\x00{key}")
+
+    def hottest(self, n, min_hits=0.0):
+        """[(kind, key, payload, estimate)] for the `n` hottest keys, hottest first."""
+        self._maybe_decay()
+        ranked = sorted(self._hot.items(), key=lambda item: item[1][0], reverse=True)
+        return [(kind, key, payload, est) for (kind, key), (est, payload) in ranked[:n] if est >= min_hits]
+
+    def _maybe_decay(self):
+        now = time.monotonic()
+        if now - self._decayed < self.half_life:
+            return
+        halvings = int((now - self._decayed) // self.half_life)
+        factor = 0.5 ** halvings
+        self._decayed += halvings * self.half_life
+        self.sketch.decay(factor)
+        for entry in self._hot.values():
+            entry[0] *= factor
+
+
+tracker = PopularityTracker()
+
+# kind -> async fn(payload, allowance) returning the upstream calls it spent
+_refreshers = {}
+
+
+def refresher(kind):
+    """Register the coroutine that recomputes keys of `kind` within an upstream call allowance."""
+    def register(fn):
+        _refreshers[kind] = fn
+        return fn
+    return register
+
+
+def round_allowance():
+    return int(UPSTREAM_QUOTA_PER_MINUTE * REFRESH_SHARE * REFRESH_INTERVAL / 60)
+
+
+async def refresh_round():
+    """Refresh the hottest keys until this round's share of upstream calls is spent."""
+    allowance = round_allowance()
+    token = refresh_margin.set(REFRESH_MARGIN)
+    try:
+        hot = tracker.hottest(REFRESH_TOP, REFRESH_MIN_HITS)
+        for i, (kind, key, payload, _) in enumerate(hot):
+            fn = _refreshers.get(kind)
+            if fn is None:
+                continue
+            if allowance <= 0:
+                metrics.inc("refresh_skipped_total", len(hot) - i)
+                break
+            try:
+                # own task, so budgets the refresher sets don't leak into the next one
+                spent = await asyncio.create_task(fn(payload, allowance))
+            except Exception as e:
+                log.warning("Refresh failed", kind=kind, key=key, error=repr(e))
+                continue
+            allowance -= spent
+            metrics.inc("refresh_runs_total", kind=kind)
+            metrics.inc("refresh_upstream_calls_total", spent, kind=kind)
+    finally:
+        refresh_margin.reset(token)
+
+
+async def _run_forever():
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        try:
+            await refresh_round()
+        except Exception as e:
+            log.exception("Round failed")
+
+
+_task = None
+
+
+def start_refresher():
+    """Start the background refresh loop (once per process)."""
+    global _task
+    if REFRESH_DISABLED or (_task is not None and not _task.done()):
+        return _task
+    _task = asyncio.create_task(_run_forever())
+    return _task
@@ -0,0 +1,159 @@
+"""
+Opt-in per-request profiling.
+
+A profiled request records a tree of spans: pipeline stages, provider
+pulls, enrichment lookups and every upstream HTTP call (through
+utils.http). Spans follow the asyncio context, so work started with
+gather() lands under whichever span was open when it was started. When
+nothing is being profiled, `span()` only does a context-variable lookup.
+"""
+import asyncio
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# When set, X-Profile is honoured only with a matching X-Debug-Key header
+DEBUG_KEY = os.getenv("DEBUG_KEY")
+
+current_span = contextvars.ContextVar("profile_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "status", "bytes", "children", "task")
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.perf_counter()
+        self.end = None
+        self.status = None
+        self.bytes = None
+        self.children = []
+        task = asyncio.current_task() if _running() else None
+        self.task = id(task) if task else 0
+
+    def child(self, name, **attrs):
+        span = Span(name, attrs)
+        self.children.append(span)
+        return span
+
+    def finish(self, status="ok", nbytes=None):
+        self.end = time.perf_counter()
+        self.status = status
+        if nbytes is not None:
+            self.bytes = nbytes
+
+    def to_dict(self, t0):
+        node = {
+            "name": self.name,
+            "start_ms": round((self.start - t0) * 1000, 3),
+            "end_ms": round((self.end - t0) * 1000, 3) if self.end is not None else None,
+            "status": self.status or "unfinished",
+        }
+        if self.bytes is not None:
+            node["bytes"] = self.bytes
+        if self.attrs:
+            node["attrs"] = self.attrs
+        if self.children:
+            node["children"] = [c.to_dict(t0) for c in self.children]
+        return node
+
+
+def _running():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def requested(x_profile, x_debug_key=None):
+    """The profiling mode asked for by the request headers: None, "tree" or "chrome"."""
+    if not x_profile or x_profile.lower() in ("0", "false", "no"):
+        return None
+    if DEBUG_KEY and x_debug_key != DEBUG_KEY:
+        return None
+    return "chrome" if x_profile.lower() == "chrome" else "tree"
+
+
+def start(name, **attrs):
+    """Begin profiling the current context; returns the root span."""
+    root = Span(name, attrs)
+    current_span.set(root)
+    return root
+
+
+@contextmanager
+def span(name, **attrs):
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    s = parent.child(name, **attrs)
+    token = current_span.set(s)
+    try:
+        yield s
+    except asyncio.CancelledError:
+        s.finish("cancelled")
+        raise
+    except BaseException:
+        s.finish("error")
+        raise
+    else:
+        if s.end is None:
+            s.finish()
+    finally:
+        current_span.reset(token)
+
+
+async def traced(name, awaitable, **attrs):
+    with span(name, **attrs):
+        return await awaitable
+
+
+def leaf(name, **attrs):
+    """A span under the current one that is finished by hand (e.g. from an httpx hook)."""
+    parent = current_span.get()
+    return parent.child(name, **attrs) if parent is not None else None
+
+
+def report(root, mode="tree"):
+    """Payload of the SSE `timing` event for a finished profile."""
+    if root.end is None:
+        root.finish()
+    payload = {"total_ms": round((root.end - root.start) * 1000, 3), "spans": root.to_dict(root.start)}
+    if mode == "chrome":
+        payload["trace_events"] = chrome_trace(root)
+    return payload
+
+
+def chrome_trace(root):
+    """
+    The span tree as Chrome trace events (load in chrome://tracing or
+    Perfetto). Each asyncio task gets its own track, so spans on a track
+    nest properly.
+    """
+    events = []
+    tids = {}
+
+    def walk(s):
+        tid = tids.setdefault(s.task, len(tids) + 1)
+        end = s.end if s.end is not None else root.end
+        args = dict(s.attrs, status=s.status or "unfinished")
+        if s.bytes is not None:
+            args["bytes"] = s.bytes
+        events.append({
+            "name": s.name, "ph": "X", "pid": 1, "tid": tid,
+            "ts": round((s.start - root.start) * 1e6), "dur": round((end - s.start) * 1e6),
+            "args": args,
+        })
+        for c in s.children:
+            walk(c)
+
+    walk(root)
+    return events
@@ -0,0 +1,300 @@
+"""
+Registry of upstream providers and what each one can do.
+
+Adapters import their provider module on first call, so a request that
+selects only some sources never loads or calls the others. Track adapters
+return async iterators of Track: nothing is fetched until the merger pulls.
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LASTFM_API_KEY = os.getenv("LASTFM_API_KEY")
+SOUNDCLOUD_CLIENT_ID = os.getenv("SOUNDCLOUD_CLIENT_ID")
+
+TRACKS = "tracks"
+RELATED_ARTISTS = "related_artists"
+ARTIST_METADATA = "artist_metadata"
+LINK_LOOKUP = "link_lookup"
+
+
+class UnknownSourceError(ValueError):
+    pass
+
+
+class SeedContext:
+    """Everything an adapter needs to query a provider for one seed artist."""
+
+    __slots__ = ("client", "headers", "artist_id", "artist_name", "track_title",
+                 "limit", "offset", "lastfm_key", "soundcloud_id", "own_tracks")
+
+    def __init__(self, client, headers, artist_id, artist_name, track_title="", limit=20, offset=0,
+                 lastfm_key=None, soundcloud_id=None, own_tracks=True):
+        self.client = client
+        self.headers = headers
+        self.artist_id = artist_id
+        self.artist_name = artist_name
+        self.track_title = track_title
+        self.limit = limit
+        self.offset = offset
+        self.lastfm_key = lastfm_key or LASTFM_API_KEY
+        self.soundcloud_id = soundcloud_id or SOUNDCLOUD_CLIENT_ID
+        # False when the caller filters out the seed artist: their own tracks aren't fetched at all
+        self.own_tracks = own_tracks
+
+
+class Provider:
+    """
+    `tracks` are the provider's main track fetchers; `secondary_tracks` are
+    costlier fan-out fetchers that are the first to go when a request's
+    upstream budget runs short.
+    """
+
+    def __init__(self, name, tracks=(), secondary_tracks=(), related_artists=None, artist_metadata=False,
+                 link_lookup=False):
+        self.name = name
+        self.track_fetchers = tuple(tracks)
+        self.secondary_track_fetchers = tuple(secondary_tracks)
+        self.related_artists = related_artists
+        self.capabilities = set()
+        if self.track_fetchers or self.secondary_track_fetchers:
+            self.capabilities.add(TRACKS)
+        if related_artists:
+            self.capabilities.add(RELATED_ARTISTS)
+        # artist metadata and link lookups run inside utils.enrich, keyed by provider name
+        if artist_metadata:
+            self.capabilities.add(ARTIST_METADATA)
+        if link_lookup:
+            self.capabilities.add(LINK_LOOKUP)
+
+    def __repr__(self):
+        return f"Provider({self.name!r}, {sorted(self.capabilities)})"
+
+    def supports(self, capability):
+        return capability in self.capabilities
+
+
+# Related artists asked of each provider; adapters pass it on, and the cost model counts them
+RELATED_ARTISTS_LIMIT = 10
+
+
+def _calls(n, artists=0):
+    """
+    Mark an adapter with a rough upper bound of the upstream calls it makes,
+    and (related-artist adapters) how many artists it returns at most.
+    """
+    def mark(fn):
+        fn.calls = n
+        fn.artists = artists
+        return fn
+    return mark
+
+
+# --- Spotify ---
+
+async def _nothing():
+    return
+    yield
+
+
+@_calls(12)
+def _spotify_tracks(ctx):
+    from utils.spotify import iter_spotify_tracks
+    if not ctx.artist_id:
+        return _nothing()
+    return iter_spotify_tracks(ctx.client, ctx.headers, ctx.artist_id, own=ctx.own_tracks)
+
+
+@_calls(1, artists=RELATED_ARTISTS_LIMIT)
+async def _spotify_related_artists(ctx):
+    from utils.spotify import fetch_spotify_recommended_artists
+    if not ctx.artist_id:
+        return []
+    return await fetch_spotify_recommended_artists(ctx.client, ctx.headers, ctx.artist_id, RELATED_ARTISTS_LIMIT)
+
+
+# --- Deezer ---
+
+@_calls(5)
+def _deezer_top_tracks(ctx):
+    from utils.deezer import iter_deezer_tracks
+    if not ctx.own_tracks:
+        # nothing but the seed artist's own tracks
+        return _nothing()
+    return iter_deezer_tracks(ctx.client, ctx.artist_name)
+
+
+@_calls(12)
+def _deezer_related_tracks(ctx):
+    from utils.deezer import iter_deezer_related_tracks
+    return iter_deezer_related_tracks(ctx.client, ctx.artist_name)
+
+
+@_calls(2, artists=RELATED_ARTISTS_LIMIT)
+async def _deezer_related_artists(ctx):
+    from utils.deezer import fetch_deezer_recommended_artists
+    return await fetch_deezer_recommended_artists(ctx.client, ctx.artist_name, RELATED_ARTISTS_LIMIT)
+
+
+# --- Last.fm ---
+
+@_calls(51)
+def _lastfm_similar_artist_tracks(ctx):
+    from utils.lastfm import iter_lastfm_tracks
+    return iter_lastfm_tracks(ctx.client, ctx.artist_name, ctx.lastfm_key)
+
+
+@_calls(1)
+def _lastfm_similar_tracks(ctx):
+    from utils.lastfm import iter_lastfm_similar_tracks
+    return iter_lastfm_similar_tracks(
+        ctx.client, ctx.artist_name, ctx.track_title, ctx.lastfm_key, limit=ctx.offset + ctx.limit
+    )
+
+
+@_calls(1, artists=RELATED_ARTISTS_LIMIT)
+async def _lastfm_related_artists(ctx):
+    from utils.lastfm import fetch_lastfm_recommended_artists
+    return await fetch_lastfm_recommended_artists(ctx.client, ctx.artist_name, ctx.lastfm_key, RELATED_ARTISTS_LIMIT)
+
+
+# --- SoundCloud ---
+
+@_calls(9)
+def _soundcloud_tracks(ctx):
+    from utils.soundcloud import iter_soundcloud_tracks
+    return iter_soundcloud_tracks(
+        ctx.track_title, ctx.artist_name, ctx.client, ctx.soundcloud_id, limit=ctx.offset + ctx.limit,
+        own=ctx.own_tracks,
+    )
+
+
+@_calls(2, artists=RELATED_ARTISTS_LIMIT)
+async def _soundcloud_related_artists(ctx):
+    from utils.soundcloud import fetch_soundcloud_recommended_artists
+    return await fetch_soundcloud_recommended_artists(
+        ctx.client, ctx.artist_name, ctx.soundcloud_id, RELATED_ARTISTS_LIMIT
+    )
+
+
+# --- Local embeddings (no upstream calls) ---
+
+@_calls(0)
+async def _local_similar_tracks(ctx):
+    from utils.embeddings import index
+    from utils.track import LOCAL, Track
+    if index is None or not ctx.track_title:
+        return
+    for (title, artist), _ in index.similar_tracks(ctx.track_title, ctx.artist_name, k=ctx.offset + ctx.limit):
+        yield Track(title, artist, sources=LOCAL)
+
+
+@_calls(0, artists=RELATED_ARTISTS_LIMIT)
+async def _local_related_artists(ctx):
+    from utils.embeddings import index
+    if index is None:
+        return []
+    return [
+        {"name": name, "image_url": None, "genres": [], "links": {}, "source": "Local"}
+        for name, _ in index.similar_artists(ctx.artist_name, k=RELATED_ARTISTS_LIMIT)
+    ]
+
+
+PROVIDERS = {
+    "spotify": Provider(
+        "spotify",
+        tracks=[_spotify_tracks],
+        related_artists=_spotify_related_artists,
+        artist_metadata=True,
+        link_lookup=True,
+    ),
+    "deezer": Provider(
+        "deezer",
+        tracks=[_deezer_top_tracks],
+        secondary_tracks=[_deezer_related_tracks],
+        related_artists=_deezer_related_artists,
+        artist_metadata=True,
+        link_lookup=True,
+    ),
+    "lastfm": Provider(
+        "lastfm",
+        tracks=[_lastfm_similar_tracks],
+        secondary_tracks=[_lastfm_similar_artist_tracks],
+        related_artists=_lastfm_related_artists,
+        artist_metadata=True,
+    ),
+    "soundcloud": Provider(
+        "soundcloud",
+        tracks=[_soundcloud_tracks],
+        related_artists=_soundcloud_related_artists,
+        artist_metadata=True,
+        link_lookup=True,
+    ),
+    "local": Provider(
+        "local",
+        tracks=[_local_similar_tracks],
+        related_artists=_local_related_artists,
+    ),
+}
+
+
+def _parse(names):
+    if not names:
+        return []
+    if isinstance(names, str):
+        names = names.split(",")
+    parsed = [n.strip().lower() for n in names if n and n.strip()]
+    unknown = [n for n in parsed if n not in PROVIDERS]
+    if unknown:
+        raise UnknownSourceError(
+            f"Unknown source(s): {', '.join(unknown)}. Choose from: {', '.join(PROVIDERS)}"
+        )
+    return parsed
+
+
+def select_providers(sources=None, exclude_sources=None):
+    """
+    Resolve `sources=` / `exclude_sources=` (comma-separated strings or lists)
+    to providers, in registry order. No `sources` means all of them.
+    Raises UnknownSourceError for an unknown name, or when the exclusions
+    leave nothing to ask.
+    """
+    wanted = _parse(sources) or list(PROVIDERS)
+    excluded = set(_parse(exclude_sources))
+    selected = [PROVIDERS[name] for name in PROVIDERS if name in wanted and name not in excluded]
+    if not selected:
+        raise UnknownSourceError("No sources left to use: exclude_sources removes every selected source")
+    return selected
+
+
+def provider_names(providers, capability=None):
+    """Names of `providers` (optionally only those with `capability`), as a hashable tuple."""
+    return tuple(p.name for p in providers if capability is None or p.supports(capability))
+
+
+def _fetchers(providers, secondary):
+    for p in providers:
+        yield from p.track_fetchers
+        if secondary:
+            yield from p.secondary_track_fetchers
+
+
+def track_streams(providers, ctx, secondary=True):
+    """One lazy track iterator per track fetcher of the selected providers."""
+    return [fetch(ctx) for fetch in _fetchers(providers, secondary)]
+
+
+def fetch_calls(providers, secondary=False):
+    """Upper bound of the upstream calls made by draining `track_streams(providers, ..., secondary)`."""
+    return sum(fetch.calls for fetch in _fetchers(providers, secondary))
+
+
+def related_artist_calls(providers):
+    return sum(p.related_artists.calls for p in providers if p.related_artists)
+
+
+def related_artist_count(providers):
+    """Most related artists the providers' listings can return together."""
+    return sum(p.related_artists.artists for p in providers if p.related_artists)
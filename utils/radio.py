@@ -0,0 +1,344 @@
+"""
+Endless radio: a stream of recommendations that walks the artist graph
+breadth-first, one artist at a time, only as fast as the listener plays.
+
+A session starts at the seed's artist. Each step takes a few fresh tracks
+from the next artist in the frontier and queues that artist's related
+artists behind it. A producer task keeps `ahead` enriched tracks ready and
+stops as soon as it has them. Sending is paced by track durations, so the
+client is never more than `ahead` tracks ahead of playback. That pacing is
+what keeps the frontier from running ahead of the listener.
+
+Pausing is disconnecting. When the connection closes the producer is
+cancelled, so no upstream call is made for a paused listener. The session
+(frontier, seen-set and ready tracks) is kept for RADIO_SESSION_TTL
+seconds. Reconnecting with the standard SSE Last-Event-ID picks up right
+after the last event the client saw.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import secrets
+import time
+from collections import OrderedDict, deque
+
+from dotenv import load_dotenv
+
+from utils import metrics
+from utils.autocomplete import note_artists, note_tracks
+from utils.cooccurrence import record, related_edges
+from utils.enrich import enrich_track
+from utils.log import get_logger
+from utils.make import make_track
+from utils.merge import pull_tracks
+from utils.normalize import get_all_recommended_artists
+from utils.providers import LINK_LOOKUP, SeedContext, provider_names, track_streams
+from utils.schemas import SpotifyArtistSearch, decode
+
+load_dotenv()
+
+log = get_logger("radio")
+
+LASTFM_API_KEY = os.getenv("LASTFM_API_KEY")
+SOUNDCLOUD_CLIENT_ID = os.getenv("SOUNDCLOUD_CLIENT_ID")
+
+RADIO_SESSIONS = int(os.getenv("RADIO_SESSIONS", "1000"))
+RADIO_SESSION_TTL = float(os.getenv("RADIO_SESSION_TTL", "1800"))
+# Fresh tracks taken from an artist per visit, and related artists queued behind it
+RADIO_TRACKS_PER_ARTIST = int(os.getenv("RADIO_TRACKS_PER_ARTIST", "3"))
+RADIO_BRANCHING = int(os.getenv("RADIO_BRANCHING", "5"))
+RADIO_MAX_FRONTIER = int(os.getenv("RADIO_MAX_FRONTIER", "200"))
+# Tracks remembered per seen-set generation; a track can come back after two generations
+RADIO_SEEN_CAPACITY = int(os.getenv("RADIO_SEEN_CAPACITY", "5000"))
+# Assumed length of a track whose duration no provider gave
+RADIO_DEFAULT_TRACK_SECONDS = float(os.getenv("RADIO_DEFAULT_TRACK_SECONDS", "180"))
+RADIO_KEEPALIVE = float(os.getenv("RADIO_KEEPALIVE", "15"))
+# Consecutive artists that may yield nothing new before the radio gives up
+RADIO_MAX_DRY_VISITS = int(os.getenv("RADIO_MAX_DRY_VISITS", "10"))
+
+metrics.describe("radio_sessions", "Radio sessions held for resumption")
+metrics.describe("radio_tracks_total", "Tracks sent by radio streams")
+metrics.describe("radio_artists_visited_total", "Artists expanded by radio producers")
+
+
+class BloomFilter:
+    """Fixed-size set membership with a bounded false-positive rate and no false negatives."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.size = bits
+        self.hashes = max(1, round(bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((bits + 7) // 8)
+
+    def _slots(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        return all(self._bits[s >> 3] & (1 << (s & 7)) for s in self._slots(key))
+
+    def add(self, key):
+        for s in self._slots(key):
+            self._bits[s >> 3] |= 1 << (s & 7)
+        self.count += 1
+
+
+class SeenSet:
+    """
+    Keys already played, in two Bloom filter generations of `capacity` keys
+    each. When the current one fills up, the older one is dropped, so
+    memory stays at a few KB however long the radio plays.
+    """
+
+    def __init__(self, capacity=RADIO_SEEN_CAPACITY):
+        self.capacity = capacity
+        self._current = BloomFilter(capacity)
+        self._previous = None
+
+    def __contains__(self, key):
+        return key in self._current or (self._previous is not None and key in self._previous)
+
+    def add(self, key):
+        """Add `key`; False if it was (probably) there already."""
+        if key in self:
+            return False
+        if self._current.count >= self.capacity:
+            self._previous, self._current = self._current, BloomFilter(self.capacity)
+        self._current.add(key)
+        return True
+
+
+def _norm(text):
+    return " ".join((text or "").lower().split())
+
+
+_SPOTIFY_ARTIST = re.compile(r"open\.spotify\.com/artist/([A-Za-z0-9]+)")
+
+
+class RadioSession:
+    def __init__(self, providers, artist_id, artist_name, seed_title):
+        self.id = secrets.token_urlsafe(9)
+        self.providers = providers
+        self.artist_name = artist_name
+        # (artist_id or None, name); ids of related artists are looked up when they are visited
+        self.frontier = deque([(artist_id, artist_name)])
+        self.artists = SeenSet(RADIO_SEEN_CAPACITY)
+        self.artists.add(_norm(artist_name))
+        self.tracks = SeenSet()
+        if seed_title:
+            self.tracks.add(f"{_norm(seed_title)}|{_norm(artist_name)}")
+        # enriched track dicts waiting to be sent
+        self.ready = deque()
+        # (event number, chunk) of the last events sent, for clients that resume
+        self.sent = deque(maxlen=32)
+        self.sequence = 0
+        self.exhausted = False
+        self.touched = time.monotonic()
+        # bumped by every new connection; an older connection sees it and leaves
+        self.generation = 0
+        self.producer = None
+        self.changed = asyncio.Event()
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def _artist_id(self, client, headers, name):
+        if "spotify" not in provider_names(self.providers):
+            return None
+        resp = await client.get("https://api.spotify.com/v1/search", headers=headers,
+                                params={"q": f'artist:"{name}"', "type": "artist", "limit": 1})
+        items = decode(resp, SpotifyArtistSearch).artists.items
+        return items[0].id if items else None
+
+    async def _visit(self, client, headers, token):
+        """Expand the next artist in the frontier; returns its fresh, enriched tracks."""
+        artist_id, name = self.frontier.popleft()
+        metrics.inc("radio_artists_visited_total")
+        if artist_id is None:
+            artist_id = await self._artist_id(client, headers, name)
+
+        ctx = SeedContext(client, headers, artist_id, name, limit=RADIO_TRACKS_PER_ARTIST * 3)
+        # visits have no seed track, and secondary sources would cost more than a few tracks are worth
+        candidates = await pull_tracks(
+            track_streams(self.providers, ctx, secondary=False), RADIO_TRACKS_PER_ARTIST * 3
+        )
+        note_tracks((t.title, t.artist) for t in candidates)
+        fresh = []
+        for t in candidates:
+            if len(fresh) >= RADIO_TRACKS_PER_ARTIST:
+                break
+            if self.tracks.add(f"{_norm(t.title)}|{_norm(t.artist)}"):
+                fresh.append(t)
+
+        related = await get_all_recommended_artists(
+            name, artist_id, client, headers, LASTFM_API_KEY, SOUNDCLOUD_CLIENT_ID, self.providers
+        )
+        names = [a["name"] for a in related if a["source"] != "Local"]
+        await record(related_edges(name, names))
+        note_artists(names)
+        for artist in related[:RADIO_BRANCHING]:
+            if len(self.frontier) >= RADIO_MAX_FRONTIER:
+                break
+            if self.artists.add(_norm(artist["name"])):
+                match = _SPOTIFY_ARTIST.search(artist["links"].get("spotify") or "")
+                self.frontier.append((match.group(1) if match else None, artist["name"]))
+
+        link_sources = provider_names(self.providers, LINK_LOOKUP)
+        enriched = []
+        for t in fresh:
+            try:
+                t = await enrich_track(t, token, sources=link_sources)
+            except Exception as e:
+                log.sampled("Enrichment failed", title=t.title, error=repr(e))
+            enriched.append(make_track(t))
+        return enriched
+
+    async def fill(self, client, headers, token, ahead):
+        """Keep `ahead` tracks ready, waiting while there are enough; runs until cancelled or exhausted."""
+        dry = 0
+        while True:
+            while len(self.ready) >= ahead:
+                await self.changed.wait()
+            if not self.frontier or dry >= RADIO_MAX_DRY_VISITS:
+                self.exhausted = True
+                self._notify()
+                return
+            try:
+                tracks = await self._visit(client, headers, token)
+            except Exception as e:
+                log.warning("Artist visit failed", error=repr(e))
+                tracks = []
+            dry = 0 if tracks else dry + 1
+            self.ready.extend(tracks)
+            self._notify()
+
+    def take(self):
+        track = self.ready.popleft()
+        self._notify()
+        return track
+
+    def event(self, payload):
+        self.sequence += 1
+        chunk = f"id: {self.id}:{self.sequence}\ndata: {json.dumps(payload)}\n\n"
+        self.sent.append((self.sequence, chunk))
+        return chunk
+
+    def replay(self, after):
+        """Chunks already sent after event number `after`, which the client may have missed."""
+        return [chunk for n, chunk in self.sent if n > after]
+
+
+class SessionStore:
+    """The last RADIO_SESSIONS sessions, each dropped RADIO_SESSION_TTL seconds after its last use."""
+
+    def __init__(self, capacity=RADIO_SESSIONS, ttl=RADIO_SESSION_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            sid, session = next(iter(self._sessions.items()))
+            if session.touched >= cutoff and len(self._sessions) <= self.capacity:
+                break
+            del self._sessions[sid]
+            if session.producer is not None:
+                session.producer.cancel()
+        metrics.set_gauge("radio_sessions", len(self._sessions))
+
+    def get(self, sid):
+        self._expire()
+        session = self._sessions.get(sid)
+        if session is not None:
+            self.touch(session)
+        return session
+
+    def touch(self, session):
+        session.touched = time.monotonic()
+        if session.id in self._sessions:
+            self._sessions.move_to_end(session.id)
+
+    def add(self, session):
+        self._sessions[session.id] = session
+        self._expire()
+
+
+sessions = SessionStore()
+
+
+def parse_event_id(value):
+    """(session id, event number) from a Last-Event-ID header, or (None, None)."""
+    sid, _, n = (value or "").rpartition(":")
+    return (sid, int(n)) if sid and n.isdigit() else (None, None)
+
+
+async def _wait(session, seconds):
+    """Until the session changes or `seconds` pass, whichever is first."""
+    if seconds <= 0:
+        return
+    try:
+        await asyncio.wait_for(session.changed.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def play(session, client, headers, token, ahead, resume_after=None):
+    """SSE chunks for one connection to `session`."""
+    session.generation += 1
+    generation = session.generation
+    if session.producer is not None:
+        session.producer.cancel()
+    # wakes the connection this one replaces, so it leaves now
+    session._notify()
+    session.producer = asyncio.create_task(session.fill(client, headers, token, ahead))
+    try:
+        if resume_after is None:
+            yield session.event({"radio": {"session": session.id, "artist": session.artist_name}})
+        else:
+            for chunk in session.replay(resume_after):
+                if session.generation != generation:
+                    return
+                yield chunk
+        written = time.monotonic()
+
+        # when each sent track will have finished, assuming the client plays straight through
+        ends = deque()
+        while session.generation == generation:
+            now = time.monotonic()
+            while ends and ends[0] <= now:
+                ends.popleft()
+            if len(ends) < ahead:
+                if session.ready:
+                    track = session.take()
+                    seconds = (track.get("duration_ms") or 0) / 1000 or RADIO_DEFAULT_TRACK_SECONDS
+                    ends.append(max(ends[-1] if ends else now, now) + seconds)
+                    sessions.touch(session)
+                    metrics.inc("radio_tracks_total")
+                    yield session.event({"track": track})
+                    written = time.monotonic()
+                    continue
+                if session.exhausted:
+                    yield session.event({"end": "exhausted"})
+                    yield "data: [DONE]\n\n"
+                    return
+            if now - written >= RADIO_KEEPALIVE:
+                yield ": keepalive\n\n"
+                written = now
+                continue
+            wake = written + RADIO_KEEPALIVE
+            if len(ends) >= ahead:
+                wake = min(wake, ends[0])
+            await _wait(session, wake - now)
+    finally:
+        if session.generation == generation and session.producer is not None:
+            # paused or gone: no more upstream work until the client comes back
+            session.producer.cancel()
+            session.producer = None
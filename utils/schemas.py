@@ -0,0 +1,287 @@
+"""
+Typed projections of the provider payloads we read.
+
+Each struct lists only the fields the code uses, so decoding skips
+everything else in the body. Fields the code indexes directly are
+required: if a provider drops or retypes one, decoding raises
+SchemaError instead of failing later with a KeyError. The top-level
+envelope of every response is required too, and non-2xx responses and
+bodies carrying an `error` raise UpstreamError, so a throttled or
+rejected call never reads as "no results".
+"""
+import msgspec
+from msgspec import Struct, field
+
+
+class SchemaError(ValueError):
+    pass
+
+
+class UpstreamError(RuntimeError):
+    """A provider answered with an error status or an error body."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _ErrorBody(Struct, frozen=True):
+    error: object = None
+
+
+_decoders = {}
+_error_decoder = msgspec.json.Decoder(_ErrorBody)
+
+
+def decode(response, schema):
+    """Decode an httpx response body once, straight into `schema`."""
+    if not response.is_success:
+        raise UpstreamError(f"{schema.__name__} from {response.url}: status {response.status_code}",
+                            response.status_code)
+    decoder = _decoders.get(schema)
+    if decoder is None:
+        decoder = _decoders[schema] = msgspec.json.Decoder(schema)
+    try:
+        return decoder.decode(response.content)
+    except msgspec.ValidationError as e:
+        # Deezer reports quota and lookup errors as 200s with an `error` body instead of `data`
+        try:
+            error = _error_decoder.decode(response.content).error
+        except msgspec.MsgspecError:
+            error = None
+        if error is not None:
+            raise UpstreamError(f"{schema.__name__} from {response.url}: {error}", response.status_code) from e
+        raise SchemaError(f"{schema.__name__} from {response.url}: {e}") from e
+    except msgspec.DecodeError as e:
+        raise SchemaError(f"{schema.__name__} from {response.url}: invalid JSON ({e})") from e
+
+
+# --- Spotify ---
+
+class SpotifyImage(Struct, frozen=True):
+    url: str
+
+
+class SpotifyExternalUrls(Struct, frozen=True):
+    spotify: str | None = None
+
+
+class SpotifyArtistRef(Struct, frozen=True):
+    name: str
+    id: str | None = None
+    external_urls: SpotifyExternalUrls = SpotifyExternalUrls()
+
+
+class SpotifyAlbum(Struct, frozen=True):
+    images: list[SpotifyImage] = []
+
+
+class SpotifyTrack(Struct, frozen=True):
+    name: str
+    artists: list[SpotifyArtistRef]
+    external_urls: SpotifyExternalUrls
+    album: SpotifyAlbum = SpotifyAlbum()
+    duration_ms: int = 0
+    preview_url: str | None = None
+    id: str | None = None
+
+
+class SpotifyArtist(Struct, frozen=True):
+    id: str
+    name: str
+    external_urls: SpotifyExternalUrls = SpotifyExternalUrls()
+    images: list[SpotifyImage] = []
+    genres: list[str] = []
+
+
+class SpotifyTrackPage(Struct, frozen=True):
+    items: list[SpotifyTrack] = []
+
+
+class SpotifyArtistPage(Struct, frozen=True):
+    items: list[SpotifyArtist] = []
+
+
+class SpotifyTrackSearch(Struct, frozen=True):
+    tracks: SpotifyTrackPage
+
+
+class SpotifyArtistSearch(Struct, frozen=True):
+    artists: SpotifyArtistPage
+
+
+class SpotifyArtistInfo(Struct, frozen=True):
+    external_urls: SpotifyExternalUrls = SpotifyExternalUrls()
+    images: list[SpotifyImage] = []
+    genres: list[str] = []
+
+
+class SpotifyTopTracks(Struct, frozen=True):
+    tracks: list[SpotifyTrack]
+
+
+class SpotifyRelatedArtists(Struct, frozen=True):
+    artists: list[SpotifyArtist]
+
+
+# --- Deezer ---
+
+class DeezerArtistRef(Struct, frozen=True):
+    name: str
+
+
+class DeezerAlbum(Struct, frozen=True):
+    cover_big: str | None = None
+    cover_medium: str | None = None
+
+
+class DeezerTrack(Struct, frozen=True):
+    title: str
+    artist: DeezerArtistRef
+    link: str
+    album: DeezerAlbum = DeezerAlbum()
+    duration: int = 0
+    preview: str | None = None
+
+
+class DeezerArtist(Struct, frozen=True):
+    id: int
+    name: str
+    link: str | None = None
+    picture: str | None = None
+    picture_medium: str | None = None
+    picture_xl: str | None = None
+
+
+class DeezerTrackList(Struct, frozen=True):
+    data: list[DeezerTrack]
+
+
+class DeezerArtistList(Struct, frozen=True):
+    data: list[DeezerArtist]
+
+
+class DeezerLink(Struct, frozen=True):
+    link: str | None = None
+
+
+class DeezerLinkList(Struct, frozen=True):
+    data: list[DeezerLink]
+
+
+# --- Last.fm ---
+
+class LastfmImage(Struct, frozen=True):
+    text: str = field(name="#text", default="")
+
+
+class LastfmArtistRef(Struct, frozen=True):
+    name: str
+
+
+class LastfmSimilarArtist(Struct, frozen=True):
+    name: str
+    url: str | None = None
+    image: list[LastfmImage] = []
+
+
+class LastfmSimilarArtistList(Struct, frozen=True):
+    artist: list[LastfmSimilarArtist] = []
+
+
+class LastfmSimilarArtists(Struct, frozen=True):
+    similarartists: LastfmSimilarArtistList
+
+
+class LastfmTopTrack(Struct, frozen=True):
+    name: str
+    # Last.fm sends durations as strings
+    duration: str | int | None = None
+    url: str | None = None
+    image: list[LastfmImage] = []
+
+
+class LastfmTopTrackList(Struct, frozen=True):
+    track: list[LastfmTopTrack] = []
+
+
+class LastfmTopTracks(Struct, frozen=True):
+    toptracks: LastfmTopTrackList
+
+
+class LastfmSimilarTrack(Struct, frozen=True):
+    name: str
+    artist: LastfmArtistRef
+    image: list[LastfmImage] = []
+
+
+class LastfmSimilarTrackList(Struct, frozen=True):
+    track: list[LastfmSimilarTrack] = []
+
+
+class LastfmSimilarTracks(Struct, frozen=True):
+    similartracks: LastfmSimilarTrackList
+
+
+class LastfmTag(Struct, frozen=True):
+    name: str
+
+
+class LastfmTagList(Struct, frozen=True):
+    tag: list[LastfmTag] = []
+
+
+class LastfmArtistInfoBody(Struct, frozen=True):
+    url: str | None = None
+    tags: LastfmTagList = LastfmTagList()
+
+
+class LastfmArtistInfo(Struct, frozen=True):
+    artist: LastfmArtistInfoBody
+
+
+# --- SoundCloud ---
+
+class SoundcloudUserRef(Struct, frozen=True):
+    username: str
+
+
+class SoundcloudTrack(Struct, frozen=True):
+    title: str
+    duration: int = 0
+    artwork_url: str | None = None
+    permalink_url: str | None = None
+    user: SoundcloudUserRef | None = None
+
+
+class SoundcloudUser(Struct, frozen=True):
+    id: int
+    username: str | None = None
+    kind: str | None = None
+    permalink: str | None = None
+    permalink_url: str | None = None
+    avatar_url: str | None = None
+
+
+class SoundcloudTrackList(Struct, frozen=True):
+    collection: list[SoundcloudTrack]
+
+
+class SoundcloudUserList(Struct, frozen=True):
+    collection: list[SoundcloudUser]
+
+
+# --- Discogs ---
+
+class DiscogsRelease(Struct, frozen=True):
+    genre: list[str] = []
+    style: list[str] = []
+    label: list[str] = []
+    format: list[str] = []
+    year: str | None = None
+    released: str | None = None
+    cover_image: str | None = None
+
+
+class DiscogsSearch(Struct, frozen=True):
+    results: list[DiscogsRelease]
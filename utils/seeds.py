@@ -0,0 +1,247 @@
+"""
+Seed resolution: "Title - Artist" -> (Spotify artist id, artist name).
+
+Answers are stored in a SQLite table next to the response cache under every
+alias of the query ("The X" / "X", with and without feat. credits), so
+spelling variants of a seed share one lookup. Misses are remembered too, for
+a shorter time. On a cold seed the loose and strict Spotify searches and a
+Deezer search run at once, and the first good answer wins.
+"""
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from utils import metrics
+from utils.cache import CACHE_DIR, CACHE_DISABLED, MISS, MemoryCache
+from utils.deezer import search_deezer_seed
+from utils.log import get_logger
+from utils.spotify import search_spotify_seed
+
+load_dotenv()
+
+log = get_logger("seeds")
+
+SEED_TTL = int(os.getenv("SEED_TTL", str(30 * 86400)))
+SEED_MISS_TTL = int(os.getenv("SEED_MISS_TTL", "86400"))
+
+metrics.describe("seed_lookups_total", "Seed resolutions by outcome")
+
+
+class SeedNotFound(ValueError):
+    pass
+
+
+_FEAT_PAREN = re.compile(r"[(\[]\s*(?:feat\.?|ft\.?|featuring|with)\s[^)\]]*[)\]]", re.I)
+_FEAT_TAIL = re.compile(r"\s(?:feat\.?|ft\.?|featuring)\s.*$", re.I)
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def _clean(text):
+    # names made only of punctuation ("!!!") are kept as they are
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text.lower())).strip() or text.lower().strip()
+
+
+def _strip_feat(text):
+    return _FEAT_TAIL.sub("", _FEAT_PAREN.sub("", text))
+
+
+def _unique(values):
+    return list(dict.fromkeys(v for v in values if v))
+
+
+def _artist_variants(artist):
+    names = [_clean(artist), _clean(_strip_feat(artist).split(",")[0])]
+    return _unique(v for name in names for v in (name, name[4:] if name.startswith("the ") else name))
+
+
+def seed_aliases(title, artist=None):
+    """Normalized lookup keys for a seed; the first one is the exact query."""
+    titles = _unique([_clean(title), _clean(_strip_feat(title))])
+    artists = _artist_variants(artist) if artist else [""]
+    return _unique(f"{t}|{a}" for t in titles for a in artists)
+
+
+def _same_artist(found, wanted):
+    found, wanted = _artist_variants(found)[-1], _artist_variants(wanted)[-1]
+    return found == wanted or wanted in found or found in wanted
+
+
+class SeedStore:
+    """
+    alias -> artist table in SQLite (WAL mode), shared by every worker on the
+    host. A row without an artist name is a remembered miss.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS aliases ("
+            " alias TEXT PRIMARY KEY,"
+            " artist_id TEXT,"
+            " artist_name TEXT,"
+            " expires REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, aliases):
+        """{alias: (artist_id, artist_name, expires)} for the unexpired rows among `aliases`."""
+        rows = self._conn().execute(
+            f"SELECT alias, artist_id, artist_name, expires FROM aliases WHERE alias IN ({','.join('?' * len(aliases))})",
+            aliases,
+        ).fetchall()
+        now = time.time()
+        return {alias: (artist_id, name, expires) for alias, artist_id, name, expires in rows if expires >= now}
+
+    def set(self, aliases, artist_id, artist_name, expires):
+        self._conn().executemany(
+            "INSERT OR REPLACE INTO aliases (alias, artist_id, artist_name, expires) VALUES (?, ?, ?, ?)",
+            [(alias, artist_id, artist_name, expires) for alias in aliases],
+        )
+
+
+def _open_store():
+    if CACHE_DISABLED:
+        return None
+    try:
+        return SeedStore(os.path.join(CACHE_DIR, "seeds.sqlite3"))
+    except Exception as e:
+        log.warning("Store unavailable, remembering seeds in memory only", error=repr(e))
+        return None
+
+
+_memory = MemoryCache()
+_store = _open_store()
+
+
+async def _lookup(aliases):
+    """(artist_id, artist_name) for the first alias with an answer, (None, None) for a known miss, or MISS."""
+    found = {}
+    for alias in aliases:
+        entry = _memory.get(alias)
+        if entry is not MISS:
+            found[alias] = entry
+    if not found and _store is not None:
+        try:
+            rows = await asyncio.to_thread(_store.get, aliases)
+        except Exception as e:
+            log.warning("Read failed", error=repr(e))
+            rows = {}
+        for alias, (artist_id, name, expires) in rows.items():
+            found[alias] = (artist_id, name)
+            _memory.set(alias, (artist_id, name), expires)
+    for alias in aliases:
+        if found.get(alias, (None, None))[1]:
+            return found[alias]
+    # misses are only ever stored under the exact query
+    return found.get(aliases[0], MISS)
+
+
+async def _remember(aliases, artist_id, artist_name, ttl):
+    expires = time.time() + ttl
+    for alias in aliases:
+        _memory.set(alias, (artist_id, artist_name), expires)
+    if _store is not None:
+        try:
+            await asyncio.to_thread(_store.set, aliases, artist_id, artist_name, expires)
+        except Exception as e:
+            log.warning("Write failed", error=repr(e))
+
+
+async def _search(client, headers, track_title, track_artist):
+    """
+    Race the lookups. A strict Spotify hit, or a loose one by the requested
+    artist, wins at once; otherwise the loose hit is taken once Spotify is
+    done, and Deezer's answer only if Spotify found nothing. Returns None
+    only when every lookup answered and none matched; if any of them failed
+    and nothing matched, re-raises the first failure so the miss isn't
+    remembered.
+    """
+    loose_q = f"{track_title} {track_artist}" if track_artist else track_title
+    lookups = {asyncio.ensure_future(search_spotify_seed(client, headers, loose_q)): "loose"}
+    if track_artist:
+        strict_q = f'track:"{track_title}" artist:"{track_artist}"'
+        lookups[asyncio.ensure_future(search_spotify_seed(client, headers, strict_q))] = "strict"
+        lookups[asyncio.ensure_future(search_deezer_seed(client, track_title, track_artist))] = "deezer"
+
+    fallback = {}
+    errors = []
+    pending = set(lookups)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                kind = lookups[task]
+                try:
+                    answer = task.result()
+                except Exception as e:
+                    log.warning("Lookup failed", kind=kind, error=repr(e))
+                    errors.append(e)
+                    continue
+                if not answer:
+                    continue
+                if kind == "strict" or (kind == "loose" and (not track_artist or _same_artist(answer[1], track_artist))):
+                    return answer
+                fallback[kind] = answer
+            if "loose" in fallback and all(lookups[t] == "deezer" for t in pending):
+                return fallback["loose"]
+        if "deezer" in fallback:
+            return fallback["deezer"]
+        if errors:
+            # a failed lookup might have matched; don't let it pass for a miss
+            raise errors[0]
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def resolve_seed(client, headers, track_title, track_artist=None):
+    """
+    (artist_id, artist_name) for a seed track. artist_id is None when only
+    Deezer knew the track. Raises SeedNotFound when nobody does, and a
+    failed lookup's own error when it might have.
+    """
+    aliases = seed_aliases(track_title, track_artist)
+    if not CACHE_DISABLED:
+        hit = await _lookup(aliases)
+        if hit is not MISS:
+            if hit[1] is None:
+                metrics.inc("seed_lookups_total", outcome="cached_miss")
+                raise SeedNotFound(f"No track found for {track_title!r}")
+            metrics.inc("seed_lookups_total", outcome="hit")
+            return hit
+
+    try:
+        answer = await _search(client, headers, track_title, track_artist)
+    except Exception:
+        metrics.inc("seed_lookups_total", outcome="error")
+        raise
+    if answer is None:
+        metrics.inc("seed_lookups_total", outcome="not_found")
+        if not CACHE_DISABLED:
+            await _remember(aliases[:1], None, None, SEED_MISS_TTL)
+        raise SeedNotFound(f"No track found for {track_title!r}")
+
+    metrics.inc("seed_lookups_total", outcome="resolved")
+    artist_id, artist_name = answer
+    if not CACHE_DISABLED:
+        # also file it under the artist's canonical name; Deezer-only answers are retried sooner
+        aliases = _unique(aliases + seed_aliases(track_title, artist_name))
+        await _remember(aliases, artist_id, artist_name, SEED_TTL if artist_id else SEED_MISS_TTL)
+    return artist_id, artist_name
@@ -0,0 +1,111 @@
+import asyncio
+import json
+
+from utils import metrics
+from utils.log import get_logger
+
+log = get_logger("singleflight")
+
+DONE = "data: [DONE]\n\n"
+
+metrics.describe("singleflight_cancelled_total", "Shared computations cancelled after their last subscriber left")
+
+
+class Broadcast:
+    """
+    Replayable event buffer fed by a single producer task.
+
+    Every subscriber starts from the first event, so late joiners still see
+    everything emitted before they arrived. When the last subscriber goes
+    away before the producer finishes, the producer is cancelled. Events
+    are SSE chunks: a producer that fails or is cancelled gets an error
+    event and [DONE] appended, so no subscriber sees a truncated stream.
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self.events = []
+        self.done = False
+        self.task = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def run(self, source):
+        try:
+            async for event in source:
+                self.events.append(event)
+                self._notify()
+        except asyncio.CancelledError:
+            # only subscribers that arrive while the cancellation lands can see this
+            self._fail("Request cancelled")
+            raise
+        except Exception as e:
+            log.warning("Shared computation failed", key=self.key, error=repr(e))
+            self._fail("Recommendation failed")
+        finally:
+            self.done = True
+            self._notify()
+
+    def _fail(self, message):
+        if self.events and self.events[-1] == DONE:
+            return
+        self.events.append("data: " + json.dumps({"error": message}) + "\n\n")
+        self.events.append(DONE)
+
+    def subscribe(self):
+        return self._follow()
+
+    async def _follow(self):
+        # counted from the first read, so a subscriber that is never iterated
+        # can't keep the producer alive; until someone reads, it just runs
+        self.subscribers += 1
+        i = 0
+        try:
+            while True:
+                while i < len(self.events):
+                    yield self.events[i]
+                    i += 1
+                if self.done:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                self.cancel()
+
+    def cancel(self):
+        # new requests for the same key start a fresh computation
+        _forget(self.key, self)
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            metrics.inc("singleflight_cancelled_total")
+
+
+_inflight = {}
+
+
+def _forget(key, broadcast):
+    if _inflight.get(key) is broadcast:
+        del _inflight[key]
+
+
+def coalesce(key, make_source):
+    """
+    Subscribe to the in-flight stream for `key`, starting it with
+    `make_source()` if nobody is computing it yet.
+    """
+    broadcast = _inflight.get(key)
+    if broadcast is None:
+        broadcast = Broadcast(key)
+        _inflight[key] = broadcast
+        broadcast.task = asyncio.create_task(broadcast.run(make_source()))
+        broadcast.task.add_done_callback(lambda _: _forget(key, broadcast))
+    return broadcast.subscribe()
+
+
+def normalize_query(text):
+    return " ".join((text or "").lower().split())
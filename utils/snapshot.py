@@ -0,0 +1,122 @@
+"""
+Read-only snapshot of precomputed by-track results.
+
+Layout (little-endian):
+
+    header  b"MSSNAP01" | u32 count | u32 params_len | params (JSON)
+    index   count x (u64 seed_hash, u64 offset, u32 length), sorted by hash
+    data    zlib-compressed JSON records: {"seed": ..., "events": [...]}
+
+The file is memory-mapped and looked up with a binary search over the
+index, so loading it costs nothing up front and every worker shares the
+same pages.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from utils.log import get_logger
+from utils.singleflight import normalize_query
+
+log = get_logger("snapshot")
+
+MAGIC = b"MSSNAP01"
+_HEADER = struct.Struct("<8sII")
+_ENTRY = struct.Struct("<QQI")
+
+
+def seed_hash(seed):
+    digest = hashlib.blake2b(normalize_query(seed).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def write_snapshot(path, params, records):
+    """
+    Write `records` ({seed: [event, ...]}) computed with `params` to `path`.
+    Replaces the file atomically so running workers keep their old mapping.
+    """
+    params_blob = json.dumps(params, sort_keys=True).encode("utf-8")
+    blobs = []
+    for seed, events in records.items():
+        seed = normalize_query(seed)
+        body = json.dumps({"seed": seed, "events": events}, ensure_ascii=False, separators=(",", ":"))
+        blobs.append((seed_hash(seed), zlib.compress(body.encode("utf-8"), 6)))
+    blobs.sort(key=lambda b: b[0])
+
+    data_start = _HEADER.size + len(params_blob) + _ENTRY.size * len(blobs)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(blobs), len(params_blob)))
+        f.write(params_blob)
+        offset = data_start
+        for h, blob in blobs:
+            f.write(_ENTRY.pack(h, offset, len(blob)))
+            offset += len(blob)
+        for _, blob in blobs:
+            f.write(blob)
+    os.replace(tmp, path)
+    return len(blobs)
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, params_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not a recommendations snapshot")
+        params_start = _HEADER.size
+        self.params = json.loads(self._mm[params_start:params_start + params_len])
+        self._index_start = params_start + params_len
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, i):
+        return _ENTRY.unpack_from(self._mm, self._index_start + i * _ENTRY.size)
+
+    def get(self, seed):
+        """Events stored for `seed`, or None."""
+        seed = normalize_query(seed)
+        target = seed_hash(seed)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        # walk past any hash collisions
+        while lo < self.count:
+            h, offset, length = self._entry(lo)
+            if h != target:
+                return None
+            record = json.loads(zlib.decompress(self._mm[offset:offset + length]))
+            if record["seed"] == seed:
+                return record["events"]
+            lo += 1
+        return None
+
+    def matches(self, **params):
+        """True if a request with `params` would get exactly what was precomputed."""
+        return all(self.params.get(k) == v for k, v in params.items())
+
+    def close(self):
+        self._mm.close()
+
+
+def open_snapshot(path):
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        snapshot = Snapshot(path)
+    except Exception as e:
+        log.warning("Could not load snapshot", path=path, error=repr(e))
+        return None
+    log.info("Loaded snapshot", path=path, seeds=len(snapshot))
+    return snapshot
@@ -1,144 +1,137 @@
-async def fetch_soundcloud_recommended_artists(client, artist_name, client_id):
-    try:
-        response = await client.get(
-            "https://api-v2.soundcloud.com/search/users",
-            params={"q": artist_name, "client_id": client_id, "limit": 1}
-        )
-        if response.status_code != 200:
-            print(f"[SoundCloud ERROR {response.status_code}]:", response.text)
-            return []
-
-        data = response.json()
-        if not data or "collection" not in data or not data["collection"]:
-            print("[SoundCloud] No artist found")
-            return []
-
-        user_id = data["collection"][0]["id"]
-
-        related = await client.get(
-            f"https://api-v2.soundcloud.com/users/{user_id}/related",
-            params={"client_id": client_id, "limit": 10}
-        )
-
-        if related.status_code != 200:
-            print(f"[SoundCloud Related ERROR {related.status_code}]:", related.text)
-            return []
-
-        try:
-            related_data = related.json()
-        except Exception as e:
-            print("[SoundCloud JSON ERROR]:", e, related.text)
-            return []
-
-        return related_data.get("collection", [])
-
-    except Exception as e:
-        print("[SoundCloud Fetch ERROR]:", e)
+from utils.cache import cached
+from utils.log import get_logger
+from utils.schemas import SoundcloudTrackList, SoundcloudUserList, decode
+from utils.track import SOUNDCLOUD, Track, pack_tracks, unpack_tracks
+
+log = get_logger("soundcloud")
+
+
+@cached("soundcloud_related_artists")
+async def fetch_soundcloud_recommended_artists(client, artist_name, client_id, limit=10):
+    # errors propagate (decode raises on non-2xx) so a failed lookup isn't cached as "no related artists"
+    response = await client.get(
+        "https://api-v2.soundcloud.com/search/users",
+        params={"q": artist_name, "client_id": client_id, "limit": 1}
+    )
+    users = decode(response, SoundcloudUserList).collection
+    if not users:
+        log.info("No artist found", artist=artist_name)
         return []
 
-async def get_soundcloud_recommendations(track_title, artist_name, client, soundcloud_client_id, offset=0, limit=10):
-    soundcloud_tracks = []
+    user_id = users[0].id
+
+    related = await client.get(
+        f"https://api-v2.soundcloud.com/users/{user_id}/related",
+        params={"client_id": client_id, "limit": limit}
+    )
+    related_users = decode(related, SoundcloudUserList).collection
+
+    return [
+        {
+            "name": u.username,
+            "image_url": u.avatar_url,
+            "genres": [],
+            "links": {
+                "soundcloud": u.permalink_url
+            },
+            "source": "SoundCloud"
+        }
+        for u in related_users
+        if u.username
+    ]
+
+def _to_track(t, artist_name):
+    return Track(
+        t.title,
+        artist_name,
+        duration_ms=t.duration,
+        cover_url=t.artwork_url,
+        preview_url=t.permalink_url,
+        soundcloud_url=t.permalink_url,
+        sources=SOUNDCLOUD,
+    )
+
+
+@cached("soundcloud_track_search", encode=pack_tracks, decode=unpack_tracks)
+async def _soundcloud_search_tracks(client, query, soundcloud_client_id, limit):
+    resp = await client.get(
+        "https://api-v2.soundcloud.com/search/tracks",
+        params={"q": query, "client_id": soundcloud_client_id, "limit": limit}
+    )
+    return [_to_track(t, t.user.username) for t in decode(resp, SoundcloudTrackList).collection if t.user]
+
+
+@cached("soundcloud_user_id")
+async def _soundcloud_user_id(client, artist_name, soundcloud_client_id):
+    resp = await client.get(
+        "https://api-v2.soundcloud.com/search/users",
+        params={"q": artist_name, "client_id": soundcloud_client_id, "limit": 1}
+    )
+    users = decode(resp, SoundcloudUserList).collection
+    return users[0].id if users else None
+
+
+@cached("soundcloud_user_tracks", encode=pack_tracks, decode=unpack_tracks)
+async def _soundcloud_user_tracks(client, user_id, artist_name, soundcloud_client_id, limit):
+    resp = await client.get(
+        f"https://api-v2.soundcloud.com/users/{user_id}/tracks",
+        params={"client_id": soundcloud_client_id, "limit": limit}
+    )
+    return [_to_track(t, artist_name) for t in decode(resp, SoundcloudTrackList).collection]
+
+
+@cached("soundcloud_recommended_users")
+async def _soundcloud_recommended_users(client, user_id, soundcloud_client_id):
+    resp = await client.get(
+        f"https://api-v2.soundcloud.com/users/{user_id}/recommendations",
+        params={"client_id": soundcloud_client_id, "limit": 5}
+    )
+    return [(u.id, u.username) for u in decode(resp, SoundcloudUserList).collection if u.kind == "user" and u.username]
+
+
+async def iter_soundcloud_tracks(track_title, artist_name, client, soundcloud_client_id, limit=10, own=True):
+    """
+    Search matches for the seed track (if there is one), then the artist's
+    own tracks (unless `own` is False), then two from each recommended
+    artist. `limit` sizes the search pages.
+    """
     seen = set()
 
+    def fresh(track):
+        if track.key in seen:
+            return False
+        seen.add(track.key)
+        return True
+
     # Step 1: Search for the given track
-    try:
-        query = f"{track_title} {artist_name}" if artist_name else track_title
-        sc_track_search = await client.get(
-            "https://api-v2.soundcloud.com/search/tracks",
-            params={
-                "q": query,
-                "client_id": soundcloud_client_id,
-                "limit": limit,
-                "offset": offset
-            }
-        )
-        for t in sc_track_search.json().get("collection", []):
-            key = (t["title"].strip().lower(), t["user"]["username"].strip().lower())
-            if key not in seen:
-                seen.add(key)
-                soundcloud_tracks.append({
-                    "title": t["title"],
-                    "artist": t["user"]["username"],
-                    "duration_ms": t["duration"],
-                    "cover": t.get("artwork_url"),
-                    "preview_url": t.get("permalink_url"),
-                    "spotify_url": None,
-                    "deezer_url": None,
-                    "soundcloud_url": t.get("permalink_url"),
-                    "source": ["SoundCloud"]
-                })
-    except Exception as e:
-        print("[SoundCloud Search Error]:", e)
+    if track_title:
+        try:
+            query = f"{track_title} {artist_name}" if artist_name else track_title
+            for track in await _soundcloud_search_tracks(client, query, soundcloud_client_id, limit):
+                if fresh(track):
+                    yield track
+        except Exception as e:
+            log.warning("Track search failed", error=repr(e))
 
     # Step 2: Artist tracks + related artists
+    if not artist_name:
+        return
     try:
-        if not artist_name:
-            return soundcloud_tracks
-
-        # Find artist ID
-        artist_search = await client.get(
-            "https://api-v2.soundcloud.com/search/users",
-            params={"q": artist_name, "client_id": soundcloud_client_id, "limit": 1}
-        )
-        artist_result = artist_search.json().get("collection", [])
-        if not artist_result:
-            return soundcloud_tracks
-
-        artist_id = artist_result[0]["id"]
-
-        # Artist top tracks
-        artist_tracks_resp = await client.get(
-            f"https://api-v2.soundcloud.com/users/{artist_id}/tracks",
-            params={"client_id": soundcloud_client_id, "limit": limit, "offset": offset}
-        )
-        for t in artist_tracks_resp.json().get("collection", []):
-            key = (t["title"].strip().lower(), artist_name.lower())
-            if key not in seen:
-                seen.add(key)
-                soundcloud_tracks.append({
-                    "title": t["title"],
-                    "artist": artist_name,
-                    "duration_ms": t["duration"],
-                    "cover": t.get("artwork_url"),
-                    "preview_url": t.get("permalink_url"),
-                    "spotify_url": None,
-                    "deezer_url": None,
-                    "soundcloud_url": t.get("permalink_url"),
-                    "source": ["SoundCloud"]
-                })
-
-        # Related artists' tracks
-        rel_artists = await client.get(
-            f"https://api-v2.soundcloud.com/users/{artist_id}/recommendations",
-            params={"client_id": soundcloud_client_id, "limit": 5}
-        )
-        for rel in rel_artists.json().get("collection", []):
-            if rel.get("kind") != "user":
-                continue
-            rel_tracks_resp = await client.get(
-                f"https://api-v2.soundcloud.com/users/{rel['id']}/tracks",
-                params={"client_id": soundcloud_client_id, "limit": 2, "offset": offset}
-            )
-            for t in rel_tracks_resp.json().get("collection", []):
-                key = (t["title"].strip().lower(), rel["username"].strip().lower())
-                if key not in seen:
-                    seen.add(key)
-                    soundcloud_tracks.append({
-                        "title": t["title"],
-                        "artist": rel["username"],
-                        "duration_ms": t["duration"],
-                        "cover": t.get("artwork_url"),
-                        "preview_url": t.get("permalink_url"),
-                        "spotify_url": None,
-                        "deezer_url": None,
-                        "soundcloud_url": t.get("permalink_url"),
-                        "source": ["SoundCloud"]
-                    })
-
+        artist_id = await _soundcloud_user_id(client, artist_name, soundcloud_client_id)
+        if not artist_id:
+            return
+
+        if own:
+            for track in await _soundcloud_user_tracks(client, artist_id, artist_name, soundcloud_client_id, limit):
+                if fresh(track):
+                    yield track
+
+        for rel_id, rel_name in await _soundcloud_recommended_users(client, artist_id, soundcloud_client_id):
+            for track in await _soundcloud_user_tracks(client, rel_id, rel_name, soundcloud_client_id, 2):
+                if fresh(track):
+                    yield track
     except Exception as e:
-        print("[SoundCloud Artist/Related Error]:", e)
-
-    return soundcloud_tracks
+        log.warning("Artist/related tracks failed", error=repr(e))
 
 
 
@@ -1,54 +1,59 @@
 from urllib.parse import quote
 
-async def fetch_spotify_recommended_artists(client, headers, artist_id):
+from utils.cache import cached
+from utils.schemas import (
+    SpotifyArtistInfo,
+    SpotifyRelatedArtists,
+    SpotifyTopTracks,
+    SpotifyTrackSearch,
+    decode,
+)
+from utils.track import SPOTIFY, Track, pack_tracks, unpack_tracks
+
+@cached("spotify_related_artists")
+async def fetch_spotify_recommended_artists(client, headers, artist_id, limit=10):
     rec_artists = []
     url = f"https://api.spotify.com/v1/artists/{artist_id}/related-artists"
     resp = await client.get(url, headers=headers)
 
-    for artist in resp.json().get("artists", [])[:10]:
+    for artist in decode(resp, SpotifyRelatedArtists).artists[:limit]:
         rec_artists.append({
-            "name": artist["name"],
-            "image_url": artist.get("images", [{}])[0].get("url"),
-            "genres": artist.get("genres", []),
+            "name": artist.name,
+            "image_url": artist.images[0].url if artist.images else None,
+            "genres": artist.genres,
             "links": {
-                "spotify": artist["external_urls"].get("spotify")
+                "spotify": artist.external_urls.spotify
             },
             "source": "Spotify"
         })
 
     return rec_artists
 
-async def extract_artist_info_from_spotify(client, headers, track_title, track_artist):
-    query_text = f"{track_title} {track_artist}" if track_artist else track_title
-    resp = await client.get("https://api.spotify.com/v1/search", headers=headers, params={"q": query_text, "type": "track", "limit": 1})
-    items = resp.json().get("tracks", {}).get("items", [])
-    if not items and track_artist:
-        strict_q = f'track:"{track_title}" artist:"{track_artist}"'
-        resp = await client.get("https://api.spotify.com/v1/search", headers=headers, params={"q": strict_q, "type": "track", "limit": 1})
-        items = resp.json().get("tracks", {}).get("items", [])
+async def search_spotify_seed(client, headers, query):
+    """(artist_id, artist_name) of the top track hit for `query`, or None."""
+    resp = await client.get("https://api.spotify.com/v1/search", headers=headers, params={"q": query, "type": "track", "limit": 1})
+    items = decode(resp, SpotifyTrackSearch).tracks.items
     if not items:
-        raise ValueError("Spotify track not found")
-    return items[0]["artists"][0]["id"], items[0]["artists"][0]["name"]
+        return None
+    return items[0].artists[0].id, items[0].artists[0].name
 
 
-async def fetch_spotify_tracks_and_metadata(client, headers, artist_id, artist_name, limit=20, offset=0):
-    result = {"artist_metadata": {}, "tracks": []}
-
-    # Fetch artist metadata
+@cached("spotify_artist_metadata")
+async def fetch_spotify_artist_metadata(client, headers, artist_id, artist_name):
     artist_info = await client.get(f"https://api.spotify.com/v1/artists/{artist_id}", headers=headers)
-    artist_json = artist_info.json()
-    
-    spotify_url = artist_json.get("external_urls", {}).get("spotify")
+    artist = decode(artist_info, SpotifyArtistInfo)
+
+    spotify_url = artist.external_urls.spotify
 
     # Optional enrichment using artist name
     deezer_url = f"https://www.deezer.com/search/{quote(artist_name)}"
     lastfm_url = f"https://www.last.fm/music/{quote(artist_name)}"
     soundcloud_url = f"https://soundcloud.com/search?q={quote(artist_name)}"
 
-    result["artist_metadata"] = {
+    return {
         "name": artist_name,
-        "image_url": artist_json.get("images", [{}])[0].get("url"),
-        "genres": artist_json.get("genres", []),
+        "image_url": artist.images[0].url if artist.images else None,
+        "genres": artist.genres,
         "spotify_url": spotify_url,
         "deezer_url": deezer_url,
         "lastfm_url": lastfm_url,
@@ -56,45 +61,48 @@ async def fetch_spotify_tracks_and_metadata(client, headers, artist_id, artist_n
         # "official_website": extract_if_you_have  # Optional
     }
 
-    tracks = []
 
-    # Fetch top tracks of the main artist
-    top_resp = await client.get(
+def _to_track(t):
+    return Track(
+        t.name,
+        t.artists[0].name,
+        duration_ms=t.duration_ms,
+        cover_url=t.album.images[0].url if t.album.images else None,
+        preview_url=t.preview_url,
+        spotify_url=t.external_urls.spotify,
+        sources=SPOTIFY,
+    )
+
+
+@cached("spotify_top_tracks", encode=pack_tracks, decode=unpack_tracks)
+async def _spotify_top_tracks(client, headers, artist_id):
+    resp = await client.get(
         f"https://api.spotify.com/v1/artists/{artist_id}/top-tracks",
         headers=headers,
         params={"market": "US"}
     )
-    tracks += top_resp.json().get("tracks", [])
+    return [_to_track(t) for t in decode(resp, SpotifyTopTracks).tracks]
 
-    # Fetch related artists and their top tracks
-    rel_resp = await client.get(f"https://api.spotify.com/v1/artists/{artist_id}/related-artists", headers=headers)
-    related = rel_resp.json().get("artists", [])[:10]
 
-    for rel in related:
-        rel_top = await client.get(
-            f"https://api.spotify.com/v1/artists/{rel['id']}/top-tracks",
-            headers=headers,
-            params={"market": "US"}
-        )
-        tracks += rel_top.json().get("tracks", [])[:2]
-
-    # Apply pagination manually
-    paginated_tracks = tracks[offset:offset + limit]
-
-    for t in paginated_tracks:
-        result["tracks"].append({
-            "title": t["name"],
-            "artist": t["artists"][0]["name"],
-            "duration_ms": t["duration_ms"],
-            "cover": t["album"]["images"][0]["url"] if t["album"]["images"] else None,
-            "preview_url": t.get("preview_url"),
-            "spotify_url": t["external_urls"]["spotify"],
-            "deezer_url": None,
-            "soundcloud_url": None,
-            "source": ["Spotify"]
-        })
+@cached("spotify_related_ids")
+async def _spotify_related_ids(client, headers, artist_id):
+    resp = await client.get(f"https://api.spotify.com/v1/artists/{artist_id}/related-artists", headers=headers)
+    return [a.id for a in decode(resp, SpotifyRelatedArtists).artists[:10]]
+
+
+async def iter_spotify_tracks(client, headers, artist_id, own=True):
+    """
+    The artist's top tracks (unless `own` is False), then two from each
+    related artist. Each upstream call is made only once the tracks before
+    it have been taken.
+    """
+    if own:
+        for track in await _spotify_top_tracks(client, headers, artist_id):
+            yield track
 
-    return result
+    for rel_id in await _spotify_related_ids(client, headers, artist_id):
+        for track in (await _spotify_top_tracks(client, headers, rel_id))[:2]:
+            yield track
 
 # api/services/spotify_recs.py
 import json
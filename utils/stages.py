@@ -0,0 +1,132 @@
+"""
+A small dependency-graph executor for streaming pipelines.
+
+Stages are declared in the order their events should reach the client,
+each with the stages it needs. Every stage starts as soon as its inputs
+are ready and runs in its own task, so independent stages overlap; the
+events they emit are buffered per stage and relayed stage by stage in
+declaration order, each stage's events as soon as it is at the head.
+
+A stage that raises takes its dependents down with it (they never run),
+while the rest of the graph carries on; with `on_error` set, the failed
+stage and each skipped one get an error chunk in their place in the
+stream, so the client can tell "failed" from "nothing found". Raising
+StopPipeline ends the
+whole stream once the events emitted so far by earlier stages and the
+stopping stage have been relayed. Closing the stream cancels every stage
+still running.
+"""
+import asyncio
+
+from utils.log import get_logger
+
+log = get_logger("pipeline")
+
+
+class StopPipeline(Exception):
+    pass
+
+
+class _Skipped(Exception):
+    """A stage that did not run because one of its inputs failed."""
+
+
+class _Stage:
+    __slots__ = ("name", "fn", "after", "events", "task", "changed")
+
+    def __init__(self, name, fn, after):
+        self.name = name
+        self.fn = fn
+        self.after = tuple(after)
+        self.events = []
+        self.task = None
+        self.changed = asyncio.Event()
+
+    def emit(self, chunk):
+        self.events.append(chunk)
+        self.changed.set()
+
+
+class Pipeline:
+    """
+    Declare stages with `add()` (or the `stage()` decorator), then iterate
+    `run()`. A stage function is called with its inputs' results as keyword
+    arguments, plus `emit` to send chunks downstream; what it returns is
+    the input its dependents get. `on_error(stage_name, message)` returns
+    the chunk relayed for a stage that failed or was skipped (or None).
+    """
+
+    def __init__(self, on_error=None):
+        self._stages = {}
+        self.on_error = on_error
+        # set when a stage raised StopPipeline
+        self.stopped = False
+
+    def add(self, name, fn, after=()):
+        unknown = [dep for dep in after if dep not in self._stages]
+        if unknown:
+            # declaring inputs first keeps the graph acyclic
+            raise ValueError(f"stage {name!r} depends on undeclared stage(s) {unknown}")
+        self._stages[name] = _Stage(name, fn, after)
+
+    def stage(self, name, after=()):
+        def register(fn):
+            self.add(name, fn, after)
+            return fn
+        return register
+
+    async def _run_stage(self, stage):
+        try:
+            inputs = {}
+            for dep in stage.after:
+                try:
+                    inputs[dep] = await self._stages[dep].task
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # named after the stage that actually failed, however far up
+                    raise _Skipped(e.args[0] if isinstance(e, _Skipped) else dep) from e
+            return await stage.fn(emit=stage.emit, **inputs)
+        finally:
+            # also when skipped: run() may already be waiting on this stage
+            stage.changed.set()
+
+    async def run(self):
+        stages = list(self._stages.values())
+        for stage in stages:
+            stage.task = asyncio.create_task(self._run_stage(stage), name=f"stage:{stage.name}")
+        try:
+            for stage in stages:
+                i = 0
+                while True:
+                    while i < len(stage.events):
+                        yield stage.events[i]
+                        i += 1
+                    if stage.task.done():
+                        break
+                    stage.changed.clear()
+                    await stage.changed.wait()
+                error = stage.task.exception() if not stage.task.cancelled() else None
+                if isinstance(error, StopPipeline):
+                    self.stopped = True
+                    return
+                if error is None:
+                    continue
+                if isinstance(error, _Skipped):
+                    message = f"skipped because {error.args[0]} failed"
+                else:
+                    log.warning("Stage failed", stage=stage.name, error=repr(error))
+                    message = "failed"
+                chunk = self.on_error(stage.name, message) if self.on_error is not None else None
+                if chunk is not None:
+                    yield chunk
+        finally:
+            pending = [s.task for s in stages if not s.task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            # retrieve exceptions of stages nobody waited on, so asyncio doesn't warn
+            for s in stages:
+                if s.task.done() and not s.task.cancelled():
+                    s.task.exception()
@@ -0,0 +1,88 @@
+"""
+Client-disconnect handling for SSE responses.
+
+Below ASGI spec 2.4 Starlette listens for http.disconnect itself and
+cancels the response, which throws CancelledError into the stream. From
+2.4 on it only notices on the next failed write, which can be a long way
+off while the pipeline waits on upstreams, so the stream is watched here.
+"""
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+from utils import metrics
+
+load_dotenv()
+
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "1"))
+
+metrics.describe("stream_disconnects_total", "Streams closed because the client went away")
+
+
+def _server_watches(request):
+    version = request.scope.get("asgi", {}).get("spec_version", "2.0")
+    return tuple(map(int, version.split("."))) < (2, 4)
+
+
+async def _watch(request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def _drive(stream, queue):
+    try:
+        async for chunk in stream:
+            await queue.put(("chunk", chunk))
+    except asyncio.CancelledError as e:
+        if asyncio.current_task().cancelling():
+            raise
+        # something the stream awaited was cancelled, not the stream itself
+        await queue.put(("cancelled", e))
+    except Exception as e:
+        await queue.put(("error", e))
+    else:
+        await queue.put(("done", None))
+
+
+async def cancel_on_disconnect(request, stream, endpoint):
+    """
+    Relay `stream`. If the client goes away first, `stream` is closed so
+    that everything it is awaiting (fetches, enrichment, shared work it is
+    the last subscriber of) is cancelled.
+
+    `stream` runs in a task of its own, and only that task is ever
+    cancelled here, so the response itself always ends normally and its
+    background tasks run.
+    """
+    queue = asyncio.Queue(maxsize=1)
+    driver = asyncio.create_task(_drive(stream, queue))
+    watcher = None if _server_watches(request) else asyncio.create_task(_watch(request))
+    finished = False
+    get = None
+    try:
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            waiting = {get} if watcher is None else {get, watcher}
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if get not in done:
+                # client gone: end the response quietly
+                break
+            kind, value = get.result()
+            if kind == "chunk":
+                yield value
+                continue
+            finished = True
+            if kind == "error":
+                raise value
+            break
+    finally:
+        if get is not None:
+            get.cancel()
+        if watcher is not None:
+            watcher.cancel()
+        if not finished:
+            metrics.inc("stream_disconnects_total", endpoint=endpoint)
+            driver.cancel()
+            await asyncio.wait([driver])
+            await stream.aclose()
@@ -0,0 +1,164 @@
+import sys
+
+DEFAULT_COVER_URL = "https://lastfm.freetls.fastly.net/i/u/300x300/2a96cbd8b46e442fc41c2b86b821562f.png"
+
+# Source names map to fixed bits. The order is part of the on-disk cache
+# format, so only ever append to it.
+SOURCES = (
+    "Spotify",
+    "Deezer",
+    "Last.fm",
+    "SoundCloud",
+    "original",
+    "Spotify Recommendations",
+    "Spotify Recommendations (Search-Seeded)",
+    "Spotify Search Fallback",
+    "Deezer Radio",
+    "Deezer Search",
+    "Local",
+)
+SOURCE_FLAGS = {name: 1 << i for i, name in enumerate(SOURCES)}
+
+SPOTIFY = SOURCE_FLAGS["Spotify"]
+DEEZER = SOURCE_FLAGS["Deezer"]
+LASTFM = SOURCE_FLAGS["Last.fm"]
+SOUNDCLOUD = SOURCE_FLAGS["SoundCloud"]
+ORIGINAL = SOURCE_FLAGS["original"]
+LOCAL = SOURCE_FLAGS["Local"]
+
+
+def source_names(flags):
+    return [name for name, bit in SOURCE_FLAGS.items() if flags & bit]
+
+
+def source_flags(names):
+    flags = 0
+    for name in names or ():
+        flags |= SOURCE_FLAGS[name]
+    return flags
+
+
+class Track:
+    """
+    One candidate track as it moves through the pipeline.
+
+    Built once by a provider, merged in place when another provider
+    returns the same track, and serialized with `to_dict()` at the edge.
+    List fields default to a shared empty tuple until something is added.
+    """
+
+    __slots__ = (
+        "title", "artist", "duration_ms", "cover_url", "preview_url",
+        "spotify_url", "deezer_url", "lastfm_url", "soundcloud_url",
+        "sources", "genre", "style", "year", "label", "format",
+    )
+
+    def __init__(self, title, artist, duration_ms=0, cover_url=None, preview_url=None,
+                 spotify_url=None, deezer_url=None, lastfm_url=None, soundcloud_url=None,
+                 sources=0, genre=(), style=(), year=None, label=(), format=()):
+        self.title = title
+        self.artist = sys.intern(artist)
+        self.duration_ms = duration_ms
+        self.cover_url = cover_url
+        self.preview_url = preview_url
+        self.spotify_url = spotify_url
+        self.deezer_url = deezer_url
+        self.lastfm_url = lastfm_url
+        self.soundcloud_url = soundcloud_url
+        self.sources = sources
+        self.genre = genre
+        self.style = style
+        self.year = year
+        self.label = label
+        self.format = format
+
+    def __repr__(self):
+        return f"Track({self.title!r}, {self.artist!r}, sources={source_names(self.sources)})"
+
+    @property
+    def key(self):
+        return (self.title.strip().lower(), self.artist.strip().lower())
+
+    @property
+    def source(self):
+        return source_names(self.sources)
+
+    def merge(self, other):
+        """Fill in whatever this track is missing from `other`."""
+        self.duration_ms = self.duration_ms or other.duration_ms
+        self.cover_url = self.cover_url or other.cover_url
+        self.preview_url = self.preview_url or other.preview_url
+        self.spotify_url = self.spotify_url or other.spotify_url
+        self.deezer_url = self.deezer_url or other.deezer_url
+        self.lastfm_url = self.lastfm_url or other.lastfm_url
+        self.soundcloud_url = self.soundcloud_url or other.soundcloud_url
+        self.sources |= other.sources
+        return self
+
+    def to_dict(self):
+        return {
+            "title": self.title.strip(),
+            "artist": self.artist.strip(),
+            "duration_ms": self.duration_ms or 0,
+            "cover_url": self.cover_url or DEFAULT_COVER_URL,
+            "preview_url": self.preview_url,
+            "spotify_url": self.spotify_url,
+            "deezer_url": self.deezer_url,
+            "lastfm_url": self.lastfm_url,
+            "soundcloud_url": self.soundcloud_url,
+            "source": source_names(self.sources),
+
+            # Enrichment-related fields
+            "genre": list(self.genre),
+            "style": list(self.style),
+            "year": self.year,
+            "label": list(self.label),
+            "format": list(self.format),
+        }
+
+    def to_row(self):
+        return tuple(getattr(self, name) for name in Track.__slots__)
+
+    @classmethod
+    def from_row(cls, row):
+        track = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, row):
+            setattr(track, name, value)
+        track.artist = sys.intern(track.artist)
+        return track
+
+    @classmethod
+    def from_dict(cls, t):
+        return cls(
+            t.get("title", ""),
+            t.get("artist", ""),
+            duration_ms=(
+                t.get("duration_ms")
+                or (t.get("duration_sec", 0) * 1000 if isinstance(t.get("duration_sec"), (int, float)) else 0)
+            ),
+            cover_url=t.get("cover_url") or t.get("cover"),
+            preview_url=t.get("preview_url"),
+            spotify_url=t.get("spotify_url"),
+            deezer_url=t.get("deezer_url"),
+            lastfm_url=t.get("lastfm_url"),
+            soundcloud_url=t.get("soundcloud_url"),
+            sources=source_flags(t.get("source")),
+            genre=t.get("genre", ()),
+            style=t.get("style", ()),
+            year=t.get("year"),
+            label=t.get("label", ()),
+            format=t.get("format", ()),
+        )
+
+
+def pack_tracks(value):
+    """Cache encoder for a provider result: a track list, or a dict with a "tracks" list."""
+    if isinstance(value, list):
+        return [t.to_row() for t in value]
+    return {**value, "tracks": [t.to_row() for t in value["tracks"]]}
+
+
+def unpack_tracks(value):
+    if isinstance(value, list):
+        return [Track.from_row(row) for row in value]
+    return {**value, "tracks": [Track.from_row(row) for row in value["tracks"]]}